@@ -17,11 +17,11 @@
 from __future__ import annotations
 
 import numpy as np
-import psycopg
 from typing import Optional
 
 from config.settings import settings
 from models.schemas import Question, ClusterStats
+from services.db_pool import connection
 
 
 # ── Загрузка данных из PostgreSQL ────────────────────────────────────────────
@@ -31,7 +31,7 @@ def load_all_questions(min_count: int = 5) -> list[Question]:
     Загружает все вопросы с рейтингами из таблицы feedback.
     Возвращает пустой список если вопросов меньше min_count.
     """
-    with psycopg.connect(settings.POSTGRES_URI) as conn:
+    with connection() as conn:
         rows = conn.execute(
             """
             SELECT id, thread_id, message_id, question, answer, rating, created_at
@@ -46,13 +46,13 @@ def load_all_questions(min_count: int = 5) -> list[Question]:
 
     return [
         Question(
-            id=r[0],
-            thread_id=r[1],
-            message_id=r[2],
-            question=r[3],
-            answer=r[4] or "",
-            rating=r[5],
-            created_at=str(r[6]),
+            id=r["id"],
+            thread_id=r["thread_id"],
+            message_id=r["message_id"],
+            question=r["question"],
+            answer=r["answer"] or "",
+            rating=r["rating"],
+            created_at=str(r["created_at"]),
         )
         for r in rows
     ]
@@ -63,12 +63,12 @@ def load_all_questions(min_count: int = 5) -> list[Question]:
 def embed_questions(questions: list[str]) -> np.ndarray:
     """
     Векторизует вопросы той же моделью что используется в indexer.py.
+    Модель загружается один раз на процесс (или берётся с общего сервера эмбеддингов).
     Возвращает numpy array shape (n, dim).
     """
-    from langchain_huggingface import HuggingFaceEmbeddings
+    from services.embeddings import get_embeddings
 
-    model = HuggingFaceEmbeddings(model_name=settings.EMBEDDINGS_MODEL)
-    vectors = model.embed_documents(questions)
+    vectors = get_embeddings().embed_documents(questions)
     return np.array(vectors, dtype=np.float32)
 
 
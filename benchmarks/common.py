@@ -0,0 +1,147 @@
+"""
+Общие заготовки для бенчмарков: синтетический корпус в стиле wiki/,
+детерминированная замена модели эмбеддингов и встроенный ChromaDB.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import random
+import resource
+import subprocess
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+WIKI_PATH = PROJECT_ROOT / "wiki"
+RESULTS_PATH = PROJECT_ROOT / "benchmarks" / "results"
+
+
+# ── Синтетический корпус ─────────────────────────────────────────────────────
+
+def wiki_paragraphs() -> list[str]:
+    """Абзацы из всех .txt в wiki/ — материал для синтетических документов."""
+    paragraphs = []
+    for path in sorted(WIKI_PATH.glob("*.txt")):
+        text = path.read_text(encoding="utf-8")
+        paragraphs.extend(p.strip() for p in text.split("\n\n") if p.strip())
+    return paragraphs
+
+
+def make_document(rng: random.Random, paragraphs: list[str], doc_no: int, size_bytes: int) -> str:
+    """Собирает документ ~size_bytes из случайных абзацев wiki/.
+
+    Каждый абзац получает уникальный заголовок раздела — иначе одинаковые
+    абзацы в разных файлах попадали бы в кэш эмбеддингов и искажали замер.
+    """
+    parts = [f"Документ {doc_no}"]
+    size = 0
+    section = 0
+    while size < size_bytes:
+        section += 1
+        part = f"Раздел {doc_no}.{section}\n{rng.choice(paragraphs)}"
+        parts.append(part)
+        size += len(part.encode("utf-8")) + 2
+    return "\n\n".join(parts)
+
+
+def build_corpus(folder: Path, n_files: int, file_kb: int, seed: int = 42) -> list[Path]:
+    """Создаёт n_files документов по ~file_kb КБ в folder (по 100 файлов в подпапке)."""
+    rng = random.Random(seed)
+    paragraphs = wiki_paragraphs()
+    files = []
+    for i in range(n_files):
+        path = folder / f"part_{i // 100:03d}" / f"doc_{i:05d}.txt"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(make_document(rng, paragraphs, i, file_kb * 1024), encoding="utf-8")
+        files.append(path)
+    return files
+
+
+def edit_files(files: list[Path], ratio: float, seed: int = 7) -> list[Path]:
+    """Правит ratio файлов: меняет один абзац и добавляет новый в конец."""
+    rng = random.Random(seed)
+    paragraphs = wiki_paragraphs()
+    edited = rng.sample(files, max(1, int(len(files) * ratio))) if files and ratio > 0 else []
+    for n, path in enumerate(edited):
+        parts = path.read_text(encoding="utf-8").split("\n\n")
+        k = rng.randrange(1, len(parts)) if len(parts) > 1 else 0
+        parts[k] = f"Правка {n}.{k}\n{rng.choice(paragraphs)}"
+        parts.append(f"Дополнение {n}\n{rng.choice(paragraphs)}")
+        path.write_text("\n\n".join(parts), encoding="utf-8")
+    return edited
+
+
+# ── Замены внешних зависимостей ──────────────────────────────────────────────
+
+class HashEmbeddings:
+    """Детерминированная замена HuggingFaceEmbeddings без загрузки весов.
+
+    Вектор — нормированный гауссов шум с seed из MD5 текста: одинаковый текст
+    даёт одинаковый вектор, разные тексты — почти ортогональные.
+    """
+
+    def __init__(self, dim: int = 768):
+        self.dim = dim
+
+    def _vector(self, text: str) -> list[float]:
+        seed = int(hashlib.md5(text.encode("utf-8")).hexdigest()[:16], 16)
+        v = np.random.default_rng(seed).standard_normal(self.dim).astype(np.float32)
+        return (v / np.linalg.norm(v)).tolist()
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return [self._vector(t) for t in texts]
+
+    def embed_query(self, text: str) -> list[float]:
+        return self._vector(text)
+
+
+def ephemeral_collection(name: str):
+    """Коллекция во встроенном in-memory ChromaDB — без сервера и сети."""
+    import chromadb
+
+    client = chromadb.EphemeralClient()
+    collection = client.get_or_create_collection(
+        name=name,
+        metadata={"hnsw:space": "cosine"},
+    )
+    return client, collection
+
+
+# ── Метрики и результаты ─────────────────────────────────────────────────────
+
+def peak_rss_mb() -> dict[str, float]:
+    """Пиковый RSS процесса и его дочерних процессов, МБ (ru_maxrss в Linux — в КБ)."""
+    return {
+        "self": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "children": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024,
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=PROJECT_ROOT, text=True,
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def write_result(name: str, result: dict, out: Path = None) -> Path:
+    """Сохраняет результат в JSON: по умолчанию benchmarks/results/<name>_<commit>_<время>.json."""
+    commit = git_commit()
+    result = {
+        "benchmark": name,
+        "commit": commit,
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        **result,
+    }
+    if out is None:
+        stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        out = RESULTS_PATH / f"{name}_{commit}_{stamp}.json"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(result, ensure_ascii=False, indent=2), encoding="utf-8")
+    return out
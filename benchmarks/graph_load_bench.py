@@ -0,0 +1,233 @@
+"""
+Нагрузочный бенчмарк графа: синхронный (invoke в потоках) против async (ainvoke в одном event loop).
+
+Что делает:
+  1. Собирает граф из build_workflow() — те же узлы и рёбра, что в build_graph() / abuild_graph(),
+     checkpointer — InMemorySaver (PostgreSQL в замере не участвует)
+  2. Подменяет LLM моделью-заглушкой с задержкой --llm-ms (time.sleep в invoke,
+     asyncio.sleep в ainvoke), а поиск — заглушкой batch_search / abatch_search
+     с задержкой --retrieval-ms. Сходство чанков между порогами grader, поэтому ход —
+     это query → retrieve → grader (LLM) → answer: три вызова LLM
+  3. Для каждого числа одновременных диалогов из --concurrency прогоняет --turns ходов
+     на диалог: sync — поток на диалог (как сессии Streamlit) или пул --threads,
+     async — asyncio.gather в одном потоке
+  4. По каждому прогону: время, ходов в секунду, задержка хода p50 / p95,
+     пик потоков ОС и прирост RSS
+
+Запуск:
+    python -m benchmarks.graph_load_bench
+    python -m benchmarks.graph_load_bench --concurrency 10,100,300,1000 --llm-ms 800 --threads 64
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import logging
+import resource
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+from benchmarks.common import write_result
+
+_ANSWER = "Согласно регламенту, заявка согласуется руководителем и отделом кадров в течение трёх рабочих дней."
+_CHUNK = "Заявка на отпуск подаётся через портал не позднее чем за две недели. " * 8
+
+
+class SleepyChatModel(BaseChatModel):
+    """LLM-заглушка: ответ через latency секунд, без сети."""
+
+    latency: float
+    tools: bool = False
+
+    @property
+    def _llm_type(self) -> str:
+        return "sleepy"
+
+    def bind_tools(self, tools, **kwargs):
+        return self.model_copy(update={"tools": True})
+
+    def reply(self, messages) -> ChatResult:
+        last = messages[-1]
+        if self.tools:
+            message = AIMessage(content="", tool_calls=[
+                {"name": "retrieve_docs", "args": {"query": "отпуск заявка"}, "id": uuid.uuid4().hex},
+            ])
+        elif str(last.content).startswith("Оцени релевантность"):
+            message = AIMessage(content="yes")
+        else:
+            message = AIMessage(content=_ANSWER)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        time.sleep(self.latency)
+        return self.reply(messages)
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        await asyncio.sleep(self.latency)
+        return self.reply(messages)
+
+
+def patch_graph(llm_s: float, retrieval_s: float):
+    """Подменяет модели и поиск в модулях узлов."""
+    from config.settings import settings
+    from graph.nodes import grader, query, retriever
+    from models.schemas import RetrievedChunks
+
+    model = SleepyChatModel(latency=llm_s)
+    query.get_response_model = lambda: model
+    grader.get_grader_model = lambda: model
+
+    # Между GRADER_REJECT_SCORE и GRADER_ACCEPT_SCORE — решает LLM
+    score = (settings.GRADER_ACCEPT_SCORE + settings.GRADER_REJECT_SCORE) / 2
+
+    def found(queries):
+        return [RetrievedChunks([_CHUNK] * settings.RETRIEVER_K, [score] * settings.RETRIEVER_K) for _ in queries]
+
+    def batch_search(queries):
+        time.sleep(retrieval_s)
+        return found(queries)
+
+    async def abatch_search(queries):
+        await asyncio.sleep(retrieval_s)
+        return found(queries)
+
+    retriever.batch_search = batch_search
+    retriever.abatch_search = abatch_search
+
+
+class ThreadPeak:
+    """Пик threading.active_count() за время прогона."""
+
+    def __init__(self):
+        self.peak = threading.active_count()
+        self.stop = threading.Event()
+        self.thread = threading.Thread(target=self.sample, daemon=True)
+
+    def sample(self):
+        while not self.stop.wait(0.01):
+            self.peak = max(self.peak, threading.active_count())
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop.set()
+        self.thread.join()
+
+
+def rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def summary(mode: str, conversations: int, turns: int, latencies: list[float], seconds: float,
+            peak_threads: int, rss_before: float) -> dict:
+    return {
+        "mode": mode,
+        "conversations": conversations,
+        "turns": len(latencies),
+        "seconds": round(seconds, 2),
+        "turns_per_s": round(len(latencies) / seconds, 1),
+        "turn_ms_p50": round(float(np.percentile(latencies, 50)), 1),
+        "turn_ms_p95": round(float(np.percentile(latencies, 95)), 1),
+        "peak_threads": peak_threads,
+        "rss_growth_mb": round(rss_mb() - rss_before, 1),
+    }
+
+
+def run_sync(graph, conversations: int, turns: int, threads: int) -> dict:
+    from langchain_core.messages import HumanMessage
+
+    def conversation(_):
+        config = {"configurable": {"thread_id": uuid.uuid4().hex}}
+        latencies = []
+        for t in range(turns):
+            started = time.perf_counter()
+            graph.invoke({"messages": [HumanMessage(content=f"Как оформить отпуск? ({t})")]}, config=config)
+            latencies.append((time.perf_counter() - started) * 1000)
+        return latencies
+
+    rss_before = rss_mb()
+    started = time.perf_counter()
+    with ThreadPeak() as peak, ThreadPoolExecutor(max_workers=threads or conversations) as pool:
+        latencies = [ms for conv in pool.map(conversation, range(conversations)) for ms in conv]
+    return summary("sync", conversations, turns, latencies, time.perf_counter() - started, peak.peak, rss_before)
+
+
+def run_async(graph, conversations: int, turns: int) -> dict:
+    from langchain_core.messages import HumanMessage
+
+    async def conversation():
+        config = {"configurable": {"thread_id": uuid.uuid4().hex}}
+        latencies = []
+        for t in range(turns):
+            started = time.perf_counter()
+            await graph.ainvoke({"messages": [HumanMessage(content=f"Как оформить отпуск? ({t})")]}, config=config)
+            latencies.append((time.perf_counter() - started) * 1000)
+        return latencies
+
+    async def main():
+        return await asyncio.gather(*(conversation() for _ in range(conversations)))
+
+    rss_before = rss_mb()
+    started = time.perf_counter()
+    with ThreadPeak() as peak:
+        latencies = [ms for conv in asyncio.run(main()) for ms in conv]
+    return summary("async", conversations, turns, latencies, time.perf_counter() - started, peak.peak, rss_before)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный бенчмарк: sync-граф против async-графа")
+    parser.add_argument("--concurrency", default="10,100,300", help="Одновременных диалогов, через запятую")
+    parser.add_argument("--turns", type=int, default=2, help="Ходов на диалог")
+    parser.add_argument("--llm-ms", type=float, default=500.0, help="Задержка одного вызова LLM, мс")
+    parser.add_argument("--retrieval-ms", type=float, default=50.0, help="Задержка поиска, мс")
+    parser.add_argument("--threads", type=int, default=0,
+                        help="Потоков для sync-графа; 0 — поток на диалог, как сессии Streamlit")
+    parser.add_argument("--verbose", action="store_true", help="Оставить отладочный журнал узлов")
+    parser.add_argument("--out", type=Path, default=None, help="Куда записать JSON")
+    args = parser.parse_args()
+
+    from langgraph.checkpoint.memory import InMemorySaver
+    from graph.builder import build_workflow
+
+    patch_graph(args.llm_ms / 1000, args.retrieval_ms / 1000)
+    if not args.verbose:
+        # Запись каждого шага в консоль и debug.log при сотнях диалогов упирается в CPU
+        for name in ("generate_query", "retriever", "grader", "answer", "rewriter", "summarizer"):
+            logging.getLogger(name).setLevel(logging.WARNING)
+    graph = build_workflow().compile(checkpointer=InMemorySaver())
+
+    runs = []
+    for conversations in [int(c) for c in args.concurrency.split(",")]:
+        for run in (run_sync(graph, conversations, args.turns, args.threads),
+                    run_async(graph, conversations, args.turns)):
+            runs.append(run)
+            print(f"{run['mode']:>5} × {conversations:<5} {run['seconds']} с, {run['turns_per_s']} ходов/с, "
+                  f"ход p50 {run['turn_ms_p50']} мс / p95 {run['turn_ms_p95']} мс, "
+                  f"потоков {run['peak_threads']}, RSS +{run['rss_growth_mb']} МБ")
+
+    result = {
+        "params": {
+            "turns": args.turns,
+            "llm_ms": args.llm_ms,
+            "retrieval_ms": args.retrieval_ms,
+            "threads": args.threads,
+        },
+        "runs": runs,
+    }
+    out = write_result("graph_load", result, args.out)
+    print(f"Результат: {out}")
+
+
+if __name__ == "__main__":
+    main()
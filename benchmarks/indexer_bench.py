@@ -0,0 +1,131 @@
+"""
+Бенчмарк пропускной способности services/indexer.py.
+
+Что делает:
+  1. Собирает синтетический корпус из абзацев wiki/ (--files × --file-kb)
+  2. Индексирует его с нуля во встроенный ChromaDB (EphemeralClient)
+  3. Правит --edit-ratio файлов и индексирует повторно (инкрементальный путь)
+  4. Повторяет запуск без изменений (stat fast path)
+
+Модель эмбеддингов по умолчанию заменена детерминированной HashEmbeddings —
+замер показывает накладные расходы конвейера. С --real-model используется
+EMBEDDINGS_MODEL из настроек.
+
+По каждой фазе: файлы/сек, чанки/сек, пиковый RSS, время стадий
+hash / split / embed / upsert. Результат пишется в JSON для сравнения коммитов.
+
+Запуск:
+    python -m benchmarks.indexer_bench --files 500 --file-kb 20
+    python -m benchmarks.indexer_bench --files 50 --real-model --out /tmp/indexer.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import tempfile
+import time
+import uuid
+from pathlib import Path
+
+from benchmarks.common import (
+    HashEmbeddings,
+    build_corpus,
+    edit_files,
+    ephemeral_collection,
+    peak_rss_mb,
+    write_result,
+)
+
+
+def run_phase(indexer, name: str, n_files: int) -> dict:
+    """Один запуск indexer.run() с замером времени и стадий."""
+    stages_before = dict(indexer.STAGE_SECONDS)
+    started = time.perf_counter()
+    n_chunks = indexer.run()
+    elapsed = time.perf_counter() - started
+
+    stages = {
+        stage: round(seconds - stages_before.get(stage, 0.0), 3)
+        for stage, seconds in indexer.STAGE_SECONDS.items()
+    }
+    return {
+        "phase": name,
+        "files": n_files,
+        "chunks": n_chunks,
+        "seconds": round(elapsed, 3),
+        "files_per_sec": round(n_files / elapsed, 2) if elapsed > 0 else None,
+        "chunks_per_sec": round(n_chunks / elapsed, 2) if elapsed > 0 else None,
+        "stage_seconds": stages,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк services/indexer.py")
+    parser.add_argument("--files", type=int, default=200, help="Число файлов в корпусе")
+    parser.add_argument("--file-kb", type=int, default=20, help="Размер файла, КБ")
+    parser.add_argument("--edit-ratio", type=float, default=0.1, help="Доля файлов, правящихся во второй фазе")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--dim", type=int, default=768, help="Размерность HashEmbeddings")
+    parser.add_argument("--real-model", action="store_true", help="Настоящая модель EMBEDDINGS_MODEL")
+    parser.add_argument("--out", type=Path, default=None, help="Куда записать JSON")
+    args = parser.parse_args()
+
+    workdir = Path(tempfile.mkdtemp(prefix="indexer_bench_"))
+    corpus = workdir / "corpus"
+
+    # Настройки читаются при импорте, а дочерние процессы нарезки наследуют окружение
+    os.environ["FOLDER_PATH"] = str(corpus)
+    os.environ["INDEX_MANIFEST_FILE"] = str(workdir / "manifest.sqlite")
+    os.environ["INDEX_STATE_FILE"] = str(workdir / "index_state.json")
+    os.environ["EMBEDDING_CACHE_FILE"] = str(workdir / "embedding_cache.sqlite")
+    os.environ["LEXICAL_INDEX_FILE"] = str(workdir / "lexical_index.sqlite")
+    os.environ["INDEX_VERSION_FILE"] = str(workdir / "index_version")
+    os.environ["SNAPSHOT_EXPORT"] = "false"
+    os.environ["ROUTING_INDEX"] = "false"
+
+    from services import indexer
+
+    _, collection = ephemeral_collection(f"bench_{uuid.uuid4().hex[:8]}")
+    indexer.get_chroma_collection = lambda: (None, collection)
+    if not args.real_model:
+        embeddings = HashEmbeddings(dim=args.dim)
+        indexer.get_embeddings_model = lambda: embeddings
+
+    files = build_corpus(corpus, args.files, args.file_kb, seed=args.seed)
+    corpus_mb = sum(f.stat().st_size for f in files) / 2**20
+    print(f"Корпус: {len(files)} файлов, {corpus_mb:.1f} МБ → {workdir}")
+
+    phases = [run_phase(indexer, "full", len(files))]
+
+    edited = edit_files(files, args.edit_ratio, seed=args.seed + 1)
+    phases.append(run_phase(indexer, "edit", len(edited)))
+
+    phases.append(run_phase(indexer, "noop", 0))
+
+    result = {
+        "params": {
+            "files": args.files,
+            "file_kb": args.file_kb,
+            "corpus_mb": round(corpus_mb, 2),
+            "edit_ratio": args.edit_ratio,
+            "seed": args.seed,
+            "embeddings": indexer.EMBEDDINGS_MODEL if args.real_model else f"HashEmbeddings({args.dim})",
+            "split_workers": indexer.SPLIT_WORKERS,
+            "embed_batch_size": indexer.EMBED_BATCH_SIZE,
+            "upsert_workers": indexer.UPSERT_WORKERS,
+        },
+        "phases": phases,
+    }
+    out = write_result("indexer", result, args.out)
+
+    for p in phases:
+        print(f"{p['phase']:>5}: {p['files']} файлов, {p['chunks']} чанков за {p['seconds']} с "
+              f"({p['files_per_sec']} файлов/сек, {p['chunks_per_sec']} чанков/сек), "
+              f"стадии {p['stage_seconds']}")
+    print(f"Результат: {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+"""
+Бенчмарк переранжирования кросс-энкодером (services/reranker.py).
+
+Что делает:
+  1. Режет wiki/ на чанки с параметрами индексатора и кладёт их во встроенный ChromaDB
+  2. Строит набор запросов: по фразе из случайного чанка (или из --queries)
+  3. Для каждого запроса берёт RERANK_CANDIDATES кандидатов векторного поиска и
+     пересчитывает первые --depths из них кросс-энкодером
+  4. Сравнивает hit@RETRIEVER_K (нужный чанк в контексте) без переранжирования и с ним
+
+Промах hit@k в графе — это цикл grader → rewriter → query с повторным поиском:
+несколько удалённых вызовов LLM (--loop-ms, --loop-calls). Бенчмарк пересчитывает
+выигрыш hit@k в сэкономленные циклы и сравнивает с ценой переранжирования.
+
+По умолчанию эмбеддинги — HashEmbeddings (векторная выдача случайна, кросс-энкодер
+работает на худшем входе); с --real-model — EMBEDDINGS_MODEL из настроек.
+Кросс-энкодер — RERANK_MODEL или --rerank-model.
+
+Запуск:
+    python -m benchmarks.rerank_bench --rerank-model cross-encoder/mmarco-mMiniLMv2-L12-H384-v1
+    python -m benchmarks.rerank_bench --real-model --queries 200 --depths 5,10,20
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import random
+import re
+import time
+import uuid
+from pathlib import Path
+
+import numpy as np
+
+from benchmarks.common import WIKI_PATH, HashEmbeddings, ephemeral_collection, write_result
+
+# Фраза-запрос: предложение чанка не короче стольких слов
+_MIN_QUERY_WORDS = 5
+
+
+def load_chunks() -> list[tuple[str, str]]:
+    """(id, текст) чанков wiki/ — так же, как их режет indexer.py."""
+    from services import indexer
+
+    splitter = indexer.get_splitter()
+    chunks = []
+    for path in sorted(WIKI_PATH.glob("*.txt")):
+        texts = splitter.split_text(path.read_text(encoding="utf-8"))
+        chunks.extend((doc_id, text) for doc_id, text, _ in indexer.chunk_records(path, texts))
+    return chunks
+
+
+def synthetic_queries(chunks: list[tuple[str, str]], n: int, seed: int) -> list[tuple[str, str]]:
+    """(запрос, id нужного чанка): предложение из случайного чанка в нижнем регистре."""
+    rng = random.Random(seed)
+    queries = []
+    for doc_id, text in rng.sample(chunks, min(n, len(chunks))):
+        sentences = [s.strip() for s in re.split(r"[.!?\n]", text) if len(s.split()) >= _MIN_QUERY_WORDS]
+        if sentences:
+            queries.append((rng.choice(sentences).lower(), doc_id))
+    return queries
+
+
+def file_queries(path: Path, chunks: list[tuple[str, str]]) -> list[tuple[str, str]]:
+    """Запросы из JSON [{"query": ..., "expect": "фраза из нужного чанка"}]."""
+    queries = []
+    for item in json.loads(path.read_text(encoding="utf-8")):
+        doc_id = next((i for i, t in chunks if item["expect"] in t), None)
+        if doc_id is not None:
+            queries.append((item["query"], doc_id))
+    return queries
+
+
+def hit_rate(rankings: list[list[str]], expected: list[str], k: int) -> float:
+    return sum(e in r[:k] for r, e in zip(rankings, expected)) / max(len(expected), 1)
+
+
+def main():
+    from config.settings import settings
+
+    parser = argparse.ArgumentParser(description="Бенчмарк переранжирования кросс-энкодером")
+    parser.add_argument("--queries", type=int, default=100, help="Число синтетических запросов")
+    parser.add_argument("--queries-file", type=Path, default=None, help="JSON с запросами вместо синтетики")
+    parser.add_argument("--depths", default="5,10,20", help="Сколько кандидатов пересчитывать, через запятую")
+    parser.add_argument("--rerank-model", default=settings.RERANK_MODEL or None)
+    parser.add_argument("--real-model", action="store_true", help="Настоящая модель EMBEDDINGS_MODEL")
+    parser.add_argument("--loop-ms", type=float, default=4000.0,
+                        help="Цена одного цикла grader → rewriter → query → retrieve, мс")
+    parser.add_argument("--loop-calls", type=int, default=3, help="Вызовов LLM в одном цикле")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--out", type=Path, default=None, help="Куда записать JSON")
+    args = parser.parse_args()
+    if not args.rerank_model:
+        parser.error("нужен --rerank-model или RERANK_MODEL")
+
+    from services.reranker import CrossEncoderReranker
+
+    k = settings.RETRIEVER_K
+    depths = sorted(int(d) for d in args.depths.split(","))
+    n_candidates = max(depths)
+
+    chunks = load_chunks()
+    queries = (file_queries(args.queries_file, chunks) if args.queries_file
+               else synthetic_queries(chunks, args.queries, args.seed))
+    print(f"Чанков: {len(chunks)}, запросов: {len(queries)}")
+
+    if args.real_model:
+        from services.embeddings import get_embeddings
+        embeddings = get_embeddings()
+    else:
+        embeddings = HashEmbeddings()
+
+    _, collection = ephemeral_collection(f"rerank_{uuid.uuid4().hex[:8]}")
+    vectors = embeddings.embed_documents([t for _, t in chunks])
+    for start in range(0, len(chunks), 1000):
+        part = chunks[start:start + 1000]
+        collection.add(
+            ids=[i for i, _ in part], documents=[t for _, t in part],
+            embeddings=vectors[start:start + len(part)],
+        )
+
+    query_texts = [q for q, _ in queries]
+    expected = [e for _, e in queries]
+    dense = collection.query(
+        query_embeddings=embeddings.embed_documents(query_texts),
+        n_results=n_candidates, include=["documents"],
+    )
+    baseline = dense["ids"]
+
+    reranker = CrossEncoderReranker(args.rerank_model, settings.RERANK_MAX_LENGTH)
+    reranker.score([(query_texts[0], dense["documents"][0][0])])  # прогрев
+
+    runs = []
+    base_hits = [e in r[:k] for r, e in zip(baseline, expected)]
+    for depth in depths:
+        rankings, latencies = [], []
+        for q, ids, docs in zip(query_texts, dense["ids"], dense["documents"]):
+            started = time.perf_counter()
+            scores = reranker.score([(q, t) for t in docs[:depth]])
+            latencies.append((time.perf_counter() - started) * 1000)
+            order = np.argsort(scores)[::-1]
+            rankings.append([ids[i] for i in order] + ids[depth:])
+
+        hits = [e in r[:k] for r, e in zip(rankings, expected)]
+        avoided = sum(h and not b for h, b in zip(hits, base_hits))
+        introduced = sum(b and not h for h, b in zip(hits, base_hits))
+        per_query_saved_ms = (avoided - introduced) / len(queries) * args.loop_ms
+        runs.append({
+            "depth": depth,
+            f"hit@{k}": round(hit_rate(rankings, expected, k), 3),
+            "rerank_ms_mean": round(float(np.mean(latencies)), 1),
+            "rerank_ms_p95": round(float(np.percentile(latencies, 95)), 1),
+            "loops_avoided": avoided,
+            "loops_introduced": introduced,
+            "llm_calls_saved_per_100": round((avoided - introduced) / len(queries) * 100 * args.loop_calls, 1),
+            "net_ms_per_query": round(per_query_saved_ms - float(np.mean(latencies)), 1),
+        })
+
+    result = {
+        "params": {
+            "queries": len(queries),
+            "chunks": len(chunks),
+            "retriever_k": k,
+            "rerank_model": args.rerank_model,
+            "embeddings": settings.EMBEDDINGS_MODEL if args.real_model else "HashEmbeddings(768)",
+            "loop_ms": args.loop_ms,
+            "loop_calls": args.loop_calls,
+            "seed": args.seed,
+        },
+        f"baseline_hit@{k}": round(hit_rate(baseline, expected, k), 3),
+        f"candidates_recall@{n_candidates}": round(hit_rate(baseline, expected, n_candidates), 3),
+        "runs": runs,
+    }
+    out = write_result("rerank", result, args.out)
+
+    print(f"Без переранжирования: hit@{k}={result[f'baseline_hit@{k}']}, "
+          f"нужный чанк среди {n_candidates} кандидатов: {result[f'candidates_recall@{n_candidates}']}")
+    for r in runs:
+        print(f"глубина {r['depth']:>3}: hit@{k}={r[f'hit@{k}']}, rerank {r['rerank_ms_mean']} мс "
+              f"(p95 {r['rerank_ms_p95']}), циклов сэкономлено {r['loops_avoided']} / добавлено "
+              f"{r['loops_introduced']}, итог {r['net_ms_per_query']} мс на запрос")
+    print(f"Результат: {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+"""
+Бенчмарк двухуровневого поиска (services/routing_index.py) против плоского.
+
+Что делает:
+  1. Для каждого размера из --sizes строит синтетический корпус во встроенном ChromaDB:
+     у документа своя «тема» (случайный центр), векторы его чанков — центр плюс шум
+     (--spread). Так векторы ведут себя как эмбеддинги: чанки одного файла ближе
+     друг к другу, чем к чужим
+  2. Строит индекс маршрутизации тем же rebuild_from_collection(), что и indexer.py
+  3. Запрос — вектор случайного чанка с шумом (--query-noise); нужный ответ — этот чанк
+  4. Сравнивает плоский поиск и двухуровневый (ROUTING_DOCS из --route-docs):
+     задержку (маршрутизация + поиск чанков), hit@RETRIEVER_K и recall@k
+     относительно точного top-k (полный перебор NumPy)
+
+HashEmbeddings здесь не подходит: у него нет тематической структуры, и выбор
+документов по центроиду был бы случайным.
+
+Для ChromaDB 1.x фильтр where в query() дороже плоского HNSW-поиска: коллекция
+сначала отбирает чанки по метаданным. Поэтому выигрыш двухуровневого поиска
+ищите в hit@k на больших и «шумных» корпусах, а не в задержке; бенчмарк
+показывает обе стороны.
+
+Запуск:
+    python -m benchmarks.routing_bench
+    python -m benchmarks.routing_bench --sizes 100,1000,10000 --chunks-per-doc 20 --route-docs 5,20,50
+"""
+
+from __future__ import annotations
+
+import argparse
+import time
+import uuid
+from pathlib import Path
+
+import numpy as np
+
+from benchmarks.common import ephemeral_collection, write_result
+
+# Размер пачки add() во встроенный ChromaDB
+_ADD_BATCH = 5000
+
+
+def normalize(v: np.ndarray) -> np.ndarray:
+    return v / np.linalg.norm(v, axis=-1, keepdims=True)
+
+
+def build_corpus(collection, n_docs: int, chunks_per_doc: int, dim: int, spread: float,
+                 rng: np.random.Generator) -> np.ndarray:
+    """Кладёт n_docs × chunks_per_doc чанков в коллекцию, возвращает их векторы."""
+    centers = normalize(rng.standard_normal((n_docs, dim)).astype(np.float32))
+    noise = rng.standard_normal((n_docs, chunks_per_doc, dim)).astype(np.float32) / np.sqrt(dim)
+    vectors = normalize(centers[:, None, :] + spread * noise).reshape(-1, dim)
+
+    ids = [f"d{d}_c{c}" for d in range(n_docs) for c in range(chunks_per_doc)]
+    metadatas = [{"source": f"doc_{d:05d}.txt", "chunk_index": c}
+                 for d in range(n_docs) for c in range(chunks_per_doc)]
+    for start in range(0, len(ids), _ADD_BATCH):
+        end = start + _ADD_BATCH
+        collection.add(ids=ids[start:end], embeddings=vectors[start:end].tolist(), metadatas=metadatas[start:end])
+    return vectors
+
+
+def timed_query(collection, queries: np.ndarray, k: int, wheres=None) -> tuple[list[list[str]], list[float]]:
+    """Поиск по одному запросу за вызов, как в графе; (выдачи, задержки мс)."""
+    rankings, latencies = [], []
+    for i, q in enumerate(queries):
+        started = time.perf_counter()
+        result = collection.query(
+            query_embeddings=[q.tolist()], n_results=k, include=[],
+            where=wheres[i] if wheres is not None else None,
+        )
+        latencies.append((time.perf_counter() - started) * 1000)
+        rankings.append(result["ids"][0])
+    return rankings, latencies
+
+
+def summary(rankings: list[list[str]], latencies: list[float], expected: list[str],
+            exact: list[list[str]], k: int) -> dict:
+    return {
+        f"hit@{k}": round(sum(e in r[:k] for r, e in zip(rankings, expected)) / len(expected), 3),
+        f"recall@{k}": round(float(np.mean([len(set(r[:k]) & set(x)) / k for r, x in zip(rankings, exact)])), 3),
+        "ms_mean": round(float(np.mean(latencies)), 2),
+        "ms_p95": round(float(np.percentile(latencies, 95)), 2),
+    }
+
+
+def run_size(n_docs: int, args, k: int, route_docs: list[int]) -> dict:
+    from services import routing_index
+
+    rng = np.random.default_rng(args.seed)
+    client, collection = ephemeral_collection(f"chunks_{uuid.uuid4().hex[:8]}")
+    routing = routing_index.open_collection(client, f"routing_{uuid.uuid4().hex[:8]}")
+
+    started = time.perf_counter()
+    vectors = build_corpus(collection, n_docs, args.chunks_per_doc, args.dim, args.spread, rng)
+    load_s = time.perf_counter() - started
+    started = time.perf_counter()
+    routing_index.rebuild_from_collection(routing, collection)
+    routing_s = time.perf_counter() - started
+
+    picked = rng.choice(len(vectors), size=min(args.queries, len(vectors)), replace=False)
+    noise = rng.standard_normal((len(picked), args.dim)).astype(np.float32) / np.sqrt(args.dim)
+    queries = normalize(vectors[picked] + args.query_noise * noise)
+    expected = [f"d{i // args.chunks_per_doc}_c{i % args.chunks_per_doc}" for i in picked]
+    expected_docs = [f"doc_{i // args.chunks_per_doc:05d}.txt" for i in picked]
+
+    exact_idx = np.argsort(-(queries @ vectors.T), axis=1)[:, :k]
+    exact = [[f"d{i // args.chunks_per_doc}_c{i % args.chunks_per_doc}" for i in row] for row in exact_idx]
+
+    timed_query(collection, queries[:10], k)    # прогрев HNSW
+    flat = summary(*timed_query(collection, queries, k), expected, exact, k)
+
+    routed = []
+    for n in route_docs:
+        route_ms, wheres = [], []
+        for q in queries:
+            started = time.perf_counter()
+            docs = routing_index.route(routing, [q.tolist()], n)[0]
+            route_ms.append((time.perf_counter() - started) * 1000)
+            wheres.append({"source": {"$in": docs}})
+        rankings, search_ms = timed_query(collection, queries, k, wheres)
+        run = summary(rankings, [r + s for r, s in zip(route_ms, search_ms)], expected, exact, k)
+        run.update({
+            "routing_docs": n,
+            "route_ms_mean": round(float(np.mean(route_ms)), 2),
+            "search_ms_mean": round(float(np.mean(search_ms)), 2),
+            "doc_recall": round(
+                sum(d in w["source"]["$in"] for d, w in zip(expected_docs, wheres)) / len(expected), 3,
+            ),
+        })
+        routed.append(run)
+
+    return {
+        "docs": n_docs,
+        "chunks": len(vectors),
+        "load_s": round(load_s, 1),
+        "routing_build_s": round(routing_s, 1),
+        "flat": flat,
+        "routed": routed,
+    }
+
+
+def main():
+    from config.settings import settings
+
+    parser = argparse.ArgumentParser(description="Бенчмарк двухуровневого поиска против плоского")
+    parser.add_argument("--sizes", default="100,1000,5000", help="Число документов, через запятую")
+    parser.add_argument("--chunks-per-doc", type=int, default=20)
+    parser.add_argument("--route-docs", default="5,20", help="Значения ROUTING_DOCS, через запятую")
+    # Значения по умолчанию подобраны так, чтобы задача не была тривиальной (hit@k плоского поиска < 1)
+    parser.add_argument("--dim", type=int, default=64, help="Размерность векторов")
+    parser.add_argument("--spread", type=float, default=0.7, help="Разброс чанков вокруг темы документа")
+    parser.add_argument("--query-noise", type=float, default=1.5, help="Шум запроса относительно чанка")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--out", type=Path, default=None, help="Куда записать JSON")
+    args = parser.parse_args()
+
+    k = settings.RETRIEVER_K
+    sizes = [int(s) for s in args.sizes.split(",")]
+    route_docs = [int(n) for n in args.route_docs.split(",")]
+
+    runs = []
+    for n_docs in sizes:
+        print(f"Документов: {n_docs} × {args.chunks_per_doc} чанков …")
+        run = run_size(n_docs, args, k, route_docs)
+        runs.append(run)
+        flat = run["flat"]
+        print(f"  плоский:      hit@{k}={flat[f'hit@{k}']} recall@{k}={flat[f'recall@{k}']} "
+              f"{flat['ms_mean']} мс (p95 {flat['ms_p95']})")
+        for r in run["routed"]:
+            print(f"  ROUTING_DOCS={r['routing_docs']:<3} hit@{k}={r[f'hit@{k}']} recall@{k}={r[f'recall@{k}']} "
+                  f"{r['ms_mean']} мс (p95 {r['ms_p95']}; маршрутизация {r['route_ms_mean']} + "
+                  f"чанки {r['search_ms_mean']}), нужный документ выбран в {r['doc_recall']:.0%}")
+
+    result = {
+        "params": {
+            "chunks_per_doc": args.chunks_per_doc,
+            "dim": args.dim,
+            "spread": args.spread,
+            "query_noise": args.query_noise,
+            "queries": args.queries,
+            "retriever_k": k,
+            "seed": args.seed,
+        },
+        "runs": runs,
+    }
+    out = write_result("routing", result, args.out)
+    print(f"Результат: {out}")
+
+
+if __name__ == "__main__":
+    main()
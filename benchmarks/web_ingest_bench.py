@@ -0,0 +1,217 @@
+"""
+Бенчмарк загрузки веб-документов (services/web_ingest.py) на локальном HTTP-сервере.
+
+Что делает:
+  1. Поднимает в процессе HTTP-сервер-заглушку: --pages HTML-страниц из абзацев wiki/,
+     задержка ответа --delay-ms (сеть до внешнего сайта), ETag и Last-Modified,
+     ответ 304 на совпавший If-None-Match / If-Modified-Since
+  2. Фаза sequential — прежний путь process_web_docs.py: каждая страница скачивается
+     по очереди и режется заново, без кэша
+  3. Фазы web_ingest: cold (пустой кэш), warm (повторный старт, ничего не менялось),
+     edit (сервер поменял --edit-ratio страниц). Каждая фаза — refresh_pages()
+     и index_pages() во встроенный ChromaDB с HashEmbeddings
+  4. По каждой фазе: время, запросы, полные ответы / 304, переданные байты,
+     сколько страниц нарезано заново и сколько чанков векторизовано
+
+С --no-validators сервер не отдаёт ETag / Last-Modified: проверяется запасной путь
+по sha256 текста (страницы скачиваются, но не режутся и не векторизуются заново).
+
+Запуск:
+    python -m benchmarks.web_ingest_bench
+    python -m benchmarks.web_ingest_bench --pages 100 --delay-ms 300 --edit-ratio 0.05
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import html
+import os
+import random
+import tempfile
+import threading
+import time
+import uuid
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+from benchmarks.common import HashEmbeddings, ephemeral_collection, make_document, wiki_paragraphs, write_result
+
+
+class StandInSite:
+    """Страницы сервера-заглушки и счётчики запросов."""
+
+    def __init__(self, n_pages: int, page_kb: int, delay_ms: float, validators: bool, seed: int):
+        self.rng = random.Random(seed)
+        self.paragraphs = wiki_paragraphs()
+        self.page_kb = page_kb
+        self.delay = delay_ms / 1000
+        self.validators = validators
+        self.lock = threading.Lock()
+        self.pages: dict[str, tuple[bytes, str, str]] = {}
+        for i in range(n_pages):
+            self.publish(i, make_document(self.rng, self.paragraphs, i, page_kb * 1024))
+        self.reset_counters()
+
+    def publish(self, i: int, text: str):
+        """Новая версия страницы i: тело, ETag, Last-Modified."""
+        paragraphs = "".join(f"<p>{html.escape(p)}</p>\n" for p in text.split("\n\n"))
+        body = f"<html><head><title>Страница {i}</title></head><body>\n{paragraphs}</body></html>".encode("utf-8")
+        etag = '"' + hashlib.md5(body).hexdigest() + '"'
+        with self.lock:
+            self.pages[f"/page/{i}"] = (body, etag, formatdate(time.time(), usegmt=True))
+
+    def edit(self, ratio: float) -> int:
+        edited = self.rng.sample(range(len(self.pages)), max(1, int(len(self.pages) * ratio)))
+        for i in edited:
+            self.publish(i, make_document(self.rng, self.paragraphs, 10_000 + i, self.page_kb * 1024))
+        return len(edited)
+
+    def reset_counters(self):
+        with self.lock:
+            self.counters = {"requests": 0, "full": 0, "not_modified": 0, "bytes": 0}
+
+    def count(self, key: str, n: int = 1):
+        with self.lock:
+            self.counters[key] += n
+
+    def urls(self, base: str) -> list[str]:
+        return [f"{base}{path}" for path in self.pages]
+
+
+def make_handler(site: StandInSite):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            site.count("requests")
+            time.sleep(site.delay)
+            page = site.pages.get(self.path)
+            if page is None:
+                self.send_response(404)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            body, etag, last_modified = page
+            if site.validators and (
+                self.headers.get("If-None-Match") == etag or self.headers.get("If-Modified-Since") == last_modified
+            ):
+                site.count("not_modified")
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.end_headers()
+                return
+            site.count("full")
+            site.count("bytes", len(body))
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            if site.validators:
+                self.send_header("ETag", etag)
+                self.send_header("Last-Modified", last_modified)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+def sequential_phase(urls: list[str]) -> dict:
+    """Прежний путь: страницы по одной, каждая режется заново."""
+    import httpx
+    from services.web_ingest import html_to_text, split_text
+
+    started = time.perf_counter()
+    n_chunks = 0
+    with httpx.Client() as client:
+        for url in urls:
+            _, text = html_to_text(client.get(url).text)
+            n_chunks += len(split_text(text))
+    return {"seconds": round(time.perf_counter() - started, 2), "pages_split": len(urls), "chunks": n_chunks}
+
+
+def ingest_phase(urls: list[str], collection, embeddings: HashEmbeddings) -> dict:
+    from services import web_ingest
+
+    started = time.perf_counter()
+    pages = web_ingest.refresh_pages(urls)
+    fetched_s = time.perf_counter() - started
+    stats = web_ingest.index_pages(collection, pages, embed_documents=embeddings.embed_documents)
+    statuses: dict[str, int] = {}
+    for p in pages:
+        statuses[p.status] = statuses.get(p.status, 0) + 1
+    return {
+        "seconds": round(time.perf_counter() - started, 2),
+        "fetch_seconds": round(fetched_s, 2),
+        "statuses": statuses,
+        "pages_split": statuses.get("new", 0) + statuses.get("changed", 0),
+        "chunks_embedded": stats["embedded"],
+        "chunks_from_embedding_cache": stats["from_cache"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк services/web_ingest.py на локальном сервере")
+    parser.add_argument("--pages", type=int, default=50)
+    parser.add_argument("--page-kb", type=int, default=60, help="Размер текста страницы, КБ")
+    parser.add_argument("--delay-ms", type=float, default=200.0, help="Задержка ответа сервера, мс")
+    parser.add_argument("--edit-ratio", type=float, default=0.1, help="Доля страниц, изменённых перед фазой edit")
+    parser.add_argument("--concurrency", type=int, default=8, help="WEB_FETCH_CONCURRENCY")
+    parser.add_argument("--no-validators", action="store_true", help="Сервер без ETag / Last-Modified")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--out", type=Path, default=None, help="Куда записать JSON")
+    args = parser.parse_args()
+
+    # Настройки читаются при импорте — кэши и индексы бенчмарка во временном каталоге
+    workdir = Path(tempfile.mkdtemp(prefix="web_ingest_bench_"))
+    os.environ["WEB_CACHE_FILE"] = str(workdir / "web_cache.sqlite")
+    os.environ["WEB_FETCH_CONCURRENCY"] = str(args.concurrency)
+    os.environ["EMBEDDING_CACHE_FILE"] = str(workdir / "embedding_cache.sqlite")
+    os.environ["LEXICAL_INDEX_FILE"] = str(workdir / "lexical_index.sqlite")
+    os.environ["INDEX_VERSION_FILE"] = str(workdir / "index_version")
+    os.environ["SNAPSHOT_EXPORT"] = "false"
+    os.environ["ROUTING_INDEX"] = "false"
+
+    site = StandInSite(args.pages, args.page_kb, args.delay_ms, not args.no_validators, args.seed)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(site))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    urls = site.urls(f"http://127.0.0.1:{server.server_address[1]}")
+    print(f"Сервер-заглушка: {len(urls)} страниц по ~{args.page_kb} КБ, задержка {args.delay_ms} мс")
+
+    _, collection = ephemeral_collection(f"web_{uuid.uuid4().hex[:8]}")
+    embeddings = HashEmbeddings()
+
+    phases = {}
+    for name in ("sequential", "cold", "warm", "edit"):
+        if name == "edit":
+            print(f"Изменено страниц: {site.edit(args.edit_ratio)}")
+        site.reset_counters()
+        phase = sequential_phase(urls) if name == "sequential" else ingest_phase(urls, collection, embeddings)
+        phase.update(site.counters)
+        phases[name] = phase
+        print(f"{name:>10}: {phase['seconds']} с, запросов {phase['requests']}, полных ответов {phase['full']}, "
+              f"304 — {phase['not_modified']}, {phase['bytes'] / 2**20:.1f} МБ, "
+              f"нарезано страниц {phase['pages_split']}, векторизовано чанков {phase.get('chunks_embedded', '—')}")
+    server.shutdown()
+
+    result = {
+        "params": {
+            "pages": args.pages,
+            "page_kb": args.page_kb,
+            "delay_ms": args.delay_ms,
+            "edit_ratio": args.edit_ratio,
+            "concurrency": args.concurrency,
+            "validators": not args.no_validators,
+            "seed": args.seed,
+        },
+        "phases": phases,
+    }
+    out = write_result("web_ingest", result, args.out)
+    print(f"Результат: {out}")
+
+
+if __name__ == "__main__":
+    main()
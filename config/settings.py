@@ -21,8 +21,25 @@ class Settings(BaseSettings):
     CHROMA_PROTOCOL: str = "http"
     COLLECTION_NAME: str = "documents"
 
+    # Пул keep-alive соединений retriever.py с ChromaDB (общий на процесс)
+    CHROMA_MAX_CONNECTIONS: int = 32
+    CHROMA_MAX_KEEPALIVE: int = 16
+    CHROMA_KEEPALIVE_SECS: float = 40.0
+    CHROMA_TIMEOUT: float = 10.0        # таймаут одного запроса async-поиска, сек
+    RETRIEVER_EMBED_WORKERS: int = 4    # потоки для эмбеддинга запроса в async-поиске
+
     # Embeddings модель
     EMBEDDINGS_MODEL: str
+    EMBEDDINGS_BACKEND: str = "torch"           # torch (fp32) | onnx-int8 (services/onnx_embeddings.py)
+    ONNX_MODEL_DIR: str = "services/onnx_models"
+    EMBEDDINGS_ONNX_THREADS: int = 0            # потоки onnxruntime, 0 — по числу ядер
+
+    # Общий сервер эмбеддингов (services/embedding_server.py).
+    # Пусто — каждый процесс загружает модель сам; иначе http://host:port или unix:///path
+    EMBEDDING_SERVER_URL: str = ""
+    EMBEDDING_SERVER_MAX_BATCH: int = 64       # текстов в одном вызове модели
+    EMBEDDING_SERVER_MAX_WAIT_MS: float = 10.0 # сколько первый запрос ждёт попутчиков
+    EMBEDDING_SERVER_TIMEOUT: float = 60.0     # таймаут клиента, сек
 
     # Настройки индексатора
     FOLDER_PATH: str = "./wiki"
@@ -31,14 +48,114 @@ class Settings(BaseSettings):
     CHECK_INTERVAL: int
     INDEX_STATE_FILE: str
 
+    # Конвейер индексации: нарезка в пуле процессов → батчевые эмбеддинги → параллельный upsert
+    SPLIT_WORKERS: int = 4
+    EMBED_BATCH_SIZE: int = 256
+    UPSERT_WORKERS: int = 2
+    UPSERT_QUEUE_SIZE: int = 4
+
+    # Файлы крупнее порога (байт) режутся потоково, блоками по STREAM_READ_SIZE символов
+    STREAM_SPLIT_THRESHOLD: int = 20_000_000
+    STREAM_READ_SIZE: int = 1_000_000
+
+    # Режим --watch: пауза после последнего события ФС перед индексацией, сек
+    WATCH_DEBOUNCE: float = 2.0
+
+    # Распределённая индексация (очередь index_jobs в PostgreSQL)
+    INDEX_JOB_TIMEOUT: int = 600        # задание без heartbeat дольше — считается брошенным
+    INDEX_CLAIM_BATCH: int = 32         # сколько файлов воркер забирает за раз
+    INDEX_POLL_INTERVAL: float = 5.0    # пауза воркера при пустой очереди, сек
+    INDEX_JOB_MAX_ATTEMPTS: int = 3     # брошенное задание после стольких попыток — failed, а не снова в работу
+
+    # Кэш эмбеддингов чанков: (модель, sha256 текста) → вектор
+    EMBEDDING_CACHE_FILE: str = "services/embedding_cache.sqlite"
+
     # Файлы состояния
-    INDEX_STATE_FILE: str
+    INDEX_STATE_FILE: str               # старое JSON-состояние, переносится в манифест при первом запуске
+    INDEX_MANIFEST_FILE: str = "services/index_manifest.sqlite"
+    LEXICAL_INDEX_FILE: str = "services/lexical_index.sqlite"   # BM25-индекс чанков (FTS5)
+    INDEX_VERSION_FILE: str = "services/index_version"          # версия коллекции для кэша retriever.py
 
     # Только txt файлы!
     SUPPORTED_EXTENSIONS: str = ".txt"
     TEXT_ENCODINGS: str = "utf-8,cp1251,latin-1"
 
+    # Веб-документы (services/web_ingest.py): URL через запятую, параллельная загрузка
+    # с кэшем страниц на диске и условными запросами (ETag / Last-Modified)
+    WEB_URLS: str = (
+        "https://lilianweng.github.io/posts/2024-11-28-reward-hacking/,"
+        "https://lilianweng.github.io/posts/2024-07-07-hallucination/,"
+        "https://lilianweng.github.io/posts/2024-04-12-diffusion-video/"
+    )
+    WEB_CACHE_FILE: str = "services/web_cache.sqlite"
+    WEB_FETCH_CONCURRENCY: int = 8      # одновременных запросов
+    WEB_FETCH_TIMEOUT: float = 30.0     # сек на запрос
+
+    # Поиск: vector — только ChromaDB; hybrid — ChromaDB + BM25, слияние через RRF;
+    # snapshot — снимок коллекции через mmap в процессе (retriever_local.py), без HTTP.
+    # hybrid требует BM25-индекса (python -m services.lexical_index --rebuild) и меняет сходства для grader
+    RETRIEVAL_MODE: str = "vector"
+    RETRIEVER_K: int = 3                # сколько чанков уходит в контекст
+    HYBRID_CANDIDATES: int = 20         # глубина каждой из выдач перед слиянием
+    RRF_K: int = 60                     # сглаживающая константа reciprocal rank fusion
+
+    # Двухуровневый поиск (services/routing_index.py): сначала ROUTING_DOCS ближайших
+    # документов по центроиду их чанков, затем чанки только из них. 0 — плоский поиск
+    ROUTING_INDEX: bool = False         # indexer.py ведёт индекс маршрутизации
+    ROUTING_COLLECTION: str = "documents_routing"
+    ROUTING_DOCS: int = 0
+
+    # Переранжирование кросс-энкодером (services/reranker.py); пусто — выключено.
+    # Например, cross-encoder/mmarco-mMiniLMv2-L12-H384-v1 (мультиязычный)
+    RERANK_MODEL: str = ""
+    RERANK_CANDIDATES: int = 20         # сколько кандидатов поиска пересчитывается
+    RERANK_BUDGET_MS: float = 150.0     # бюджет задержки на ход; глубина подстраивается под него
+    RERANK_MAX_LENGTH: int = 512        # токенов в паре (запрос, чанк)
+
+    # Снимок коллекции для RETRIEVAL_MODE=snapshot (services/snapshot.py)
+    SNAPSHOT_EXPORT: bool = False       # indexer.py выгружает снимок после каждого прохода
+    SNAPSHOT_DIR: str = "services/snapshot"
+    SNAPSHOT_DTYPE: str = "int8"        # int8 | float16 | float32
+    SNAPSHOT_MIN_INTERVAL: float = 60.0 # не чаще раза в столько секунд (--watch: лишние проходы ждут), 0 — каждый проход
+
+    # Сборка контекста (services/context.py): соседние чанки файла склеиваются без
+    # перекрытия, результат укладывается в бюджет токенов промпта answer.py
+    CONTEXT_MAX_TOKENS: int = 3000      # 0 — без ограничения
+    CONTEXT_MIN_TAIL_TOKENS: int = 64   # не влезающий блок обрезается, если остаток не меньше
+    CONTEXT_TOKENIZER: str = ""         # кодировка tiktoken; пусто — по OPENAI_MODEL
+
+    # Кэш retriever.py (LRU + TTL): запрос → эмбеддинг, (эмбеддинг, k, версия коллекции) → выдача
+    RETRIEVER_CACHE_SIZE: int = 1024    # записей на каждом уровне
+    RETRIEVER_CACHE_TTL: float = 600.0  # сек
+
+    # Быстрые пути grader.py по лучшему сходству чанка с запросом (косинус; пороги зависят
+    # от модели эмбеддингов). Выше ACCEPT — ответ без LLM-проверки, ниже REJECT —
+    # сразу «в базе знаний нет», между ними — LLM. 1.01 / 0.0 — всегда спрашивать LLM
+    # (по умолчанию: пороги подбираются по журналу [grade] под свою модель эмбеддингов)
+    GRADER_ACCEPT_SCORE: float = 1.01
+    GRADER_REJECT_SCORE: float = 0.0
+
+    # Спекулятивный поиск (graph/nodes/speculative.py): поиск по вопросу пользователя идёт
+    # параллельно с вызовом LLM в query. Выдача берётся, если запрос retrieve_docs похож на вопрос —
+    # не меньше SPECULATIVE_MIN_OVERLAP его слов есть в вопросе; иначе отбрасывается
+    SPECULATIVE_RETRIEVAL: bool = False
+    SPECULATIVE_MIN_OVERLAP: float = 0.6
+    # Ответ генерируется параллельно с LLM-проверкой grader: принимается, если проверка
+    # прошла, иначе отменяется (расход токенов — в журнале [speculative])
+    SPECULATIVE_ANSWER: bool = False
+    SPECULATIVE_ANSWER_WORKERS: int = 4 # потоки спекулятивных ответов sync-графа (свой пул, не пул ретривера)
+
+    # Переформулировки веером (graph/nodes/rewriter.py): rewriter одним вызовом LLM даёт
+    # REWRITE_FANOUT вариантов вопроса, они ищутся параллельно (Send), выдачи объединяются
+    # и проверяются grader один раз. 0 — прежний цикл rewriter → query, до двух раз
+    REWRITE_FANOUT: int = 0
+
     POSTGRES_URI: str
+    # Общий пул соединений процесса (services/db_pool.py): checkpointer, фидбек, аналитика
+    POSTGRES_POOL_MIN_SIZE: int = 1
+    POSTGRES_POOL_MAX_SIZE: int = 20
+    POSTGRES_POOL_TIMEOUT: float = 30.0         # сек ожидания свободного соединения, потом PoolTimeout
+    POSTGRES_POOL_MAX_LIFETIME: float = 3600.0  # сек, после — соединение пересоздаётся
 
     COOKIE_PASSWORD: SecretStr
 
@@ -56,6 +173,10 @@ class Settings(BaseSettings):
     def extensions_set(self) -> set[str]:
         return {ext.strip() for ext in self.SUPPORTED_EXTENSIONS.split(",")}
 
+    @property
+    def web_urls_list(self) -> list[str]:
+        return [url.strip() for url in self.WEB_URLS.split(",") if url.strip()]
+
     @property
     def encodings_list(self) -> list[str]:
         return [enc.strip() for enc in self.TEXT_ENCODINGS.split(",")]
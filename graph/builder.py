@@ -1,37 +1,54 @@
 # graph/builder.py
 
 from langgraph.graph import StateGraph, START, END
-from langgraph.prebuilt import ToolNode, tools_condition
+from langchain_core.runnables import RunnableLambda
+from langgraph.prebuilt import tools_condition
 
 from graph.state import GraphState
 
 
-def build_graph(use_checkpointer: bool = False):
-    """Построить RAG граф с самокоррекцией.
+def build_workflow() -> StateGraph:
+    """Построить RAG граф с самокоррекцией (без компиляции).
 
     Структура графа:
         START → query
           ├─→ retrieve → grader
           │     ├─→ answer → should_summarize → summarizer → END
           │     │                             └─→ END
+          │     ├─→ not_found → should_summarize → ...
           │     └─→ rewriter → query
           └─→ should_summarize → summarizer → END
                               └─→ END
+
+    С REWRITE_FANOUT вместо rewriter → query:
+        rewriter ══Send══► fanout_search × N → fanout_merge → grader
+    (вариант переформулировки на задачу; отказ grader после неё — not_found).
+
+    У узлов с LLM и поиском две реализации: invoke / stream идут в синхронную,
+    ainvoke / astream — в async (ainvoke модели, AsyncHttpClient ChromaDB).
     """
-    from graph.nodes.query import generate_query_or_respond
-    from graph.nodes.grader import grade_documents
-    from graph.nodes.answer import generate_answer
-    from graph.nodes.rewriter import rewrite_question
-    from graph.nodes.retriever import retriever_tool
-    from graph.nodes.summarizer import summarize_conversation, should_summarize
+    from graph.nodes.query import generate_query_or_respond, agenerate_query_or_respond
+    from graph.nodes.grader import grade_documents, agrade_documents
+    from graph.nodes.answer import generate_answer, agenerate_answer, answer_not_found
+    from config.settings import settings
+    from graph.nodes.rewriter import rewrite_question, arewrite_question, rewrite_fanout, arewrite_fanout, send_alternatives
+    from graph.nodes.retriever import retrieve_node, aretrieve_node, fanout_search, afanout_search, fanout_merge
+    from graph.nodes.summarizer import summarize_conversation, asummarize_conversation, should_summarize
 
     workflow = StateGraph(GraphState)
 
-    workflow.add_node("query", generate_query_or_respond)
-    workflow.add_node("retrieve", ToolNode([retriever_tool]))
-    workflow.add_node("answer", generate_answer)
-    workflow.add_node("rewriter", rewrite_question)
-    workflow.add_node("summarizer", summarize_conversation)
+    workflow.add_node("query", RunnableLambda(generate_query_or_respond, afunc=agenerate_query_or_respond))
+    # Все вызовы retrieve_docs хода — одним батчем (вместо ToolNode([retriever_tool]))
+    workflow.add_node("retrieve", RunnableLambda(retrieve_node, afunc=aretrieve_node))
+    workflow.add_node("answer", RunnableLambda(generate_answer, afunc=agenerate_answer))
+    workflow.add_node("not_found", answer_not_found)
+    if settings.REWRITE_FANOUT:
+        workflow.add_node("rewriter", RunnableLambda(rewrite_fanout, afunc=arewrite_fanout))
+        workflow.add_node("fanout_search", RunnableLambda(fanout_search, afunc=afanout_search))
+        workflow.add_node("fanout_merge", fanout_merge)
+    else:
+        workflow.add_node("rewriter", RunnableLambda(rewrite_question, afunc=arewrite_question))
+    workflow.add_node("summarizer", RunnableLambda(summarize_conversation, afunc=asummarize_conversation))
 
     workflow.add_edge(START, "query")
 
@@ -45,46 +62,75 @@ def build_graph(use_checkpointer: bool = False):
         },
     )
 
-    workflow.add_conditional_edges(
-        "retrieve",
-        grade_documents,
-        {
-            "answer": "answer",
-            "rewriter": "rewriter",
-        }
-    )
+    # После поиска (и объединения вариантов в режиме REWRITE_FANOUT) — оценка
+    for node in ("retrieve", "fanout_merge") if settings.REWRITE_FANOUT else ("retrieve",):
+        workflow.add_conditional_edges(
+            node,
+            RunnableLambda(grade_documents, afunc=agrade_documents),
+            {
+                "answer": "answer",
+                "rewriter": "rewriter",
+                "not_found": "not_found",
+            }
+        )
 
-    # После answer — проверяем нужна ли суммаризация
-    workflow.add_conditional_edges(
-        "answer",
-        should_summarize,
-        {
-            "summarizer": "summarizer",
-            "__end__": END,
-        }
-    )
+    # После answer / not_found — проверяем нужна ли суммаризация
+    for node in ("answer", "not_found"):
+        workflow.add_conditional_edges(
+            node,
+            should_summarize,
+            {
+                "summarizer": "summarizer",
+                "__end__": END,
+            }
+        )
 
     workflow.add_edge("summarizer", END)
-    workflow.add_edge("rewriter", "query")
+    if settings.REWRITE_FANOUT:
+        # Поиск вариантов — параллельные задачи одного шага, объединение — после всех
+        workflow.add_conditional_edges("rewriter", send_alternatives, ["fanout_search"])
+        workflow.add_edge("fanout_search", "fanout_merge")
+    else:
+        workflow.add_edge("rewriter", "query")
+
+    return workflow
+
+
+def build_graph(use_checkpointer: bool = False):
+    """Синхронный граф: invoke / stream, checkpointer — PostgresSaver."""
+    workflow = build_workflow()
 
     # ── Checkpointer ─────────────────────────────────────────────────────────
     if use_checkpointer:
-        import psycopg
-        from psycopg.rows import dict_row
         from langgraph.checkpoint.postgres import PostgresSaver
-        from config.settings import settings
+        from services.db_pool import get_pool
 
-        conn = psycopg.connect(
-            settings.POSTGRES_URI,
-            autocommit=True,
-            row_factory=dict_row,
-        )
-        checkpointer = PostgresSaver(conn)
+        # Общий пул процесса: сессии Streamlit не ждут друг друга на одном соединении
+        checkpointer = PostgresSaver(get_pool())
         checkpointer.setup()
         return workflow.compile(checkpointer=checkpointer)
 
     return workflow.compile()
 
 
+async def abuild_graph(use_checkpointer: bool = False):
+    """Async граф: ainvoke / astream, checkpointer — AsyncPostgresSaver на AsyncConnectionPool.
+
+    Ход не держит поток ОС, пока ждёт LLM: сотни диалогов обслуживает
+    один event loop. Пул открывается в текущем loop — граф живёт в нём же.
+    """
+    workflow = build_workflow()
+
+    if use_checkpointer:
+        from langgraph.checkpoint.postgres.aio import AsyncPostgresSaver
+        from services.db_pool import open_async_pool
+
+        checkpointer = AsyncPostgresSaver(await open_async_pool())
+        await checkpointer.setup()
+        return workflow.compile(checkpointer=checkpointer)
+
+    return workflow.compile()
+
+
 # Экспорт для LangGraph Studio
 graph = build_graph(use_checkpointer=False)
\ No newline at end of file
@@ -40,9 +40,8 @@ GENERATE_PROMPT = (
 )
 
 
-def generate_answer(state: MessagesState):
-    """Сгенерировать ответ на основе найденных документов."""
-    from graph.nodes.query import get_response_model
+def answer_prompt(state: MessagesState) -> list:
+    """Промпт answer: последний вопрос пользователя и контекст последнего поиска."""
     from langchain_core.messages import HumanMessage
 
     messages = state["messages"]
@@ -59,14 +58,49 @@ def generate_answer(state: MessagesState):
         logger.debug("[answer] ToolMessage не найден — контекст пустой")
         context = messages[-1].content if messages else ""
     else:
-        context = tool_messages[-1].content
+        from graph.nodes.retriever import merged_context
+        context = merged_context(messages)
 
     logger.debug(f"[answer] генерируем ответ на: {question[:60]}")
 
-    prompt = GENERATE_PROMPT.format(question=question, context=context)
-    response_model = get_response_model()
-    response = response_model.invoke([{"role": "user", "content": prompt}])
+    return [{"role": "user", "content": GENERATE_PROMPT.format(question=question, context=context)}]
 
+
+def answer_result(response) -> dict:
     logger.debug(f"[answer] ответ сгенерирован ({len(response.content)} симв.)")
+    return {"messages": [response]}
+
+
+def generate_answer(state: MessagesState):
+    """Сгенерировать ответ на основе найденных документов."""
+    from graph.nodes import speculative
+    from graph.nodes.query import get_response_model
+
+    # Ответ, сгенерированный параллельно с grader (SPECULATIVE_ANSWER)
+    response = speculative.take_answer(state)
+    if response is None:
+        response = get_response_model().invoke(answer_prompt(state))
+    return answer_result(response)
+
+
+async def agenerate_answer(state: MessagesState):
+    from graph.nodes import speculative
+    from graph.nodes.query import get_response_model
+
+    response = await speculative.atake_answer(state)
+    if response is None:
+        response = await get_response_model().ainvoke(answer_prompt(state))
+    return answer_result(response)
+
+NOT_FOUND_ANSWER = (
+    "В базе знаний нет информации по этому вопросу. "
+    "Попробуйте переформулировать вопрос или уточнить, о каком документе или процессе идёт речь."
+)
+
+
+def answer_not_found(state: MessagesState):
+    """Ответ без LLM, когда grader по сходству решил, что в базе знаний ничего нет."""
+    from langchain_core.messages import AIMessage
 
-    return {"messages": [response]}
\ No newline at end of file
+    logger.debug("[answer] релевантных документов нет → ответ «нет в базе знаний»")
+    return {"messages": [AIMessage(content=NOT_FOUND_ANSWER)]}
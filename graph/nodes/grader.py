@@ -1,6 +1,7 @@
 # graph/nodes/grader.py
 
 import logging
+import threading
 from pathlib import Path
 from typing import Literal
 
@@ -49,6 +50,26 @@ class GradeDocuments(BaseModel):
 
 _grader_model = None
 
+# Сколько раз срабатывал каждый путь grade_documents
+_paths = {"accept": 0, "reject": 0, "llm": 0, "other": 0}
+_paths_lock = threading.Lock()
+
+
+def count_path(path: str):
+    with _paths_lock:
+        _paths[path] += 1
+        counts = dict(_paths)
+    total = sum(counts.values())
+    shares = ", ".join(f"{p}={n} ({n / total:.0%})" for p, n in counts.items())
+    logger.debug(f"[grade] путь={path}; всего: {shares}")
+
+
+def grader_stats() -> dict:
+    """Счётчики путей: accept/reject — по сходству без LLM, llm — вызов модели,
+    other — пустой контекст, лимит попыток."""
+    with _paths_lock:
+        return dict(_paths)
+
 
 def get_grader_model():
     global _grader_model
@@ -69,55 +90,130 @@ def get_grader_model():
     return _grader_model
 
 
-def grade_documents(state) -> Literal["answer", "rewriter"]:
-    """Оценка документов - используется как conditional edge."""
+def grade_prompt(state) -> tuple[str | None, str | None]:
+    """Решение без LLM: (маршрут, None); (None, промпт), если решает LLM.
+
+    По лучшему сходству чанка с запросом (артефакт ToolMessage от retriever.py):
+    >= GRADER_ACCEPT_SCORE — answer без LLM, < GRADER_REJECT_SCORE — not_found
+    без LLM и без переформулировок, между порогами — решает LLM. Если в контексте
+    есть чанк, найденный только BM25 (сходство неизвестно), not_found без LLM не выбирается.
+    """
+    from config.settings import settings
+    from graph.nodes.retriever import best_score, has_unknown_score, merged_context
+
     messages = state["messages"]
 
     if not messages:
-        return "rewriter"
+        return "rewriter", None
 
     human_messages = [m for m in messages if isinstance(m, HumanMessage)]
     if not human_messages:
-        return "rewriter"
+        return "rewriter", None
 
     question = human_messages[-1].content
 
     tool_messages = [m for m in messages if isinstance(m, ToolMessage)]
     if not tool_messages:
-        return "rewriter"
+        return "rewriter", None
 
-    context = tool_messages[-1].content
+    # Все вызовы retrieve_docs последнего хода (retrieve_node отдаёт их без повторов)
+    context = merged_context(messages)
+    score = best_score(messages)
 
     # Берём из GraphState — сбрасывается в 0 при каждом новом вопросе
     # Не зависит от длины истории в Postgres
     rewrite_count = state.get("rewrite_count", 0)
-    logger.debug(f"[grade] попытка={rewrite_count}, вопрос: {question[:60]}")
+    logger.debug(f"[grade] попытка={rewrite_count}, сходство={score}, вопрос: {question[:60]}")
 
-    if rewrite_count >= 2:
+    # С REWRITE_FANOUT выдача вариантов переформулировки проверяется (bound_route)
+    if not settings.REWRITE_FANOUT and rewrite_count >= 2:
         logger.debug("[grade] лимит попыток → generate_answer")
-        return "answer"
+        count_path("other")
+        return "answer", None
 
     if not context or len(context.strip()) < 50:
         logger.debug("[grade] пустой контекст → rewrite_question")
+        count_path("other")
+        return "rewriter", None
+
+    if score is not None and score >= settings.GRADER_ACCEPT_SCORE:
+        logger.debug(f"[grade] сходство {score} >= {settings.GRADER_ACCEPT_SCORE} → generate_answer без LLM")
+        count_path("accept")
+        return "answer", None
+
+    # Точное совпадение термина по BM25 не имеет сходства и может быть ответом — решает LLM
+    if score is not None and score < settings.GRADER_REJECT_SCORE and not has_unknown_score(messages):
+        logger.debug(f"[grade] сходство {score} < {settings.GRADER_REJECT_SCORE} → нет в базе знаний")
+        count_path("reject")
+        return "not_found", None
+
+    count_path("llm")
+
+    return None, GRADE_PROMPT_STRICT.format(question=question, context=context[:1500])
+
+
+def grade_route(response) -> Literal["answer", "rewriter"]:
+    answer = response.content.strip().lower()
+    logger.debug(f"[grade] ответ модели: '{answer}'")
+
+    if "yes" in answer:
+        logger.debug("[grade] релевантен → generate_answer")
+        return "answer"
+    else:
+        logger.debug("[grade] нерелевантен → rewrite_question")
         return "rewriter"
 
-    prompt = GRADE_PROMPT_STRICT.format(question=question, context=context[:1500])
 
+def bound_route(state, route: str) -> str:
+    """REWRITE_FANOUT: переформулировка одна — отказ после неё ведёт в not_found, а не в rewriter."""
+    from config.settings import settings
+
+    if route == "rewriter" and settings.REWRITE_FANOUT and state.get("rewrite_count", 0) >= 1:
+        logger.debug("[grade] варианты переформулировки не помогли → нет в базе знаний")
+        return "not_found"
+    return route
+
+
+def grade_documents(state) -> Literal["answer", "rewriter", "not_found"]:
+    """Оценка документов - используется как conditional edge."""
+    from graph.nodes import speculative
+
+    route, prompt = grade_prompt(state)
+    if route:
+        return bound_route(state, route)
+
+    # SPECULATIVE_ANSWER: ответ генерируется, пока модель оценивает контекст
+    answer = speculative.start_answer(state)
     try:
         grader_model = get_grader_model()
 
         # Простой вызов без with_structured_output - работает с любой моделью
-        response = grader_model.invoke([{"role": "user", "content": prompt}])
-        answer = response.content.strip().lower()
-        logger.debug(f"[grade] ответ модели: '{answer}'")
+        route = grade_route(grader_model.invoke([{"role": "user", "content": prompt}]))
 
-        if "yes" in answer:
-            logger.debug("[grade] релевантен → generate_answer")
-            return "answer"
-        else:
-            logger.debug("[grade] нерелевантен → rewrite_question")
-            return "rewriter"
+    except Exception as e:
+        logger.debug(f"[grade] ошибка: {e} → generate_answer")
+        route = "answer"
+
+    route = bound_route(state, route)
+    speculative.settle_answer(answer, route)
+    return route
+
+
+async def agrade_documents(state) -> Literal["answer", "rewriter", "not_found"]:
+    from graph.nodes import speculative
+
+    route, prompt = grade_prompt(state)
+    if route:
+        return bound_route(state, route)
+
+    answer = speculative.astart_answer(state)
+    try:
+        route = grade_route(await get_grader_model().ainvoke([{"role": "user", "content": prompt}]))
 
     except Exception as e:
         logger.debug(f"[grade] ошибка: {e} → generate_answer")
-        return "answer"
\ No newline at end of file
+        route = "answer"
+
+    route = bound_route(state, route)
+    speculative.settle_answer(answer, route)
+    return route
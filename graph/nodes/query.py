@@ -79,24 +79,17 @@ def get_response_model():
     return model
 
 
-def generate_query_or_respond(state: MessagesState):
-    """Вызвать модель для генерации ответа на основе текущего состояния.
+def query_messages(state: MessagesState) -> list:
+    return [SystemMessage(content=SYSTEM_PROMPT_WITH_EXAMPLES)] + state["messages"]
 
-    В зависимости от вопроса, модель примет решение:
-    извлечь информацию с помощью инструмента поиска или просто ответить пользователю.
-    """
-    from graph.nodes.retriever import retriever_tool
 
-    messages = [SystemMessage(content=SYSTEM_PROMPT_WITH_EXAMPLES)] + state["messages"]
+def get_tool_model():
+    from graph.nodes.retriever import retriever_tool
 
-    response_model = get_response_model()
+    return get_response_model().bind_tools([retriever_tool])
 
-    response = (
-        response_model
-        .bind_tools([retriever_tool])
-        .invoke(messages)
-    )
 
+def query_result(response) -> dict:
     tool_calls = response.tool_calls if hasattr(response, "tool_calls") and response.tool_calls else None
 
     if tool_calls:
@@ -106,4 +99,28 @@ def generate_query_or_respond(state: MessagesState):
     else:
         logger.debug("[generate_query] Tool не вызван — модель отвечает напрямую")
 
-    return {"messages": [response]}
\ No newline at end of file
+    return {"messages": [response]}
+
+
+def generate_query_or_respond(state: MessagesState):
+    """Вызвать модель для генерации ответа на основе текущего состояния.
+
+    В зависимости от вопроса, модель примет решение:
+    извлечь информацию с помощью инструмента поиска или просто ответить пользователю.
+    """
+    from graph.nodes import speculative
+
+    # SPECULATIVE_RETRIEVAL: поиск по вопросу идёт, пока модель решает
+    prefetch = speculative.start(state)
+    response = get_tool_model().invoke(query_messages(state))
+    speculative.adopt(prefetch, response)
+    return query_result(response)
+
+
+async def agenerate_query_or_respond(state: MessagesState):
+    from graph.nodes import speculative
+
+    prefetch = speculative.astart(state)
+    response = await get_tool_model().ainvoke(query_messages(state))
+    speculative.adopt(prefetch, response)
+    return query_result(response)
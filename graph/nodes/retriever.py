@@ -1,7 +1,74 @@
 # graph/nodes/retriever.py
 
+import asyncio
+import hashlib
+import logging
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from functools import lru_cache
-from langchain.tools import tool
+from pathlib import Path
+
+import numpy as np
+from langchain_core.tools import StructuredTool
+
+from models.schemas import RetrievedChunks
+
+# ---------------------------------------------------------------------------
+# Логгер — пишет одновременно в консоль и в logs/debug.log в корне проекта
+# ---------------------------------------------------------------------------
+_LOG_PATH = Path(__file__).resolve().parents[2] / "logs" / "debug.log"
+_LOG_PATH.parent.mkdir(parents=True, exist_ok=True)
+
+logger = logging.getLogger("retriever")
+if not logger.handlers:
+    logger.setLevel(logging.DEBUG)
+
+    _fmt = logging.Formatter("%(asctime)s [%(name)s] %(message)s", datefmt="%Y-%m-%d %H:%M:%S")
+
+    _fh = logging.FileHandler(_LOG_PATH, encoding="utf-8")
+    _fh.setFormatter(_fmt)
+    logger.addHandler(_fh)
+
+    _ch = logging.StreamHandler()
+    _ch.setFormatter(_fmt)
+    logger.addHandler(_ch)
+
+# ---------------------------------------------------------------------------
+
+
+def chroma_client_settings():
+    """Пул keep-alive соединений с ChromaDB: один на процесс (sync) или на event loop (async)."""
+    from chromadb.config import Settings as ChromaSettings
+    from config.settings import settings
+
+    return ChromaSettings(
+        chroma_http_max_connections=settings.CHROMA_MAX_CONNECTIONS,
+        chroma_http_max_keepalive_connections=settings.CHROMA_MAX_KEEPALIVE,
+        chroma_http_keepalive_secs=settings.CHROMA_KEEPALIVE_SECS,
+    )
+
+
+@lru_cache(maxsize=1)
+def get_chroma_client():
+    """HTTP-клиент ChromaDB с пулом соединений, один на процесс."""
+    import chromadb
+    from config.settings import settings
+
+    return chromadb.HttpClient(
+        host=settings.CHROMA_HOST,
+        port=int(settings.CHROMA_PORT),
+        settings=chroma_client_settings(),
+    )
+
+
+@lru_cache(maxsize=1)
+def get_collection():
+    """Коллекция ChromaDB без LangChain-обёртки — для multi-query запросов batch_search()."""
+    from config.settings import settings
+    return get_chroma_client().get_collection(settings.COLLECTION_NAME, embedding_function=None)
 
 
 @lru_cache(maxsize=1)
@@ -10,18 +77,14 @@ def get_vectorstore():
 
     Инициализируется один раз при первом вызове, затем кэшируется.
     """
-    import chromadb
     from langchain_chroma import Chroma
-    from langchain_huggingface import HuggingFaceEmbeddings
     from config.settings import settings
+    from services.embeddings import get_embeddings
 
-    client = chromadb.HttpClient(
-        host=settings.CHROMA_HOST,
-        port=int(settings.CHROMA_PORT),
-    )
+    client = get_chroma_client()
 
-    # Та же модель эмбеддингов, что использует indexer.py
-    embeddings = HuggingFaceEmbeddings(model_name=settings.EMBEDDINGS_MODEL)
+    # Та же модель эмбеддингов, что использует indexer.py (общий сервер, если задан EMBEDDING_SERVER_URL)
+    embeddings = get_embeddings()
 
     vectorstore = Chroma(
         client=client,
@@ -33,12 +96,798 @@ def get_vectorstore():
 
 
 @lru_cache(maxsize=1)
-def get_retriever():
-    return get_vectorstore().as_retriever(search_kwargs={"k": 3})
+def get_routing_collection():
+    """Индекс маршрутизации ROUTING_COLLECTION (services/routing_index.py): вектор на документ."""
+    from config.settings import settings
+    return get_chroma_client().get_collection(settings.ROUTING_COLLECTION, embedding_function=None)
+
+
+# httpx-пул async-клиента привязан к event loop — клиент и коллекции свои для каждого цикла
+_async_collections: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+
+
+async def get_async_collection(name: str | None = None):
+    """Коллекция ChromaDB для async-поиска (chromadb.AsyncHttpClient), одна на event loop.
+
+    По умолчанию — COLLECTION_NAME.
+    """
+    import chromadb
+    from config.settings import settings
+
+    name = name or settings.COLLECTION_NAME
+    loop = asyncio.get_running_loop()
+    collections = _async_collections.setdefault(loop, {})
+    if name not in collections:
+        if "client" not in collections:
+            collections["client"] = await with_timeout(chromadb.AsyncHttpClient(
+                host=settings.CHROMA_HOST,
+                port=int(settings.CHROMA_PORT),
+                settings=chroma_client_settings(),
+            ))
+        collections[name] = await with_timeout(collections["client"].get_collection(name, embedding_function=None))
+    return collections[name]
+
+
+async def with_timeout(awaitable):
+    """Ожидание запроса к ChromaDB не дольше CHROMA_TIMEOUT."""
+    from config.settings import settings
+    return await asyncio.wait_for(awaitable, timeout=settings.CHROMA_TIMEOUT)
+
+
+@lru_cache(maxsize=1)
+def get_executor() -> ThreadPoolExecutor:
+    """Потоки async-поиска для блокирующих шагов: эмбеддинг запроса, BM25, снимок."""
+    from config.settings import settings
+    return ThreadPoolExecutor(max_workers=settings.RETRIEVER_EMBED_WORKERS, thread_name_prefix="retriever")
+
+
+async def run_blocking(func, *args):
+    return await asyncio.get_running_loop().run_in_executor(get_executor(), func, *args)
+
+
+# ── Кэш ──────────────────────────────────────────────────────────────────────
+
+class LRUTTLCache:
+    """Ограниченный LRU-кэш с временем жизни записей и счётчиками попаданий."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or item[0] < time.monotonic():
+                if item is not None:
+                    del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def pop(self, key):
+        """Забрать запись (None — нет или истекла); в счётчики не входит."""
+        with self._lock:
+            item = self._data.pop(key, None)
+        if item is None or item[0] < time.monotonic():
+            return None
+        return item[1]
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            }
+
+
+@lru_cache(maxsize=1)
+def get_caches() -> tuple[LRUTTLCache, LRUTTLCache]:
+    """(запрос → эмбеддинг, (эмбеддинг, k, версия коллекции) → выдача)."""
+    from config.settings import settings
+    return (
+        LRUTTLCache(settings.RETRIEVER_CACHE_SIZE, settings.RETRIEVER_CACHE_TTL),
+        LRUTTLCache(settings.RETRIEVER_CACHE_SIZE, settings.RETRIEVER_CACHE_TTL),
+    )
+
+
+def cache_stats() -> dict:
+    """Статистика попаданий по уровням кэша."""
+    embedding_cache, result_cache = get_caches()
+    return {"embedding": embedding_cache.stats(), "results": result_cache.stats()}
+
+
+def normalize_query(query: str) -> str:
+    """Нормализация для ключа кэша: регистр, ё → е, пробелы.
+
+    Только ключ: в модель эмбеддингов, BM25 и кросс-энкодер уходит исходный текст
+    (у запросов с одним ключом — текст первого из них).
+    """
+    return " ".join(query.lower().replace("ё", "е").split())
+
+
+def vector_key(embedding: list[float]) -> str:
+    return hashlib.blake2b(np.asarray(embedding, dtype=np.float32).tobytes(), digest_size=16).hexdigest()
+
+
+# ── Поиск ────────────────────────────────────────────────────────────────────
+
+def embed_query(text: str) -> list[float]:
+    from services.embeddings import get_embeddings
+    return get_embeddings().embed_query(text)
+
+
+def embed_queries(texts: list[str]) -> list[list[float]]:
+    """Эмбеддинги нескольких запросов одним вызовом модели.
+
+    У всех бэкендов services/embeddings.py embed_query(t) == embed_documents([t])[0].
+    """
+    from services.embeddings import get_embeddings
+    return get_embeddings().embed_documents(texts)
+
+
+def get_lexical_index():
+    """Соединение с BM25-индексом (только чтение) или None, если индекс ещё не построен."""
+    from config.settings import settings
+    from services import lexical_index
+
+    path = Path(settings.LEXICAL_INDEX_FILE)
+    if not path.exists():
+        return None
+    return lexical_index.open_index(path, readonly=True)
+
+
+def lexical_search(query: str, where: dict | None = None) -> list[str] | None:
+    """IDs HYBRID_CANDIDATES лучших чанков по BM25 или None, если индекса нет.
+
+    where — фильтр маршрутизации (routing_filter()): BM25 ищет только в выбранных
+    документах, как и векторная выдача, иначе отсечённые документы вернулись бы через RRF.
+    """
+    from config.settings import settings
+    from services import lexical_index
+
+    conn = get_lexical_index()
+    if conn is None:
+        return None
+    sources = where["source"]["$in"] if where else None
+    try:
+        return [chunk_id for chunk_id, _ in lexical_index.search(conn, query, settings.HYBRID_CANDIDATES, sources)]
+    finally:
+        conn.close()
+
+
+def reciprocal_rank_fusion(rankings: list[list[str]], k: int) -> list[str]:
+    """Reciprocal rank fusion: score(id) = Σ 1 / (k + ранг). Ранги с 1."""
+    scores: dict[str, float] = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores, key=scores.get, reverse=True)
+
+
+def fuse_hybrid(dense_ids: list[str], lexical: list[str]) -> list[str]:
+    """IDs search_depth() лучших чанков после слияния векторной и BM25-выдачи."""
+    from config.settings import settings
+    return reciprocal_rank_fusion([dense_ids, lexical], settings.RRF_K)[:search_depth()]
+
+
+def log_hybrid(n_dense: int, lexical: list[str], top: list[str], missing: list[str]):
+    logger.debug(f"[retrieve] hybrid: dense={n_dense} bm25={len(lexical)} "
+                 f"top={len(top)} только из bm25={len(missing)}")
+
+
+def search_depth() -> int:
+    """Сколько кандидатов отдаёт поиск: RETRIEVER_K, с переранжированием — RERANK_CANDIDATES."""
+    from config.settings import settings
+    from services import reranker
+
+    if reranker.enabled():
+        return max(settings.RERANK_CANDIDATES, settings.RETRIEVER_K)
+    return settings.RETRIEVER_K
+
+
+def rerank_stage(queries: list[str], candidates: list[RetrievedChunks]) -> list[RetrievedChunks]:
+    """Переранжирование кандидатов кросс-энкодером (RERANK_MODEL), top RETRIEVER_K на запрос.
+
+    Пары всех запросов пересчитываются одним батчем. Без RERANK_MODEL — без изменений.
+    """
+    from config.settings import settings
+    from services import reranker
+
+    if not reranker.enabled() or not candidates:
+        return candidates
+    orders, stats = reranker.rerank(queries, [c.texts for c in candidates], settings.RETRIEVER_K)
+    if stats["skipped"]:
+        logger.debug(f"[retrieve] rerank пропущен: {settings.RETRIEVER_K} пар на запрос "
+                     f"не укладываются в {settings.RERANK_BUDGET_MS} мс")
+    else:
+        logger.debug(f"[retrieve] rerank{' (замер цены после пропусков)' if stats['probe'] else ''}: "
+                     f"пар={stats['pairs']} за {stats['ms']:.0f} мс (бюджет {settings.RERANK_BUDGET_MS} мс)")
+    return [c.take(order) for c, order in zip(candidates, orders)]
+
+
+def routing_filter(routes: list[list[str]]) -> dict | None:
+    """where-фильтр чанков по документам, выбранным для запросов (объединение по всем)."""
+    sources = list(dict.fromkeys(s for docs in routes for s in docs))
+    return {"source": {"$in": sources}} if sources else None
+
+
+def log_routing(n_queries: int, where: dict | None):
+    n_docs = len(where["source"]["$in"]) if where else 0
+    logger.debug(f"[retrieve] маршрутизация: запросов={n_queries} документов={n_docs}")
+
+
+def route_documents(embeddings: list[list[float]]) -> dict | None:
+    """Первый уровень двухуровневого поиска: where-фильтр по ROUTING_DOCS ближайшим документам.
+
+    None — плоский поиск: ROUTING_DOCS=0 или индекса маршрутизации ещё нет.
+    """
+    from chromadb.errors import NotFoundError
+    from config.settings import settings
+    from services import routing_index
+
+    if settings.ROUTING_DOCS <= 0:
+        return None
+    try:
+        routes = routing_index.route(get_routing_collection(), embeddings, settings.ROUTING_DOCS)
+    except NotFoundError:
+        logger.debug("[retrieve] индекса маршрутизации нет → плоский поиск")
+        return None
+    where = routing_filter(routes)
+    log_routing(len(embeddings), where)
+    return where
+
+
+async def aroute_documents(embeddings: list[list[float]]) -> dict | None:
+    """route_documents() через async-клиент ChromaDB."""
+    from chromadb.errors import NotFoundError
+    from config.settings import settings
+
+    if settings.ROUTING_DOCS <= 0:
+        return None
+    try:
+        routing = await get_async_collection(settings.ROUTING_COLLECTION)
+    except NotFoundError:
+        logger.debug("[retrieve] индекса маршрутизации нет → плоский поиск")
+        return None
+    result = await with_timeout(routing.query(
+        query_embeddings=embeddings, n_results=settings.ROUTING_DOCS, include=[],
+    ))
+    where = routing_filter(result["ids"])
+    log_routing(len(embeddings), where)
+    return where
+
+
+def similarity(distance: float) -> float:
+    """Косинусное сходство из расстояния ChromaDB (коллекция создана с hnsw:space=cosine)."""
+    return round(1.0 - float(distance), 4)
+
+
+def collect(top: list[str], texts: dict[str, str], scores: dict[str, float], metas: dict[str, dict]) -> RetrievedChunks:
+    """Выдача по списку IDs; чанки без известного текста пропускаются."""
+    top = [i for i in top if i in texts]
+    return RetrievedChunks([texts[i] for i in top], [scores.get(i) for i in top], [metas.get(i) or {} for i in top])
+
+
+def vector_search(embedding: list[float], where: dict | None = None) -> RetrievedChunks:
+    """search_depth() ближайших чанков из ChromaDB (where — фильтр route_documents())."""
+    hits = get_vectorstore().similarity_search_by_vector_with_relevance_scores(
+        embedding, k=search_depth(), filter=where,
+    )
+    return RetrievedChunks(
+        [doc.page_content for doc, _ in hits], [similarity(d) for _, d in hits], [doc.metadata for doc, _ in hits],
+    )
 
 
-@tool
-def retrieve_docs(query: str) -> str:
+def hybrid_search(query: str, embedding: list[float], where: dict | None = None) -> RetrievedChunks:
+    """Векторная выдача + BM25, слитые через RRF: search_depth() лучших чанков.
+
+    Если BM25-индекса нет (indexer.py ещё не запускался после обновления) —
+    только векторная выдача.
+    """
+    from config.settings import settings
+
+    vectorstore = get_vectorstore()
+    dense = vectorstore.similarity_search_by_vector_with_relevance_scores(
+        embedding, k=settings.HYBRID_CANDIDATES, filter=where,
+    )
+    texts = {doc.id: doc.page_content for doc, _ in dense}
+    scores = {doc.id: similarity(d) for doc, d in dense}
+    metas = {doc.id: doc.metadata for doc, _ in dense}
+
+    lexical = lexical_search(query, where)
+    if lexical is None:
+        return collect(list(texts)[:search_depth()], texts, scores, metas)
+    top = fuse_hybrid(list(texts), lexical)
+
+    # Тексты чанков, найденных только по BM25, берём из ChromaDB
+    missing = [i for i in top if i not in texts]
+    if missing:
+        got = vectorstore.get(ids=missing, include=["documents", "metadatas"])
+        texts.update(zip(got["ids"], got["documents"]))
+        metas.update(zip(got["ids"], got["metadatas"]))
+
+    log_hybrid(len(dense), lexical, top, missing)
+    return collect(top, texts, scores, metas)
+
+
+async def avector_search(embedding: list[float], where: dict | None = None) -> RetrievedChunks:
+    """vector_search() через async-клиент ChromaDB."""
+    collection = await get_async_collection()
+    result = await with_timeout(collection.query(
+        query_embeddings=[embedding], n_results=search_depth(), where=where,
+        include=["documents", "distances", "metadatas"],
+    ))
+    return RetrievedChunks(
+        result["documents"][0], [similarity(d) for d in result["distances"][0]],
+        [m or {} for m in result["metadatas"][0]],
+    )
+
+
+async def ahybrid_search(query: str, embedding: list[float], where: dict | None = None) -> RetrievedChunks:
+    """hybrid_search() через async-клиент ChromaDB; BM25 идёт параллельно с векторным запросом."""
+    from config.settings import settings
+
+    collection = await get_async_collection()
+    dense, lexical = await asyncio.gather(
+        with_timeout(collection.query(
+            query_embeddings=[embedding], n_results=settings.HYBRID_CANDIDATES, where=where,
+            include=["documents", "distances", "metadatas"],
+        )),
+        run_blocking(lexical_search, query, where),
+    )
+    texts = dict(zip(dense["ids"][0], dense["documents"][0]))
+    scores = {i: similarity(d) for i, d in zip(dense["ids"][0], dense["distances"][0])}
+    metas = dict(zip(dense["ids"][0], dense["metadatas"][0]))
+
+    if lexical is None:
+        return collect(dense["ids"][0][:search_depth()], texts, scores, metas)
+    top = fuse_hybrid(list(texts), lexical)
+
+    missing = [i for i in top if i not in texts]
+    if missing:
+        got = await with_timeout(collection.get(ids=missing, include=["documents", "metadatas"]))
+        texts.update(zip(got["ids"], got["documents"]))
+        metas.update(zip(got["ids"], got["metadatas"]))
+
+    log_hybrid(len(dense["ids"][0]), lexical, top, missing)
+    return collect(top, texts, scores, metas)
+
+
+def search_plan(normalized: str, embedding: list[float]):
+    """(режим, снимок, ключ кэша выдачи) для запроса.
+
+    Ключ: (эмбеддинг, k, режим, модель переранжирования, ROUTING_DOCS, версия коллекции). Версию
+    меняет indexer.py после каждого прохода — переиндексация сбрасывает кэш выдачи.
+    В гибридном режиме и с переранжированием в ключ входит и сам запрос: от него
+    зависят BM25 и кросс-энкодер. В режиме snapshot версия — версия открытого
+    снимка (retriever_local.py); пока снимка нет — поиск в ChromaDB.
+    """
+    from config.settings import settings
+    from graph.nodes.retriever_local import get_snapshot
+    from services.index_version import read_version
+
+    mode = settings.RETRIEVAL_MODE
+    snapshot = None
+    if mode == "snapshot":
+        snapshot = get_snapshot()
+        if snapshot is None:
+            logger.debug("[retrieve] снимка коллекции нет → поиск в ChromaDB")
+            mode = "vector"
+
+    key = (
+        vector_key(embedding),
+        settings.RETRIEVER_K,
+        mode,
+        settings.RERANK_MODEL,
+        settings.ROUTING_DOCS,
+        normalized if mode == "hybrid" or settings.RERANK_MODEL else "",
+        snapshot.header["version"] if snapshot else read_version(Path(settings.INDEX_VERSION_FILE)),
+    )
+    return mode, snapshot, key
+
+
+def log_cache(embedding_hit: bool, results_hit: bool):
+    stats = cache_stats()
+    logger.debug(f"[retrieve] кэш: эмбеддинг {'hit' if embedding_hit else 'miss'}, "
+                 f"выдача {'hit' if results_hit else 'miss'} "
+                 f"(hit rate {stats['embedding']['hit_rate']} / {stats['results']['hit_rate']})")
+
+
+def search_chunks(query: str) -> RetrievedChunks:
+    """Найденные чанки со сходством с запросом, двухуровневый кэш.
+
+    Уровень 1: нормализованный запрос → эмбеддинг (без вызова модели).
+    Уровень 2: ключ из search_plan() → выдача (без запроса к ChromaDB).
+    """
+    from graph.nodes.retriever_local import snapshot_search
+
+    embedding_cache, result_cache = get_caches()
+    normalized = normalize_query(query)
+
+    embedding = embedding_cache.get(normalized)
+    embedding_hit = embedding is not None
+    if not embedding_hit:
+        embedding = embed_query(query)
+        embedding_cache.put(normalized, embedding)
+
+    mode, snapshot, key = search_plan(normalized, embedding)
+    found = result_cache.get(key)
+    results_hit = found is not None
+    if not results_hit:
+        if mode == "snapshot":
+            found = snapshot_search(snapshot, embedding, search_depth())
+        elif mode == "hybrid":
+            found = hybrid_search(query, embedding, route_documents([embedding]))
+        else:
+            found = vector_search(embedding, route_documents([embedding]))
+        found = rerank_stage([query], [found])[0]
+        result_cache.put(key, found)
+
+    log_cache(embedding_hit, results_hit)
+    return found
+
+
+async def asearch_chunks(query: str) -> RetrievedChunks:
+    """search_chunks() для async-графа: поток event loop не блокируется.
+
+    Эмбеддинг, BM25 и поиск по снимку выполняются в пуле get_executor(),
+    запросы к ChromaDB — через async-клиент с общим keep-alive пулом и
+    таймаутом CHROMA_TIMEOUT на каждый запрос.
+    """
+    from config.settings import settings
+    from graph.nodes.retriever_local import snapshot_search
+
+    embedding_cache, result_cache = get_caches()
+    normalized = normalize_query(query)
+
+    embedding = embedding_cache.get(normalized)
+    embedding_hit = embedding is not None
+    if not embedding_hit:
+        embedding = await run_blocking(embed_query, query)
+        embedding_cache.put(normalized, embedding)
+
+    mode, snapshot, key = search_plan(normalized, embedding)
+    found = result_cache.get(key)
+    results_hit = found is not None
+    if not results_hit:
+        try:
+            if mode == "snapshot":
+                found = await run_blocking(snapshot_search, snapshot, embedding, search_depth())
+            elif mode == "hybrid":
+                found = await ahybrid_search(query, embedding, await aroute_documents([embedding]))
+            else:
+                found = await avector_search(embedding, await aroute_documents([embedding]))
+        except TimeoutError:
+            logger.debug(f"[retrieve] ChromaDB не ответила за {settings.CHROMA_TIMEOUT} с")
+            raise
+        found = (await run_blocking(rerank_stage, [query], [found]))[0]
+        result_cache.put(key, found)
+
+    log_cache(embedding_hit, results_hit)
+    return found
+
+
+# ── Несколько вызовов retrieve_docs за ход ──────────────────────────────────
+
+def rank_batch(mode: str, dense: dict, lexical: list[list[str] | None]):
+    """IDs выдачи по каждому запросу, известные тексты, сходства и метаданные из ответа multi-query ChromaDB."""
+    texts: dict[str, str] = {}
+    scores: dict[str, float] = {}
+    metas: dict[str, dict] = {}
+    rankings = []
+    for ids, docs, distances, meta, lex in zip(
+        dense["ids"], dense["documents"], dense["distances"], dense["metadatas"], lexical,
+    ):
+        texts.update(zip(ids, docs))
+        metas.update(zip(ids, meta))
+        scores.update((i, similarity(d)) for i, d in zip(ids, distances))
+        if mode == "hybrid" and lex is not None:
+            top = fuse_hybrid(ids, lex)
+            log_hybrid(len(ids), lex, top, [i for i in top if i not in ids])
+        else:
+            top = ids[:search_depth()]
+        rankings.append(top)
+    return rankings, texts, scores, metas
+
+
+def dense_depth(mode: str) -> int:
+    from config.settings import settings
+    return settings.HYBRID_CANDIDATES if mode == "hybrid" else search_depth()
+
+
+def missing_ids(rankings: list[list[str]], texts: dict[str, str]) -> list[str]:
+    return list(dict.fromkeys(i for top in rankings for i in top if i not in texts))
+
+
+def chroma_batch(mode: str, queries: list[str], embeddings: list[list[float]]) -> list[RetrievedChunks]:
+    """Выдачи нескольких запросов: один multi-query запрос к ChromaDB и один get() недостающих текстов.
+
+    С маршрутизацией у multi-query запроса один where — объединение документов всех запросов.
+    """
+    collection = get_collection()
+    where = route_documents(embeddings)
+    dense = collection.query(
+        query_embeddings=embeddings, n_results=dense_depth(mode), where=where, include=["documents", "distances", "metadatas"],
+    )
+    lexical = [lexical_search(q, where) if mode == "hybrid" else None for q in queries]
+    rankings, texts, scores, metas = rank_batch(mode, dense, lexical)
+    missing = missing_ids(rankings, texts)
+    if missing:
+        got = collection.get(ids=missing, include=["documents", "metadatas"])
+        texts.update(zip(got["ids"], got["documents"]))
+        metas.update(zip(got["ids"], got["metadatas"]))
+    return [collect(top, texts, scores, metas) for top in rankings]
+
+
+async def achroma_batch(mode: str, queries: list[str], embeddings: list[list[float]]) -> list[RetrievedChunks]:
+    """chroma_batch() через async-клиент ChromaDB; BM25 идёт параллельно с векторным запросом."""
+    collection = await get_async_collection()
+    where = await aroute_documents(embeddings)
+    lexical_jobs = [run_blocking(lexical_search, q, where) for q in queries] if mode == "hybrid" else []
+    dense, *lexical = await asyncio.gather(
+        with_timeout(collection.query(
+            query_embeddings=embeddings, n_results=dense_depth(mode), where=where,
+            include=["documents", "distances", "metadatas"],
+        )),
+        *lexical_jobs,
+    )
+    rankings, texts, scores, metas = rank_batch(mode, dense, lexical or [None] * len(queries))
+    missing = missing_ids(rankings, texts)
+    if missing:
+        got = await with_timeout(collection.get(ids=missing, include=["documents", "metadatas"]))
+        texts.update(zip(got["ids"], got["documents"]))
+        metas.update(zip(got["ids"], got["metadatas"]))
+    return [collect(top, texts, scores, metas) for top in rankings]
+
+
+def plan_batch(queries: list[str], embeddings: dict[str, list[float]]):
+    """Ключи кэша по запросам; промахи сгруппированы по режиму: {режим: [(запрос, снимок, ключ)]}."""
+    _, result_cache = get_caches()
+    results: dict[str, RetrievedChunks] = {}
+    todo: dict[str, list] = {}
+    for q in queries:
+        mode, snapshot, key = search_plan(q, embeddings[q])
+        cached = result_cache.get(key)
+        if cached is None:
+            todo.setdefault(mode, []).append((q, snapshot, key))
+        else:
+            results[q] = cached
+    return results, todo
+
+
+def batch_search(queries: list[str]) -> list[RetrievedChunks]:
+    """search_chunks() для нескольких запросов одного хода.
+
+    Промахи кэша эмбеддингов считаются одним вызовом модели, промахи кэша
+    выдачи — одним multi-query запросом к ChromaDB. Возвращает выдачи в порядке queries.
+    """
+    from graph.nodes.retriever_local import snapshot_search
+
+    embedding_cache, result_cache = get_caches()
+    normalized = [normalize_query(q) for q in queries]
+    unique = list(dict.fromkeys(normalized))
+    original = {}
+    for n, q in zip(normalized, queries):
+        original.setdefault(n, q)
+
+    embeddings = {q: embedding_cache.get(q) for q in unique}
+    misses = [q for q, e in embeddings.items() if e is None]
+    if misses:
+        for q, e in zip(misses, embed_queries([original[q] for q in misses])):
+            embeddings[q] = e
+            embedding_cache.put(q, e)
+
+    results, todo = plan_batch(unique, embeddings)
+    fetched, candidates = [], []
+    for mode, items in todo.items():
+        if mode == "snapshot":
+            found = [snapshot_search(snapshot, embeddings[q], search_depth()) for q, snapshot, _ in items]
+        else:
+            found = chroma_batch(mode, [original[q] for q, _, _ in items], [embeddings[q] for q, _, _ in items])
+        fetched.extend((q, key) for q, _, key in items)
+        candidates.extend(found)
+
+    for (q, key), f in zip(fetched, rerank_stage([original[q] for q, _ in fetched], candidates)):
+        results[q] = f
+        result_cache.put(key, f)
+
+    log_batch(len(queries), len(unique), len(misses), sum(len(i) for i in todo.values()))
+    return [results[q] for q in normalized]
+
+
+async def abatch_search(queries: list[str]) -> list[RetrievedChunks]:
+    """batch_search() для async-графа (см. asearch_chunks())."""
+    from graph.nodes.retriever_local import snapshot_search
+
+    embedding_cache, result_cache = get_caches()
+    normalized = [normalize_query(q) for q in queries]
+    unique = list(dict.fromkeys(normalized))
+    original = {}
+    for n, q in zip(normalized, queries):
+        original.setdefault(n, q)
+
+    embeddings = {q: embedding_cache.get(q) for q in unique}
+    misses = [q for q, e in embeddings.items() if e is None]
+    if misses:
+        for q, e in zip(misses, await run_blocking(embed_queries, [original[q] for q in misses])):
+            embeddings[q] = e
+            embedding_cache.put(q, e)
+
+    results, todo = plan_batch(unique, embeddings)
+    fetched, candidates = [], []
+    for mode, items in todo.items():
+        if mode == "snapshot":
+            found = [
+                await run_blocking(snapshot_search, snapshot, embeddings[q], search_depth())
+                for q, snapshot, _ in items
+            ]
+        else:
+            found = await achroma_batch(mode, [original[q] for q, _, _ in items], [embeddings[q] for q, _, _ in items])
+        fetched.extend((q, key) for q, _, key in items)
+        candidates.extend(found)
+
+    reranked = await run_blocking(rerank_stage, [original[q] for q, _ in fetched], candidates)
+    for (q, key), f in zip(fetched, reranked):
+        results[q] = f
+        result_cache.put(key, f)
+
+    log_batch(len(queries), len(unique), len(misses), sum(len(i) for i in todo.values()))
+    return [results[q] for q in normalized]
+
+
+def log_batch(n_calls: int, n_unique: int, n_embedded: int, n_searched: int):
+    logger.debug(f"[retrieve] батч: вызовов={n_calls} уникальных={n_unique} "
+                 f"эмбеддингов={n_embedded} запросов в поиск={n_searched}")
+
+
+def artifact(found: RetrievedChunks, scores: list[float | None]) -> dict:
+    """Артефакт ToolMessage: сходства выданных чанков и лучшее сходство выдачи (для grader.py)."""
+    return {"scores": scores, "best_score": found.best_score}
+
+
+def assemble_context(results: list[RetrievedChunks]) -> list:
+    """Блоки контекста по выдачам хода (services/context.py): без повторов и перекрытий, в бюджете токенов."""
+    from services.context import assemble
+
+    per_call, stats = assemble(results)
+    tokens = (f"токенов {stats['tokens_in']} → {stats['tokens_out']} (бюджет {stats['budget']}, "
+              f"отброшено блоков {stats['dropped_blocks']})" if stats["budget"] > 0 else "без бюджета токенов")
+    logger.debug(f"[retrieve] контекст: чанков={stats['chunks']} блоков={stats['blocks']} "
+                 f"перекрытий вырезано={stats['overlap_chars']} симв. {tokens}")
+    return per_call
+
+
+def tool_messages(tool_calls: list[dict], results: list[RetrievedChunks]) -> list:
+    """ToolMessage на каждый вызов. Чанки всех вызовов хода собираются в общий контекст
+    assemble_context(): блок уходит в сообщение вызова, который нашёл его выше всех."""
+    from langchain_core.messages import ToolMessage
+    from services.context import render
+
+    messages = []
+    for call, found, blocks in zip(tool_calls, results, assemble_context(results)):
+        messages.append(ToolMessage(
+            content=render(blocks),
+            artifact=artifact(found, [s for b in blocks for s in b.scores]),
+            tool_call_id=call["id"],
+            name=call["name"],
+        ))
+    return messages
+
+
+def call_queries(state) -> tuple[list[dict], list[str]]:
+    tool_calls = state["messages"][-1].tool_calls
+    return tool_calls, [call["args"].get("query", "") for call in tool_calls]
+
+
+def retrieve_node(state):
+    """Узел retrieve: все вызовы retrieve_docs последнего ответа LLM одним батчем.
+
+    Заменяет ToolNode([retriever_tool]), который выполнял вызовы по одному.
+    Объединённый контекст для grader/answer собирает merged_context().
+    """
+    from graph.nodes import speculative
+
+    tool_calls, queries = call_queries(state)
+    logger.debug(f"[retrieve] вызовов retrieve_docs: {len(queries)}")
+    # Выдачи спекулятивного поиска, закреплённые query за вызовами (SPECULATIVE_RETRIEVAL)
+    found = {i: speculative.resolve(p) for i, p in speculative.claim(tool_calls).items()}
+    rest = [i for i in range(len(queries)) if found.get(i) is None]
+    if rest:
+        found.update(zip(rest, batch_search([queries[i] for i in rest])))
+    return {"messages": tool_messages(tool_calls, [found[i] for i in range(len(queries))])}
+
+
+async def aretrieve_node(state):
+    from graph.nodes import speculative
+
+    tool_calls, queries = call_queries(state)
+    logger.debug(f"[retrieve] вызовов retrieve_docs: {len(queries)}")
+    found = {i: await speculative.aresolve(p) for i, p in speculative.claim(tool_calls).items()}
+    rest = [i for i in range(len(queries)) if found.get(i) is None]
+    if rest:
+        found.update(zip(rest, await abatch_search([queries[i] for i in rest])))
+    return {"messages": tool_messages(tool_calls, [found[i] for i in range(len(queries))])}
+
+
+# ── Поиск по вариантам переформулировки (REWRITE_FANOUT) ─────────────────────
+
+def fanout_search(task: dict):
+    """Узел fanout_search: поиск одного варианта; вход — Send из rewriter.send_alternatives()."""
+    logger.debug(f"[retrieve] вариант {task['index']}: {task['query'][:60]}")
+    return {"fanout": [(task["index"], search_chunks(task["query"]))]}
+
+
+async def afanout_search(task: dict):
+    logger.debug(f"[retrieve] вариант {task['index']}: {task['query'][:60]}")
+    return {"fanout": [(task["index"], await asearch_chunks(task["query"]))]}
+
+
+def fanout_merge(state):
+    """Узел fanout_merge: выдачи всех вариантов → ToolMessage на каждый вызов rewriter.
+
+    Как и в retrieve_node, контекст собирает assemble_context(): чанк, найденный
+    несколькими вариантами, попадает в контекст один раз.
+    """
+    tool_calls = state["messages"][-1].tool_calls
+    found = dict(state["fanout"])
+    results = [found[i] for i in range(len(tool_calls))]
+    logger.debug(f"[retrieve] варианты объединены: {len(tool_calls)}, "
+                 f"уникальных чанков {len({t for r in results for t in r.texts})}")
+    return {"messages": tool_messages(tool_calls, results), "fanout": None}
+
+
+def last_tool_messages(messages) -> list:
+    """ToolMessage последнего поиска — все подряд в конце истории."""
+    from langchain_core.messages import ToolMessage
+
+    tail = []
+    for message in reversed(messages):
+        if not isinstance(message, ToolMessage):
+            break
+        tail.append(message)
+    return tail[::-1]
+
+
+def merged_context(messages) -> str:
+    """Контекст последнего поиска: все ToolMessage в конце истории, без пустых."""
+    return "\n\n---\n\n".join(m.content for m in last_tool_messages(messages) if m.content)
+
+
+def best_score(messages) -> float | None:
+    """Лучшее сходство чанка с запросом в последнем поиске; None — сходства неизвестны."""
+    scores = [
+        m.artifact["best_score"] for m in last_tool_messages(messages)
+        if isinstance(m.artifact, dict) and m.artifact.get("best_score") is not None
+    ]
+    return max(scores) if scores else None
+
+
+def has_unknown_score(messages) -> bool:
+    """В контексте последнего поиска есть чанк без сходства — найденный только BM25."""
+    return any(
+        score is None
+        for m in last_tool_messages(messages) if isinstance(m.artifact, dict)
+        for score in m.artifact.get("scores", [])
+    )
+
+
+def retrieve_docs(query: str) -> tuple[str, dict]:
     """Поиск и получение информации из документов.
 
     Ищет релевантную информацию в ChromaDB из локальных текстовых документов.
@@ -47,10 +896,31 @@ def retrieve_docs(query: str) -> str:
         query: Поисковый запрос (на русском или английском языке)
 
     Returns:
-        Объединённый текст найденных документов
+        Кортеж (content, artifact): content — объединённый текст найденных
+        документов (ToolMessage.content); artifact — {"scores": сходства чанков
+        контекста с запросом, None у найденных только BM25, "best_score": лучшее
+        известное сходство выдачи или None} (ToolMessage.artifact, читает grader.py)
     """
-    docs = get_retriever().invoke(query)
-    return "\n\n---\n\n".join([doc.page_content for doc in docs])
+    from services.context import render
+
+    found = search_chunks(query)
+    blocks = assemble_context([found])[0]
+    return render(blocks), artifact(found, [s for b in blocks for s in b.scores])
+
+
+async def aretrieve_docs(query: str) -> tuple[str, dict]:
+    from services.context import render
+
+    found = await asearch_chunks(query)
+    blocks = assemble_context([found])[0]
+    return render(blocks), artifact(found, [s for b in blocks for s in b.scores])
 
 
-retriever_tool = retrieve_docs
\ No newline at end of file
+# invoke → retrieve_docs, ainvoke (async-граф) → aretrieve_docs.
+# Текст уходит в ToolMessage.content, сходства — в ToolMessage.artifact
+retriever_tool = StructuredTool.from_function(
+    func=retrieve_docs,
+    coroutine=aretrieve_docs,
+    name="retrieve_docs",
+    response_format="content_and_artifact",
+)
@@ -1,10 +1,49 @@
-# src/components/retriever_tool.py
+# graph/nodes/retriever_local.py
+"""
+Поиск в процессе, без запросов к ChromaDB.
+
+1. Снимок коллекции (RETRIEVAL_MODE=snapshot) — get_snapshot / snapshot_search,
+   их вызывает retriever.py.
+2. Хранилище в памяти — retriever_tool: InMemoryVectorStore из веб- и
+   txt-документов, собирается при первом вызове (как раньше).
+
+Снимок выгружает services/indexer.py (SNAPSHOT_EXPORT=true) или
+python -m services.snapshot --export. Файлы открываются через mmap:
+старт — чтение заголовка, а несколько процессов Streamlit делят одни страницы.
+Запрос к ChromaDB не нужен, top-k считается скалярными произведениями NumPy.
+Модель эмбеддингов для запроса — та же, что в indexer.py (services/embeddings.py).
+"""
 
 from functools import lru_cache
+from pathlib import Path
+
 from langchain.tools import tool
-from langchain_core.vectorstores import InMemoryVectorStore
-from langchain_huggingface import HuggingFaceEmbeddings
 
+from models.schemas import RetrievedChunks
+
+
+def get_snapshot():
+    """Текущий снимок коллекции или None, если его ещё не выгружали.
+
+    Новая выгрузка подхватывается при следующем вызове, без перезапуска процесса.
+    """
+    from config.settings import settings
+    from services.snapshot import load_current
+
+    return load_current(Path(settings.SNAPSHOT_DIR))
+
+
+def snapshot_search(snapshot, embedding: list[float], k: int) -> RetrievedChunks:
+    """k ближайших чанков снимка с косинусным сходством."""
+    hits = snapshot.search(embedding, k)
+    return RetrievedChunks(
+        [snapshot.text(i) for i, _ in hits],
+        [round(score, 4) for _, score in hits],
+        [snapshot.metadata(i) for i, _ in hits],
+    )
+
+
+# ── Хранилище в памяти (без ChromaDB и снимка) ───────────────────────────────
 
 @lru_cache(maxsize=1)
 def get_vectorstore():
@@ -15,6 +54,8 @@ def get_vectorstore():
     """
 
     # Импортируем только когда нужно
+    from langchain_core.vectorstores import InMemoryVectorStore
+    from langchain_huggingface import HuggingFaceEmbeddings
     from graph.nodes.process_web_docs import get_web_documents
     from graph.nodes.process_txt_docs import get_txt_documents
 
@@ -67,4 +108,4 @@ def retrieve_docs(query: str) -> str:
 
 
 # Экспортируем инструмент
-retriever_tool = retrieve_docs
\ No newline at end of file
+retriever_tool = retrieve_docs
@@ -1,10 +1,13 @@
 # graph/nodes/rewriter.py
 
 import logging
+import re
+import uuid
 from pathlib import Path
 
-from langchain_core.messages import HumanMessage
+from langchain_core.messages import AIMessage, HumanMessage
 from langgraph.graph import MessagesState
+from langgraph.types import Send
 
 # ---------------------------------------------------------------------------
 _LOG_PATH = Path(__file__).resolve().parents[2] / "logs" / "debug.log"
@@ -35,10 +38,8 @@ REWRITE_PROMPT = (
 )
 
 
-def rewrite_question(state: MessagesState):
-    """Переформулировать вопрос для улучшения поиска."""
-    from graph.nodes.query import get_response_model
-
+def question_and_count(state: MessagesState) -> tuple[str, int]:
+    """Вопрос для переформулировки и номер попытки."""
     messages = state["messages"]
 
     human_messages = [m for m in messages if isinstance(m, HumanMessage)]
@@ -52,14 +53,119 @@ def rewrite_question(state: MessagesState):
 
     logger.debug(f"[rewriter] попытка №{rewrite_count}, переформулируем: {question[:60]}")
 
-    prompt = REWRITE_PROMPT.format(question=question)
-    response_model = get_response_model()
-    response = response_model.invoke([{"role": "user", "content": prompt}])
+    return question, rewrite_count
+
+
+def rewrite_prompt(state: MessagesState) -> tuple[list, int]:
+    """Промпт переформулировки и номер попытки."""
+    question, rewrite_count = question_and_count(state)
+    return [{"role": "user", "content": REWRITE_PROMPT.format(question=question)}], rewrite_count
+
 
+def rewrite_result(response, rewrite_count: int) -> dict:
     rewritten = response.content
     logger.debug(f"[rewriter] новый вопрос: {rewritten[:80]}")
 
     return {
         "messages": [HumanMessage(content=rewritten)],
         "rewrite_count": rewrite_count,
-    }
\ No newline at end of file
+    }
+
+
+def rewrite_question(state: MessagesState):
+    """Переформулировать вопрос для улучшения поиска."""
+    from graph.nodes.query import get_response_model
+
+    prompt, rewrite_count = rewrite_prompt(state)
+    return rewrite_result(get_response_model().invoke(prompt), rewrite_count)
+
+
+async def arewrite_question(state: MessagesState):
+    from graph.nodes.query import get_response_model
+
+    prompt, rewrite_count = rewrite_prompt(state)
+    return rewrite_result(await get_response_model().ainvoke(prompt), rewrite_count)
+
+
+# ── Переформулировки веером (REWRITE_FANOUT) ─────────────────────────────────
+
+FANOUT_PROMPT = (
+    "Посмотри на входные данные и попытайся проанализировать базовое семантическое намерение / значение.\n"
+    "Предыдущий поисковый запрос не дал релевантных результатов. "
+    "Сформулируй разные поисковые запросы по этому вопросу, всего запросов: {n}.\n"
+    "Вот исходный вопрос:"
+    "\n ------- \n"
+    "{question}"
+    "\n ------- \n"
+    "Пиши на том же языке, что и оригинал. Используй синонимы, термины документов и разные углы зрения. "
+    "Каждый запрос — с новой строки, без нумерации и пояснений:"
+)
+
+# Нумерация и маркеры списка, которые модель всё равно иногда ставит
+_LIST_MARK = re.compile(r"^\s*(?:\d+[.)]|[-*•])\s*")
+
+
+def parse_alternatives(text: str, n: int) -> list[str]:
+    """До n непустых различных строк ответа модели, без нумерации и кавычек."""
+    from graph.nodes.retriever import normalize_query
+
+    alternatives = {}
+    for line in text.splitlines():
+        line = _LIST_MARK.sub("", line).strip().strip("\"«»")
+        if line:
+            alternatives.setdefault(normalize_query(line), line)
+    return list(alternatives.values())[:n]
+
+
+def fanout_prompt(state: MessagesState) -> tuple[list, str, int]:
+    """Промпт на REWRITE_FANOUT вариантов, исходный вопрос и номер попытки."""
+    from config.settings import settings
+
+    question, rewrite_count = question_and_count(state)
+    content = FANOUT_PROMPT.format(n=settings.REWRITE_FANOUT, question=question)
+    return [{"role": "user", "content": content}], question, rewrite_count
+
+
+def fanout_result(response, question: str, rewrite_count: int) -> dict:
+    """AIMessage с вызовом retrieve_docs на каждый вариант — их ищет fanout_search."""
+    from config.settings import settings
+
+    alternatives = parse_alternatives(response.content, settings.REWRITE_FANOUT) or [question]
+    logger.debug(f"[rewriter] вариантов: {len(alternatives)} — " + " | ".join(a[:60] for a in alternatives))
+
+    tool_calls = [
+        {"name": "retrieve_docs", "args": {"query": a}, "id": f"rewrite_{uuid.uuid4().hex[:12]}"}
+        for a in alternatives
+    ]
+    return {
+        "messages": [AIMessage(content="", tool_calls=tool_calls)],
+        "rewrite_count": rewrite_count,
+    }
+
+
+def rewrite_fanout(state: MessagesState):
+    """Переформулировать вопрос в REWRITE_FANOUT вариантов одним вызовом LLM."""
+    from graph.nodes.query import get_response_model
+
+    prompt, question, rewrite_count = fanout_prompt(state)
+    return fanout_result(get_response_model().invoke(prompt), question, rewrite_count)
+
+
+async def arewrite_fanout(state: MessagesState):
+    from graph.nodes.query import get_response_model
+
+    prompt, question, rewrite_count = fanout_prompt(state)
+    return fanout_result(await get_response_model().ainvoke(prompt), question, rewrite_count)
+
+
+def send_alternatives(state: MessagesState) -> list[Send]:
+    """Условное ребро после rewriter: поиск каждого варианта — отдельная задача fanout_search.
+
+    Задачи одного шага LangGraph выполняет параллельно (потоки в invoke, задачи
+    asyncio в ainvoke); fanout_merge запускается один раз, когда готовы все.
+    """
+    tool_calls = state["messages"][-1].tool_calls
+    return [
+        Send("fanout_search", {"index": i, "query": call["args"]["query"]})
+        for i, call in enumerate(tool_calls)
+    ]
@@ -0,0 +1,387 @@
+# graph/nodes/speculative.py
+"""
+Спекулятивный поиск (SPECULATIVE_RETRIEVAL=true).
+
+Пока query ждёт LLM, поиск по сырому вопросу пользователя уже идёт:
+    start() / astart()  — запуск в потоке get_executor() / в asyncio.Task;
+    adopt()             — после ответа LLM: выдача закрепляется за вызовом
+                          retrieve_docs, чей запрос похож на вопрос
+                          (overlap() >= SPECULATIVE_MIN_OVERLAP), иначе отбрасывается;
+    claim() / resolve() — retrieve забирает закреплённую выдачу вместо поиска.
+
+Исходы хода: hit — выдача пригодилась, miss — модель искала другое,
+direct — модель ответила без поиска. Счётчики и сэкономленное время
+(длительность поиска минус ожидание его в retrieve) пишутся в журнал.
+
+Спекулятивный ответ (SPECULATIVE_ANSWER=true). Когда grader спрашивает LLM,
+ответ answer на том же контексте генерируется одновременно:
+    start_answer() / astart_answer() — запуск рядом с вызовом модели grader:
+                                       в своём пуле get_answer_executor()
+                                       (SPECULATIVE_ANSWER_WORKERS) / в asyncio.Task;
+    settle_answer()                  — проверка прошла: ответ ждёт answer,
+                                       не прошла: отменяется, токены идут в расход;
+    take_answer() / atake_answer()   — answer забирает готовый ответ вместо вызова LLM.
+Спекулятивный ответ не стримится по токенам: в чат он приходит целиком,
+когда grader его принял.
+"""
+
+import asyncio
+import logging
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from pathlib import Path
+
+from langchain_core.messages import HumanMessage
+
+from models.schemas import Prefetch, RetrievedChunks, SpeculativeAnswer
+
+# ---------------------------------------------------------------------------
+_LOG_PATH = Path(__file__).resolve().parents[2] / "logs" / "debug.log"
+_LOG_PATH.parent.mkdir(parents=True, exist_ok=True)
+
+logger = logging.getLogger("speculative")
+if not logger.handlers:
+    logger.setLevel(logging.DEBUG)
+    _fmt = logging.Formatter("%(asctime)s [%(name)s] %(message)s", datefmt="%Y-%m-%d %H:%M:%S")
+    _fh = logging.FileHandler(_LOG_PATH, encoding="utf-8")
+    _fh.setFormatter(_fmt)
+    logger.addHandler(_fh)
+    _ch = logging.StreamHandler()
+    _ch.setFormatter(_fmt)
+    logger.addHandler(_ch)
+# ---------------------------------------------------------------------------
+
+# Закреплённые выдачи живут от query до retrieve одного хода
+_PENDING_SIZE = 256
+_PENDING_TTL = 120.0
+
+# Для сравнения запросов слово сводится к первым символам: «отпуска» ~ «отпуск»
+_STEM = 5
+
+_stats = {"hit": 0, "miss": 0, "direct": 0, "saved_ms": 0.0}
+_stats_lock = threading.Lock()
+
+_answer_stats = {"committed": 0, "cancelled": 0, "saved_ms": 0.0, "wasted_input_tokens": 0, "wasted_output_tokens": 0}
+
+
+@lru_cache(maxsize=1)
+def get_pending():
+    """id вызова retrieve_docs → Prefetch."""
+    from graph.nodes.retriever import LRUTTLCache
+    return LRUTTLCache(_PENDING_SIZE, _PENDING_TTL)
+
+
+def count(outcome: str, saved_ms: float = 0.0):
+    with _stats_lock:
+        _stats[outcome] += 1
+        _stats["saved_ms"] += saved_ms
+        stats = dict(_stats)
+    turns = stats["hit"] + stats["miss"] + stats["direct"]
+    searched = stats["hit"] + stats["miss"]
+    logger.debug(
+        f"[speculative] ходов={turns}: hit={stats['hit']} miss={stats['miss']} direct={stats['direct']}; "
+        f"hit rate среди поисков {stats['hit'] / searched if searched else 0:.0%}; "
+        f"сэкономлено {stats['saved_ms']:.0f} мс, в среднем {stats['saved_ms'] / stats['hit'] if stats['hit'] else 0:.0f} мс"
+    )
+
+
+def speculative_stats() -> dict:
+    """hit / miss / direct и суммарное сэкономленное время, мс."""
+    with _stats_lock:
+        return dict(_stats)
+
+
+def terms(text: str) -> set[str]:
+    from graph.nodes.retriever import normalize_query
+    return {w[:_STEM] for w in re.findall(r"\w+", normalize_query(text)) if len(w) > 2}
+
+
+def overlap(query: str, question: str) -> float:
+    """Доля слов запроса retrieve_docs, которые есть в вопросе.
+
+    Модель пишет запрос ключевыми словами из вопроса (см. промпт query.py),
+    поэтому сравнивается вхождение слов, а не эмбеддинги: без лишнего вызова модели.
+    """
+    query_terms = terms(query)
+    if not query_terms:
+        return 0.0
+    return len(query_terms & terms(question)) / len(query_terms)
+
+
+def question_to_prefetch(state) -> str | None:
+    """Вопрос для спекулятивного поиска: последнее сообщение — от пользователя (или rewriter)."""
+    from config.settings import settings
+
+    if not settings.SPECULATIVE_RETRIEVAL:
+        return None
+    messages = state["messages"]
+    if not messages or not isinstance(messages[-1], HumanMessage) or not messages[-1].content:
+        return None
+    return messages[-1].content
+
+
+def timed_search(question: str) -> tuple[RetrievedChunks, float]:
+    from graph.nodes.retriever import batch_search
+
+    started = time.perf_counter()
+    found = batch_search([question])[0]
+    return found, (time.perf_counter() - started) * 1000
+
+
+async def atimed_search(question: str) -> tuple[RetrievedChunks, float]:
+    from graph.nodes.retriever import abatch_search
+
+    started = time.perf_counter()
+    found = (await abatch_search([question]))[0]
+    return found, (time.perf_counter() - started) * 1000
+
+
+def start(state) -> Prefetch | None:
+    from graph.nodes.retriever import get_executor
+
+    question = question_to_prefetch(state)
+    if question is None:
+        return None
+    return Prefetch(question, get_executor().submit(timed_search, question))
+
+
+def astart(state) -> Prefetch | None:
+    question = question_to_prefetch(state)
+    if question is None:
+        return None
+    task = asyncio.create_task(atimed_search(question))
+    # Отброшенная задача может упасть — исключение забирается, чтобы не было предупреждения
+    task.add_done_callback(lambda t: t.cancelled() or t.exception())
+    return Prefetch(question, task)
+
+
+def adopt(prefetch: Prefetch | None, response):
+    """Закрепить выдачу за похожим вызовом retrieve_docs или отбросить её."""
+    from config.settings import settings
+
+    if prefetch is None:
+        return
+    tool_calls = getattr(response, "tool_calls", None) or []
+    if not tool_calls:
+        prefetch.future.cancel()
+        logger.debug("[speculative] модель ответила без поиска → выдача отброшена")
+        count("direct")
+        return
+
+    scored = [(overlap(call["args"].get("query", ""), prefetch.question), call) for call in tool_calls]
+    best, call = max(scored, key=lambda item: item[0])
+    if best >= settings.SPECULATIVE_MIN_OVERLAP:
+        get_pending().put(call["id"], prefetch)
+        logger.debug(f"[speculative] запрос «{call['args'].get('query', '')}» совпал с вопросом на {best:.0%} → "
+                     f"выдача закреплена")
+        return
+
+    prefetch.future.cancel()
+    logger.debug(f"[speculative] запросы модели совпали с вопросом не больше чем на {best:.0%} → выдача отброшена")
+    count("miss")
+
+
+def claim(tool_calls: list[dict]) -> dict[int, Prefetch]:
+    """Закреплённые выдачи по номерам вызовов retrieve_docs."""
+    pending = get_pending()
+    claimed = {}
+    for i, call in enumerate(tool_calls):
+        prefetch = pending.pop(call["id"])
+        if prefetch is not None:
+            claimed[i] = prefetch
+    return claimed
+
+
+def settle(wait_ms: float, duration_ms: float) -> None:
+    saved = max(0.0, duration_ms - wait_ms)
+    logger.debug(f"[speculative] выдача взята: поиск {duration_ms:.0f} мс, ожидание в retrieve {wait_ms:.0f} мс")
+    count("hit", saved)
+
+
+def resolve(prefetch: Prefetch) -> RetrievedChunks | None:
+    """Выдача спекулятивного поиска; None — поиск упал, нужен обычный."""
+    started = time.perf_counter()
+    try:
+        found, duration_ms = prefetch.future.result()
+    except Exception as e:
+        logger.debug(f"[speculative] ошибка поиска: {e} → обычный поиск")
+        count("miss")
+        return None
+    settle((time.perf_counter() - started) * 1000, duration_ms)
+    return found
+
+
+async def aresolve(prefetch: Prefetch) -> RetrievedChunks | None:
+    started = time.perf_counter()
+    try:
+        found, duration_ms = await prefetch.future
+    except Exception as e:
+        logger.debug(f"[speculative] ошибка поиска: {e} → обычный поиск")
+        count("miss")
+        return None
+    settle((time.perf_counter() - started) * 1000, duration_ms)
+    return found
+
+
+# ── Спекулятивный ответ ──────────────────────────────────────────────────────
+
+@lru_cache(maxsize=1)
+def get_pending_answers():
+    """id вызовов retrieve_docs хода → SpeculativeAnswer."""
+    from graph.nodes.retriever import LRUTTLCache
+    return LRUTTLCache(_PENDING_SIZE, _PENDING_TTL)
+
+
+def turn_key(state) -> str:
+    """Ключ хода: id вызовов retrieve_docs, чьи ToolMessage в конце истории."""
+    from graph.nodes.retriever import last_tool_messages
+    return ",".join(m.tool_call_id for m in last_tool_messages(state["messages"]))
+
+
+def count_answer(outcome: str, saved_ms: float = 0.0, wasted: tuple[int, int] = (0, 0)):
+    with _stats_lock:
+        _answer_stats[outcome] += 1
+        _answer_stats["saved_ms"] += saved_ms
+        _answer_stats["wasted_input_tokens"] += wasted[0]
+        _answer_stats["wasted_output_tokens"] += wasted[1]
+        stats = dict(_answer_stats)
+    logger.debug(
+        f"[speculative] ответы: принято={stats['committed']} отменено={stats['cancelled']}; "
+        f"сэкономлено {stats['saved_ms']:.0f} мс; впустую токенов: "
+        f"вход {stats['wasted_input_tokens']}, выход {stats['wasted_output_tokens']}"
+    )
+
+
+def answer_stats() -> dict:
+    """Принятые / отменённые спекулятивные ответы, сэкономленное время и потраченные впустую токены."""
+    with _stats_lock:
+        return dict(_answer_stats)
+
+
+def answer_request(state) -> tuple[list, int] | None:
+    """Промпт answer и оценка его токенов; None — режим выключен."""
+    from config.settings import settings
+    from graph.nodes.answer import answer_prompt
+    from services.context import count_tokens
+
+    if not settings.SPECULATIVE_ANSWER:
+        return None
+    prompt = answer_prompt(state)
+    return prompt, count_tokens(prompt[0]["content"])
+
+
+@lru_cache(maxsize=1)
+def get_answer_executor() -> ThreadPoolExecutor:
+    """Потоки спекулятивных ответов sync-графа.
+
+    Отдельно от get_executor() ретривера: генерация занимает секунды, и в общем
+    пуле эмбеддинги запросов и BM25 ждали бы её в очереди.
+    """
+    from config.settings import settings
+    return ThreadPoolExecutor(max_workers=settings.SPECULATIVE_ANSWER_WORKERS, thread_name_prefix="speculative-answer")
+
+
+def timed_answer(prompt: list):
+    from graph.nodes.query import get_response_model
+
+    started = time.perf_counter()
+    # Без колбэков графа: токены ответа не должны уйти в поток узла retrieve
+    response = get_response_model().invoke(prompt, config={"callbacks": []})
+    return response, (time.perf_counter() - started) * 1000
+
+
+async def atimed_answer(prompt: list):
+    from graph.nodes.query import get_response_model
+
+    started = time.perf_counter()
+    response = await get_response_model().ainvoke(prompt, config={"callbacks": []})
+    return response, (time.perf_counter() - started) * 1000
+
+
+def start_answer(state) -> SpeculativeAnswer | None:
+    request = answer_request(state)
+    if request is None:
+        return None
+    prompt, prompt_tokens = request
+    return SpeculativeAnswer(turn_key(state), get_answer_executor().submit(timed_answer, prompt), prompt_tokens)
+
+
+def astart_answer(state) -> SpeculativeAnswer | None:
+    request = answer_request(state)
+    if request is None:
+        return None
+    prompt, prompt_tokens = request
+    task = asyncio.create_task(atimed_answer(prompt))
+    task.add_done_callback(lambda t: t.cancelled() or t.exception())
+    return SpeculativeAnswer(turn_key(state), task, prompt_tokens)
+
+
+def wasted_tokens(answer: SpeculativeAnswer) -> tuple[int, int]:
+    """(вход, выход) отменённого ответа: по usage_metadata, если он успел завершиться,
+    иначе — оценка промпта (запрос уже отправлен) и 0 на выходе."""
+    future = answer.future
+    if future.done() and not future.cancelled() and future.exception() is None:
+        usage = getattr(future.result()[0], "usage_metadata", None)
+        if usage:
+            return usage.get("input_tokens", 0), usage.get("output_tokens", 0)
+    return answer.prompt_tokens, 0
+
+
+def settle_answer(answer: SpeculativeAnswer | None, route: str):
+    """После решения grader: ответ ждёт answer или отменяется."""
+    if answer is None:
+        return
+    if route == "answer":
+        # concurrent.futures.Future.cancel() отменяет только не начатую задачу (asyncio.Task — любую)
+        if not asyncio.isfuture(answer.future) and answer.future.cancel():
+            # Пул ответов занят и генерация не началась: answer сгенерирует сам, без ожидания очереди
+            logger.debug("[speculative] спекулятивный ответ не начался (пул занят) → обычная генерация")
+            count_answer("cancelled")
+            return
+        get_pending_answers().put(answer.key, answer)
+        return
+
+    future = answer.future
+    if future.cancel() or future.done():
+        count_answer("cancelled", wasted=wasted_tokens(answer))
+    else:
+        # Поток уже генерирует — расход известен, когда он закончит
+        future.add_done_callback(lambda _: count_answer("cancelled", wasted=wasted_tokens(answer)))
+    logger.debug(f"[speculative] grader отклонил контекст ({route}) → спекулятивный ответ отменён")
+
+
+def take_answer(state):
+    """Принятый спекулятивный ответ хода; None — его нет или генерация упала."""
+    answer = get_pending_answers().pop(turn_key(state))
+    if answer is None:
+        return None
+    started = time.perf_counter()
+    try:
+        response, duration_ms = answer.future.result()
+    except Exception as e:
+        logger.debug(f"[speculative] ошибка спекулятивного ответа: {e} → обычная генерация")
+        return None
+    commit_answer((time.perf_counter() - started) * 1000, duration_ms)
+    return response
+
+
+async def atake_answer(state):
+    answer = get_pending_answers().pop(turn_key(state))
+    if answer is None:
+        return None
+    started = time.perf_counter()
+    try:
+        response, duration_ms = await answer.future
+    except Exception as e:
+        logger.debug(f"[speculative] ошибка спекулятивного ответа: {e} → обычная генерация")
+        return None
+    commit_answer((time.perf_counter() - started) * 1000, duration_ms)
+    return response
+
+
+def commit_answer(wait_ms: float, duration_ms: float):
+    logger.debug(f"[speculative] ответ взят: генерация {duration_ms:.0f} мс, ожидание в answer {wait_ms:.0f} мс")
+    count_answer("committed", saved_ms=max(0.0, duration_ms - wait_ms))
@@ -36,10 +36,7 @@ def should_summarize(state) -> Literal["summarizer", "__end__"]:
     return "__end__"
 
 
-def summarize_conversation(state):
-    """Сворачивает историю в сводку, удаляет старые сообщения."""
-    from graph.nodes.query import get_response_model
-
+def summary_prompt(state) -> list:
     summary = state.get("summary", "")
 
     if summary:
@@ -56,10 +53,10 @@ def summarize_conversation(state):
         )
         logger.debug("[summarizer] создаём сводку с нуля")
 
-    messages = state["messages"] + [HumanMessage(content=summary_message)]
-    model = get_response_model()
-    response = model.invoke(messages)
+    return state["messages"] + [HumanMessage(content=summary_message)]
 
+
+def summary_result(state, response) -> dict:
     delete_messages = [
         RemoveMessage(id=m.id)
         for m in state["messages"][:-MESSAGES_TO_KEEP]
@@ -70,4 +67,17 @@ def summarize_conversation(state):
     return {
         "summary": response.content,
         "messages": delete_messages,
-    }
\ No newline at end of file
+    }
+
+
+def summarize_conversation(state):
+    """Сворачивает историю в сводку, удаляет старые сообщения."""
+    from graph.nodes.query import get_response_model
+
+    return summary_result(state, get_response_model().invoke(summary_prompt(state)))
+
+
+async def asummarize_conversation(state):
+    from graph.nodes.query import get_response_model
+
+    return summary_result(state, await get_response_model().ainvoke(summary_prompt(state)))
@@ -1,9 +1,15 @@
 # graph/state.py
 
 from langgraph.graph import MessagesState
-from typing import Optional
+from typing import Annotated, Optional
 
 
+def merge_fanout(current: list | None, update: list | None) -> list:
+    """Редьюсер fanout: выдачи параллельных поисков дописываются, None — очистка."""
+    if update is None:
+        return []
+    return (current or []) + update
+
 
 class GraphState(MessagesState):
     """Расширенный State графа.
@@ -13,6 +19,9 @@ class GraphState(MessagesState):
 
     Добавляем:
     - rewrite_count: int — количество попыток переформулирования вопроса
+    - fanout: list — (номер варианта, RetrievedChunks) от поисков по вариантам
+      переформулировки (REWRITE_FANOUT); fanout_merge очищает после сборки
     """
     rewrite_count: int
-    summary: Optional[str]
\ No newline at end of file
+    summary: Optional[str]
+    fanout: Annotated[list, merge_fanout]
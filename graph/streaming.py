@@ -0,0 +1,139 @@
+# graph/streaming.py
+"""
+Потоковый прогон хода графа для интерфейса.
+
+stream_turn() вызывает graph.stream(stream_mode=["messages", "tasks"]) и отдаёт события:
+  ("status", текст) — узел начал работу (поиск, переформулировка, …)
+  ("token", текст)  — очередной фрагмент ответа пользователю
+  ("reset", None)   — показанный текст оказался не ответом, его надо стереть
+
+Токены берутся только из узлов, чей вывод видит пользователь (STREAMED_NODES):
+прямой ответ query, answer и not_found. Токены grader, rewriter и summarizer
+в чат не попадают. Время до первого токена (TTFT) пишется в журнал на каждый ход.
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+from pathlib import Path
+
+from langchain_core.messages import AIMessage, HumanMessage
+
+# ---------------------------------------------------------------------------
+_LOG_PATH = Path(__file__).resolve().parents[1] / "logs" / "debug.log"
+_LOG_PATH.parent.mkdir(parents=True, exist_ok=True)
+
+logger = logging.getLogger("stream")
+if not logger.handlers:
+    logger.setLevel(logging.DEBUG)
+    _fmt = logging.Formatter("%(asctime)s [%(name)s] %(message)s", datefmt="%Y-%m-%d %H:%M:%S")
+    _fh = logging.FileHandler(_LOG_PATH, encoding="utf-8")
+    _fh.setFormatter(_fmt)
+    logger.addHandler(_fh)
+    _ch = logging.StreamHandler()
+    _ch.setFormatter(_fmt)
+    logger.addHandler(_ch)
+# ---------------------------------------------------------------------------
+
+# Узлы, токены которых — ответ пользователю
+STREAMED_NODES = ("query", "answer", "not_found")
+
+# Статус, который показывается, пока узел работает
+NODE_STATUS = {
+    "query": "Разбираю вопрос...",
+    "retrieve": "Ищу в базе знаний...",
+    "rewriter": "Переформулирую запрос...",
+    "fanout_search": "Ищу по вариантам запроса...",
+    "answer": "Формирую ответ...",
+    "summarizer": "Сжимаю историю диалога...",
+}
+
+# TTFT последних ходов, мс — для p50 / p95 в журнале
+_TTFT_WINDOW = 200
+_ttft = deque(maxlen=_TTFT_WINDOW)
+_ttft_lock = threading.Lock()
+
+
+def record_ttft(ttft_ms: float) -> dict:
+    with _ttft_lock:
+        _ttft.append(ttft_ms)
+    return ttft_stats()
+
+
+def ttft_stats() -> dict:
+    """p50 / p95 времени до первого токена (мс) по последним ходам."""
+    with _ttft_lock:
+        values = sorted(_ttft)
+    if not values:
+        return {"turns": 0}
+    return {
+        "turns": len(values),
+        "p50": values[len(values) // 2],
+        "p95": values[min(len(values) - 1, int(len(values) * 0.95))],
+    }
+
+
+def chunk_text(message) -> str:
+    """Текст фрагмента; у некоторых провайдеров content — список частей."""
+    content = message.content
+    if isinstance(content, str):
+        return content
+    return "".join(part.get("text", "") for part in content if isinstance(part, dict))
+
+
+def stream_turn(graph, prompt: str, config: dict):
+    """Прогнать ход графа, отдавая события ("status" | "token" | "reset", данные).
+
+    Токены query показываются сразу: если модель в итоге вызвала retrieve_docs,
+    отдаётся "reset" и ответ придёт из answer или not_found.
+    """
+    started = time.perf_counter()
+    first_token_ms = None
+    shown = 0          # символов ответа на экране
+    path = []
+
+    for mode, data in graph.stream(
+        # Счётчик переформулировок — на каждый вопрос заново
+        {"messages": [HumanMessage(content=prompt)], "rewrite_count": 0},
+        config=config,
+        stream_mode=["messages", "tasks"],
+    ):
+        if mode == "tasks":
+            # Событие начала задачи содержит input, завершения — result
+            if "input" in data:
+                path.append(data["name"])
+                if data["name"] in NODE_STATUS:
+                    yield "status", NODE_STATUS[data["name"]]
+            continue
+
+        message, metadata = data
+        if metadata.get("langgraph_node") not in STREAMED_NODES or not isinstance(message, AIMessage):
+            continue
+
+        if message.tool_calls or getattr(message, "tool_call_chunks", None):
+            # query ушёл в поиск — всё, что он успел написать, не ответ
+            if shown:
+                shown = 0
+                first_token_ms = None
+                yield "reset", None
+            continue
+
+        text = chunk_text(message)
+        if not text:
+            continue
+        if first_token_ms is None:
+            first_token_ms = (time.perf_counter() - started) * 1000
+        shown += len(text)
+        yield "token", text
+
+    total_ms = (time.perf_counter() - started) * 1000
+    if first_token_ms is None:
+        logger.debug(f"[stream] ход без токенов ответа за {total_ms:.0f} мс; узлы: {' → '.join(path)}")
+        return
+
+    stats = record_ttft(first_token_ms)
+    logger.debug(
+        f"[stream] TTFT={first_token_ms:.0f} мс, весь ход={total_ms:.0f} мс; узлы: {' → '.join(path)}; "
+        f"TTFT за {stats['turns']} ходов: p50={stats['p50']:.0f} мс, p95={stats['p95']:.0f} мс"
+    )
@@ -6,6 +6,7 @@
 
 from __future__ import annotations
 from dataclasses import dataclass, field
+from typing import Any, Optional
 
 
 # ── Feedback ─────────────────────────────────────────────────────────────────
@@ -61,4 +62,99 @@ class ClusterStats:
             return 0.0
         dislike_rate = 1.0 - self.like_rate
         anomaly_bonus = self.like_rate * self.dislikes * 0.5
-        return dislike_rate * self.total + anomaly_bonus
\ No newline at end of file
+        return dislike_rate * self.total + anomaly_bonus
+
+
+# ── Индексация ───────────────────────────────────────────────────────────────
+
+@dataclass
+class IndexedFile:
+    path: str
+    hash: str                           # MD5 содержимого
+    status: str                         # "pending" = индексация начата, "committed" = завершена
+    mtime_ns: Optional[int] = None      # None — запись перенесена из старого JSON-состояния
+    size: Optional[int] = None
+    chunk_ids: Optional[list[str]] = None   # IDs чанков в ChromaDB в порядке chunk_index
+
+    @property
+    def committed(self) -> bool:
+        return self.status == "committed"
+
+
+@dataclass
+class IndexJob:
+    path: str
+    hash: str                           # MD5 версии файла, поставленной в очередь
+    mtime_ns: Optional[int]
+    size: Optional[int]
+    old_chunk_ids: Optional[list[str]]  # IDs из манифеста координатора — для диффа (None — сверка по source)
+    attempts: int = 0
+
+
+@dataclass
+class WebPage:
+    url: str
+    content_hash: str                   # sha256 извлечённого текста
+    chunks: list[str]                   # чанки текста страницы (сплиттер индексатора)
+    title: str = ""
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    chunk_ids: Optional[list[str]] = None   # IDs в ChromaDB; None — страница ещё не загружалась
+    fetched_at: float = 0.0
+    status: str = "cached"              # new | changed | unchanged | not_modified | error | cached
+
+    @property
+    def needs_indexing(self) -> bool:
+        return self.status in ("new", "changed") or self.chunk_ids is None
+
+
+# ── Поиск ────────────────────────────────────────────────────────────────────
+
+@dataclass
+class RetrievedChunks:
+    texts: list[str]
+    scores: list[Optional[float]]       # косинусное сходство чанка с запросом; None — найден только BM25
+    metadatas: list[dict] = field(default_factory=list)    # source / chunk_index, параллельно texts
+
+    @property
+    def best_score(self) -> Optional[float]:
+        known = [s for s in self.scores if s is not None]
+        return max(known) if known else None
+
+    def take(self, order: list[int]) -> RetrievedChunks:
+        """Чанки в порядке order (номера позиций)."""
+        return RetrievedChunks(
+            [self.texts[i] for i in order],
+            [self.scores[i] for i in order],
+            [self.metadatas[i] for i in order] if self.metadatas else [],
+        )
+
+    def metadata(self, i: int) -> dict:
+        return self.metadatas[i] if i < len(self.metadatas) else {}
+
+
+@dataclass
+class ContextBlock:
+    """Фрагмент контекста: один чанк или несколько соседних чанков одного файла."""
+    text: str
+    source: str                         # пусто — чанк без метаданных (не склеивается)
+    chunk_indexes: list[int]
+    rank: tuple[int, int]               # (место в выдаче, номер вызова) лучшего чанка — приоритет при упаковке
+    owner: int                          # номер вызова retrieve_docs, в чьё сообщение попадает блок
+    scores: list[Optional[float]] = field(default_factory=list)
+    tokens: int = 0
+
+
+@dataclass
+class Prefetch:
+    """Спекулятивный поиск по вопросу пользователя, запущенный параллельно с LLM в query."""
+    question: str
+    future: Any                         # Future (invoke) или asyncio.Task (ainvoke) → (RetrievedChunks, мс поиска)
+
+
+@dataclass
+class SpeculativeAnswer:
+    """Ответ answer, запущенный параллельно с LLM-проверкой grader на том же контексте."""
+    key: str                            # id вызовов retrieve_docs хода — общий для grader и answer
+    future: Any                         # Future (invoke) или asyncio.Task (ainvoke) → (AIMessage, мс генерации)
+    prompt_tokens: int                  # оценка токенов промпта — расход, если ответ отменён до завершения
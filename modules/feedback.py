@@ -1,12 +1,11 @@
 # modules/feedback.py
-import psycopg
 import streamlit as st
-from config.settings import settings
+from services.db_pool import connection
 
 
 def init_feedback_table():
     """Создаёт таблицу feedback если не существует."""
-    with psycopg.connect(settings.POSTGRES_URI) as conn:
+    with connection() as conn:
         conn.execute("""
                      CREATE TABLE IF NOT EXISTS feedback
                      (
@@ -19,7 +18,6 @@ def init_feedback_table():
                          created_at TIMESTAMPTZ DEFAULT now()
                          )
                      """)
-        conn.commit()
 
 
 def save_feedback(thread_id: str, message_id: str, rating: int,
@@ -27,13 +25,12 @@ def save_feedback(thread_id: str, message_id: str, rating: int,
     """Сохраняет оценку. rating: 1 = лайк, -1 = дизлайк.
     question/answer — оригинальные тексты без лемматизации.
     """
-    with psycopg.connect(settings.POSTGRES_URI) as conn:
+    with connection() as conn:
         conn.execute(
             """INSERT INTO feedback (thread_id, message_id, rating, question, answer)
                VALUES (%s, %s, %s, %s, %s)""",
             (thread_id, message_id, rating, question, answer),
         )
-        conn.commit()
 
 
 def render_feedback(message_id: str, thread_id: str,
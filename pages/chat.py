@@ -1,6 +1,5 @@
 # pages/chat.py
 import sys
-import time
 from pathlib import Path
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
@@ -9,6 +8,7 @@ from langchain_core.messages import HumanMessage, AIMessage
 from modules.auth import require_auth
 from modules.feedback import init_feedback_table, render_feedback
 from graph.builder import build_graph
+from graph.streaming import stream_turn
 
 st.set_page_config(page_title="Чат", layout="wide")
 
@@ -28,12 +28,6 @@ except Exception as e:
     st.stop()
 
 
-def stream_text(text: str, delay: float = 0.015):
-    for ch in text:
-        yield ch
-        time.sleep(delay)
-
-
 config = {"configurable": {"thread_id": thread_id}}
 
 state = graph.get_state(config)
@@ -61,16 +55,23 @@ if prompt := st.chat_input("Введите сообщение..."):
         st.write(prompt)
 
     try:
-        with st.spinner("Ищу информацию..."):
-            result = graph.invoke(
-                {"messages": [HumanMessage(content=prompt)]},
-                config=config,
-            )
-
-        ai_msg = result["messages"][-1]
-
         with st.chat_message("assistant"):
-            st.write_stream(stream_text(ai_msg.content))
+            status = st.status("Обрабатываю запрос...")
+            placeholder = st.empty()
+            text = ""
+            for kind, payload in stream_turn(graph, prompt, config):
+                if kind == "status":
+                    status.update(label=payload)
+                elif kind == "token":
+                    text += payload
+                    placeholder.markdown(text + "▌")
+                elif kind == "reset":
+                    text = ""
+                    placeholder.empty()
+            status.update(label="Готово", state="complete")
+
+            ai_msg = graph.get_state(config).values["messages"][-1]
+            placeholder.markdown(ai_msg.content)
             render_feedback(
                 message_id=ai_msg.id,
                 thread_id=thread_id,
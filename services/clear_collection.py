@@ -5,7 +5,8 @@ clear_collection.py — полная зачистка коллекции в Chro
 Что делает:
   1. Удаляет коллекцию COLLECTION_NAME из ChromaDB
   2. Создаёт её заново (пустую)
-  3. Очищает INDEX_STATE_FILE (сбрасывает хэши файлов)
+  3. Очищает лексический BM25-индекс LEXICAL_INDEX_FILE (вместе с коллекцией)
+  4. Очищает манифест INDEX_MANIFEST_FILE и старый INDEX_STATE_FILE (сбрасывает хэши файлов)
 
 После запуска следующий запуск indexer.py переиндексирует всё с нуля.
 
@@ -22,6 +23,7 @@ import sys
 from pathlib import Path
 from datetime import datetime
 from config.settings import settings
+from services import index_version, lexical_index, manifest
 
 
 # try:
@@ -34,7 +36,12 @@ from config.settings import settings
 CHROMA_HOST      = settings.CHROMA_HOST
 CHROMA_PORT      = int(settings.CHROMA_PORT)
 COLLECTION_NAME  = settings.COLLECTION_NAME
+ROUTING_COLLECTION = settings.ROUTING_COLLECTION
 INDEX_STATE_FILE = Path(settings.INDEX_STATE_FILE)
+INDEX_MANIFEST_FILE = Path(settings.INDEX_MANIFEST_FILE)
+LEXICAL_INDEX_FILE = Path(settings.LEXICAL_INDEX_FILE)
+INDEX_VERSION_FILE = Path(settings.INDEX_VERSION_FILE)
+SNAPSHOT_CURRENT = Path(settings.SNAPSHOT_DIR) / "CURRENT"
 
 
 def log(msg: str):
@@ -73,17 +80,46 @@ def clear_chroma(force: bool = False):
             metadata={"hnsw:space": "cosine"},
         )
         log(f"Коллекция '{COLLECTION_NAME}' создана заново (пустая).")
+        index_version.bump_version(INDEX_VERSION_FILE)  # кэш выдачи в retriever.py больше не действителен
+        if SNAPSHOT_CURRENT.exists():
+            SNAPSHOT_CURRENT.unlink()  # снимок старой коллекции больше не используется
+            log(f"Снимок коллекции отключён: {SNAPSHOT_CURRENT}")
+
+    # Индекс маршрутизации — центроиды чанков коллекции, удаляется вместе с ней
+    if ROUTING_COLLECTION in existing:
+        client.delete_collection(ROUTING_COLLECTION)
+        log(f"Индекс маршрутизации '{ROUTING_COLLECTION}' удалён.")
+
+    clear_lexical_index()
+
+
+def clear_lexical_index():
+    """BM25-индекс ссылается на IDs чанков коллекции — очищается вместе с ней."""
+    if not LEXICAL_INDEX_FILE.exists():
+        return
+    conn = lexical_index.open_index(LEXICAL_INDEX_FILE)
+    count = lexical_index.clear(conn)
+    conn.close()
+    log(f"LEXICAL_INDEX_FILE сброшен: {LEXICAL_INDEX_FILE} ({count} чанков)")
 
 
 def clear_state(force: bool = False):
-    if not INDEX_STATE_FILE.exists():
-        log(f"Файл состояния не найден: {INDEX_STATE_FILE} — пропускаем.")
+    if not INDEX_STATE_FILE.exists() and not INDEX_MANIFEST_FILE.exists():
+        log(f"Файл состояния не найден: {INDEX_MANIFEST_FILE} — пропускаем.")
         return
 
-    with open(INDEX_STATE_FILE, "r", encoding="utf-8") as f:
-        state = json.load(f)
+    state = {}
+    if INDEX_STATE_FILE.exists():
+        with open(INDEX_STATE_FILE, "r", encoding="utf-8") as f:
+            state = json.load(f)
+
+    conn = None
+    entries = {}
+    if INDEX_MANIFEST_FILE.exists():
+        conn = manifest.open_manifest(INDEX_MANIFEST_FILE)
+        entries = manifest.load_entries(conn)
 
-    count = len(state)
+    count = len(set(state) | set(entries))
 
     if not force:
         answer = input(
@@ -94,10 +130,17 @@ def clear_state(force: bool = False):
             log("Отменено.")
             sys.exit(0)
 
-    with open(INDEX_STATE_FILE, "w", encoding="utf-8") as f:
-        json.dump({}, f)
+    if conn is not None:
+        manifest.clear(conn)
+        conn.close()
+        log(f"INDEX_MANIFEST_FILE сброшен: {INDEX_MANIFEST_FILE}")
+
+    # Пустой JSON — чтобы манифест не подхватил старые хэши при пересоздании
+    if INDEX_STATE_FILE.exists():
+        with open(INDEX_STATE_FILE, "w", encoding="utf-8") as f:
+            json.dump({}, f)
 
-    log(f"INDEX_STATE_FILE сброшен: {INDEX_STATE_FILE} ({count} записей удалено).")
+    log(f"Состояние индексатора сброшено ({count} записей удалено).")
 
 
 def main():
@@ -110,13 +153,13 @@ def main():
     parser.add_argument(
         "--state-only",
         action="store_true",
-        help="Только сбросить INDEX_STATE_FILE, не трогать ChromaDB",
+        help="Только сбросить манифест (INDEX_MANIFEST_FILE/INDEX_STATE_FILE), не трогать ChromaDB",
     )
     args = parser.parse_args()
 
     log("=" * 60)
     log(f"ChromaDB: {CHROMA_HOST}:{CHROMA_PORT} / коллекция: {COLLECTION_NAME}")
-    log(f"INDEX_STATE_FILE: {INDEX_STATE_FILE}")
+    log(f"INDEX_MANIFEST_FILE: {INDEX_MANIFEST_FILE}")
     log("=" * 60)
 
     if args.state_only:
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""
+context.py — сборка контекста для answer.py из найденных чанков.
+
+Соседние чанки одного файла перекрываются на CHUNK_OVERLAP символов, а несколько
+вызовов retrieve_docs за ход часто находят куски одного места документа. Сборка:
+
+  1. Убирает повторы: чанк (source, chunk_index), уже выданный в этом ходе, не дублируется.
+  2. Склеивает соседние чанки одного файла (chunk_index подряд) в один блок,
+     вырезая перекрытие — общий хвост/начало соседей.
+  3. Упаковывает блоки в бюджет CONTEXT_MAX_TOKENS по приоритету: место лучшего
+     чанка блока в выдаче, затем номер вызова. Блок, который не влезает целиком,
+     обрезается по токенам (если остаток не меньше CONTEXT_MIN_TAIL_TOKENS), дальше
+     упаковка останавливается.
+
+Токены считает tiktoken: CONTEXT_TOKENIZER или кодировка модели OPENAI_MODEL.
+Файл кодировки tiktoken скачивает при первом обращении; без сети (закрытый контур)
+он берётся из TIKTOKEN_CACHE_DIR, а если нет и там — токены оцениваются по
+длине текста (_CHARS_PER_TOKEN символов на токен) с предупреждением в журнале.
+С CONTEXT_MAX_TOKENS=0 токены не считаются вовсе.
+Чанки без метаданных (старый индекс, веб-документы) остаются отдельными блоками.
+"""
+
+from datetime import datetime
+from functools import lru_cache
+
+from config.settings import settings
+from models.schemas import ContextBlock, RetrievedChunks
+
+SEPARATOR = "\n\n---\n\n"
+
+# Кодировка, если модель OPENAI_MODEL tiktoken не знает (прокси, локальные модели)
+_FALLBACK_ENCODING = "o200k_base"
+
+# Оценка без tiktoken: символов на токен
+_CHARS_PER_TOKEN = 4
+
+# Перекрытие короче — скорее совпадение, чем повтор: соседи склеиваются без вырезания
+_MIN_OVERLAP_CHARS = 8
+
+
+def log(msg: str):
+    ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    print(f"[{ts}] {msg}", flush=True)
+
+
+class CharEstimate:
+    """Замена кодировки tiktoken: «токен» — _CHARS_PER_TOKEN символов подряд."""
+
+    def encode(self, text: str, **kwargs) -> list[str]:
+        return [text[i:i + _CHARS_PER_TOKEN] for i in range(0, len(text), _CHARS_PER_TOKEN)]
+
+    def decode(self, tokens: list[str]) -> str:
+        return "".join(tokens)
+
+
+def load_encoding():
+    import tiktoken
+
+    if settings.CONTEXT_TOKENIZER:
+        return tiktoken.get_encoding(settings.CONTEXT_TOKENIZER)
+    try:
+        return tiktoken.encoding_for_model(settings.OPENAI_MODEL)
+    except KeyError:
+        return tiktoken.get_encoding(_FALLBACK_ENCODING)
+
+
+@lru_cache(maxsize=1)
+def get_encoding():
+    """Кодировка tiktoken; если файл кодировки не скачать и нет в кэше — CharEstimate."""
+    try:
+        return load_encoding()
+    except OSError as e:
+        # requests.ConnectionError / HTTPError — подклассы OSError
+        log(f"⚠️  Кодировка tiktoken недоступна ({e}); токены контекста оцениваются как "
+            f"len(text) // {_CHARS_PER_TOKEN}. Положите файл кодировки в TIKTOKEN_CACHE_DIR")
+        return CharEstimate()
+
+
+def count_tokens(text: str) -> int:
+    return len(get_encoding().encode(text, disallowed_special=()))
+
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    """Начало текста не длиннее max_tokens токенов, обрезанное по границе слова."""
+    encoding = get_encoding()
+    tokens = encoding.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    head = encoding.decode(tokens[:max_tokens]).rstrip("�")
+    cut = head.rfind(" ")
+    return (head[:cut] if cut > 0 else head).rstrip()
+
+
+def overlap_length(prev: str, nxt: str) -> int:
+    """Длина перекрытия: самый длинный конец prev, с которого начинается nxt."""
+    limit = min(len(prev), len(nxt), 2 * settings.CHUNK_OVERLAP)
+    for n in range(limit, _MIN_OVERLAP_CHARS - 1, -1):
+        if prev.endswith(nxt[:n]):
+            return n
+    return 0
+
+
+def join_adjacent(prev: str, nxt: str) -> tuple[str, int]:
+    """Склейка соседних чанков без повтора перекрытия; (текст, вырезано символов)."""
+    n = overlap_length(prev, nxt)
+    if n:
+        return prev + nxt[n:], n
+    return prev + "\n" + nxt, 0
+
+
+def chunk_key(meta: dict) -> tuple[str, int] | None:
+    """(source, chunk_index) чанка или None, если метаданных нет."""
+    source, index = meta.get("source"), meta.get("chunk_index")
+    if source and isinstance(index, int) and index >= 0:
+        return source, index
+    return None
+
+
+def dedupe(results: list[RetrievedChunks]) -> list[tuple]:
+    """(текст, chunk_key, сходство, ранг, вызов) уникальных чанков всех выдач хода."""
+    seen = set()
+    chunks = []
+    for call, found in enumerate(results):
+        for rank, (text, score) in enumerate(zip(found.texts, found.scores)):
+            key = chunk_key(found.metadata(rank))
+            if (key or text) in seen:
+                continue
+            seen.add(key or text)
+            chunks.append((text, key, score, (rank, call), call))
+    return chunks
+
+
+def merge_blocks(results: list[RetrievedChunks]) -> tuple[list[ContextBlock], dict]:
+    """Блоки контекста в порядке приоритета: соседние чанки одного файла склеены."""
+    blocks: list[ContextBlock] = []
+    by_source: dict[str, list] = {}
+    n_chunks = 0
+    for text, key, score, rank, call in dedupe(results):
+        n_chunks += 1
+        if key is not None:
+            source, index = key
+            by_source.setdefault(source, []).append((index, text, score, rank, call))
+        else:
+            blocks.append(ContextBlock(text, "", [], rank, call, [score]))
+
+    stripped = 0
+    for source, items in by_source.items():
+        items.sort(key=lambda x: x[0])
+        block = None
+        for index, text, score, rank, call in items:
+            if block is not None and index == block.chunk_indexes[-1] + 1:
+                block.text, cut = join_adjacent(block.text, text)
+                stripped += cut
+                block.chunk_indexes.append(index)
+                block.scores.append(score)
+                if rank < block.rank:
+                    block.rank, block.owner = rank, call
+                continue
+            block = ContextBlock(text, source, [index], rank, call, [score])
+            blocks.append(block)
+
+    blocks.sort(key=lambda b: b.rank)
+    return blocks, {"chunks": n_chunks, "blocks": len(blocks), "overlap_chars": stripped}
+
+
+def pack(blocks: list[ContextBlock], budget: int) -> list[ContextBlock]:
+    """Блоки, уложенные в budget токенов с учётом разделителей; 0 — без ограничения.
+
+    block.tokens должны быть уже посчитаны.
+    """
+    if budget <= 0:
+        return blocks
+
+    separator = count_tokens(SEPARATOR)
+    packed, used = [], 0
+    for block in blocks:
+        cost = block.tokens + (separator if packed else 0)
+        if used + cost <= budget:
+            packed.append(block)
+            used += cost
+            continue
+        room = budget - used - (separator if packed else 0)
+        if room >= settings.CONTEXT_MIN_TAIL_TOKENS:
+            block.text = truncate_tokens(block.text, room)
+            block.tokens = count_tokens(block.text)
+            packed.append(block)
+        break
+    return packed
+
+
+def assemble(results: list[RetrievedChunks]) -> tuple[list[list[ContextBlock]], dict]:
+    """Блоки контекста по вызовам retrieve_docs хода (в порядке results) и статистика.
+
+    Блок попадает в сообщение вызова, чей чанк в нём стоит выше всех в выдаче;
+    внутри сообщения блоки идут по приоритету.
+    """
+    blocks, stats = merge_blocks(results)
+    budget = settings.CONTEXT_MAX_TOKENS
+    if budget > 0:
+        for block in blocks:
+            block.tokens = count_tokens(block.text)
+    # Без бюджета токены не нужны: block.tokens остаются 0
+    tokens_in = sum(b.tokens for b in blocks)
+    packed = pack(blocks, budget)
+
+    per_call: list[list[ContextBlock]] = [[] for _ in results]
+    for block in packed:
+        per_call[block.owner].append(block)
+
+    stats.update({
+        "tokens_in": tokens_in,
+        "tokens_out": sum(b.tokens for b in packed),
+        "dropped_blocks": len(blocks) - len(packed),
+        "budget": budget,
+    })
+    return per_call, stats
+
+
+def render(blocks: list[ContextBlock]) -> str:
+    return SEPARATOR.join(b.text for b in blocks)
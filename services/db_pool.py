@@ -0,0 +1,123 @@
+"""
+db_pool.py — общий пул соединений с PostgreSQL на процесс.
+
+get_pool() возвращает psycopg_pool.ConnectionPool, которым пользуются:
+    checkpointer графа (PostgresSaver, graph/builder.py);
+    modules/feedback.py — init_feedback_table / save_feedback;
+    analytics/cluster_questions.py — load_all_questions.
+
+Раньше у checkpointer'а было одно соединение на все сессии Streamlit (запросы
+шли к нему по очереди), а фидбек и аналитика открывали новое на каждый вызов.
+
+Размер пула — POSTGRES_POOL_MIN_SIZE / POSTGRES_POOL_MAX_SIZE. Соединение
+проверяется перед выдачей (check_connection): разорванное закрывается и
+заменяется новым. Старше POSTGRES_POOL_MAX_LIFETIME секунд — пересоздаётся.
+
+Соединения в режиме autocommit с dict_row — так требует PostgresSaver.
+
+Метрики ожидания:
+    pool_stats() — счётчики psycopg_pool (запросы, очередь, суммарное ожидание,
+                   потерянные соединения) и p50 / p95 ожидания в connection();
+    ожидание дольше _SLOW_WAIT_MS пишется в журнал вместе со счётчиками.
+"""
+
+import atexit
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+from functools import lru_cache
+
+from psycopg.rows import dict_row
+from psycopg_pool import AsyncConnectionPool, ConnectionPool
+
+from config.settings import settings
+
+# Параметры соединений — как требует PostgresSaver / AsyncPostgresSaver
+CONNECTION_KWARGS = {"autocommit": True, "row_factory": dict_row, "prepare_threshold": 0}
+
+# Ожидание соединения дольше порога — в журнал
+_SLOW_WAIT_MS = 100.0
+
+# Ожидания последних вызовов connection(), мс
+_WAIT_WINDOW = 1000
+_waits = deque(maxlen=_WAIT_WINDOW)
+_waits_lock = threading.Lock()
+
+
+def log(msg: str):
+    ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    print(f"[{ts}] {msg}", flush=True)
+
+
+def pool_kwargs() -> dict:
+    return {
+        "min_size": settings.POSTGRES_POOL_MIN_SIZE,
+        "max_size": settings.POSTGRES_POOL_MAX_SIZE,
+        "timeout": settings.POSTGRES_POOL_TIMEOUT,
+        "max_lifetime": settings.POSTGRES_POOL_MAX_LIFETIME,
+        "kwargs": CONNECTION_KWARGS,
+    }
+
+
+@lru_cache(maxsize=1)
+def get_pool() -> ConnectionPool:
+    """Пул процесса; открывается при первом обращении, закрывается при выходе."""
+    pool = ConnectionPool(
+        settings.POSTGRES_URI,
+        check=ConnectionPool.check_connection,
+        name="app",
+        open=True,
+        **pool_kwargs(),
+    )
+    atexit.register(pool.close)
+    return pool
+
+
+async def open_async_pool() -> AsyncConnectionPool:
+    """Async пул с теми же настройками — для AsyncPostgresSaver (abuild_graph).
+
+    Привязан к event loop, в котором открыт, поэтому не кэшируется.
+    """
+    pool = AsyncConnectionPool(
+        settings.POSTGRES_URI,
+        check=AsyncConnectionPool.check_connection,
+        name="app-async",
+        open=False,
+        **pool_kwargs(),
+    )
+    await pool.open()
+    return pool
+
+
+@contextmanager
+def connection():
+    """Соединение из общего пула; время ожидания попадает в pool_stats()."""
+    pool = get_pool()
+    started = time.perf_counter()
+    with pool.connection() as conn:
+        wait_ms = (time.perf_counter() - started) * 1000
+        with _waits_lock:
+            _waits.append(wait_ms)
+        if wait_ms > _SLOW_WAIT_MS:
+            log(f"Ожидание соединения PostgreSQL {wait_ms:.0f} мс; пул: {pool_stats()}")
+        yield conn
+
+
+def pool_stats() -> dict:
+    """Счётчики пула и ожидание соединения (мс).
+
+    requests_num / requests_queued / requests_wait_ms / connections_lost — от psycopg_pool
+    и учитывают всех клиентов пула, включая checkpointer; wait_p50 / wait_p95 —
+    по последним вызовам connection().
+    """
+    stats = get_pool().get_stats()
+    if stats.get("requests_num"):
+        stats["wait_avg_ms"] = round(stats.get("requests_wait_ms", 0) / stats["requests_num"], 2)
+    with _waits_lock:
+        waits = sorted(_waits)
+    if waits:
+        stats["wait_p50_ms"] = round(waits[len(waits) // 2], 2)
+        stats["wait_p95_ms"] = round(waits[min(len(waits) - 1, int(len(waits) * 0.95))], 2)
+    return stats
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+embedding_cache.py — постоянный content-addressed кэш эмбеддингов чанков.
+
+Ключ — (имя модели, sha256 текста чанка), значение — вектор float32.
+Хранится в SQLite-файле EMBEDDING_CACHE_FILE. Одинаковый текст при любой
+модели векторизуется один раз: после правки одного абзаца переиндексация
+файла сводится к поиску векторов в кэше.
+"""
+
+import hashlib
+import sqlite3
+from array import array
+from pathlib import Path
+from typing import Callable
+
+# SQLite ограничивает число параметров в запросе — читаем пачками
+_LOOKUP_BATCH = 500
+
+
+def text_hash(text: str) -> str:
+    """sha256 текста чанка — ключ кэша."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def open_cache(path: Path) -> sqlite3.Connection:
+    """Открывает (и при необходимости создаёт) файл кэша."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS embeddings
+        (
+            model     TEXT NOT NULL,
+            text_hash TEXT NOT NULL,
+            vector    BLOB NOT NULL,
+            PRIMARY KEY (model, text_hash)
+        )
+    """)
+    conn.commit()
+    return conn
+
+
+def get_vectors(conn: sqlite3.Connection, model: str, hashes: list[str]) -> dict[str, list[float]]:
+    """Возвращает {text_hash: вектор} для найденных в кэше хэшей."""
+    found = {}
+    unique = list(dict.fromkeys(hashes))
+    for i in range(0, len(unique), _LOOKUP_BATCH):
+        part = unique[i:i + _LOOKUP_BATCH]
+        placeholders = ",".join("?" * len(part))
+        rows = conn.execute(
+            f"SELECT text_hash, vector FROM embeddings "
+            f"WHERE model = ? AND text_hash IN ({placeholders})",
+            [model, *part],
+        )
+        for h, blob in rows:
+            vector = array("f")
+            vector.frombytes(blob)
+            found[h] = vector.tolist()
+    return found
+
+
+def put_vectors(conn: sqlite3.Connection, model: str, vectors: dict[str, list[float]]):
+    """Сохраняет {text_hash: вектор} в кэш."""
+    conn.executemany(
+        "INSERT OR REPLACE INTO embeddings (model, text_hash, vector) VALUES (?, ?, ?)",
+        [(model, h, array("f", v).tobytes()) for h, v in vectors.items()],
+    )
+    conn.commit()
+
+
+def embed_with_cache(
+    conn: sqlite3.Connection,
+    model: str,
+    embed_documents: Callable[[list[str]], list[list[float]]],
+    texts: list[str],
+) -> tuple[list[list[float]], int]:
+    """Векторизует тексты, вызывая модель только для отсутствующих в кэше.
+
+    Returns:
+        (векторы в порядке texts, сколько текстов взято из кэша)
+    """
+    hashes = [text_hash(t) for t in texts]
+    vectors = get_vectors(conn, model, hashes)
+
+    missing = {h: t for h, t in zip(hashes, texts) if h not in vectors}
+    if missing:
+        fresh = dict(zip(missing, embed_documents(list(missing.values()))))
+        put_vectors(conn, model, fresh)
+        vectors.update(fresh)
+
+    hits = sum(1 for h in hashes if h not in missing)
+    return [vectors[h] for h in hashes], hits
@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+"""
+embedding_server.py — общий сервер эмбеддингов с динамическими микробатчами.
+
+Модель EMBEDDINGS_MODEL загружается один раз. Запросы всех процессов
+(чат, индексатор, аналитика) складываются в общую очередь; батчер ждёт
+не дольше EMBEDDING_SERVER_MAX_WAIT_MS от первого запроса в очереди,
+собирает до EMBEDDING_SERVER_MAX_BATCH текстов и векторизует их одним вызовом
+модели. Одиночные запросы чата из разных сессий так попадают в общий батч,
+а крупные батчи индексатора режутся на части и не блокируют чат надолго.
+
+HTTP API (TCP на localhost или Unix-сокет, см. EMBEDDING_SERVER_URL):
+    POST /embed    {"texts": [...]} → float32 little-endian n×dim, заголовок X-Embedding-Dim
+    GET  /metrics  глубина очереди, гистограмма размеров батчей, задержки (JSON)
+    GET  /health   "ok"
+
+Запросы и документы векторизуются одинаково: HuggingFaceEmbeddings.embed_query
+с настройками по умолчанию эквивалентен embed_documents([text])[0].
+
+Запуск:
+    python -m services.embedding_server
+    python -m services.embedding_server --url unix:///tmp/embeddings.sock
+Клиенты подключаются, если в .env задан тот же EMBEDDING_SERVER_URL.
+"""
+
+import argparse
+import json
+import os
+import socketserver
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+import numpy as np
+
+from config.settings import settings
+from services.embeddings import load_local_model
+
+EMBEDDINGS_MODEL = settings.EMBEDDINGS_MODEL
+EMBEDDING_SERVER_URL = settings.EMBEDDING_SERVER_URL or "http://127.0.0.1:8765"
+EMBEDDING_SERVER_MAX_BATCH = int(settings.EMBEDDING_SERVER_MAX_BATCH)
+EMBEDDING_SERVER_MAX_WAIT_MS = float(settings.EMBEDDING_SERVER_MAX_WAIT_MS)
+
+# Границы корзин гистограммы размеров батчей (верхние, включительно)
+_BATCH_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+
+def log(msg: str):
+    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] {msg}", flush=True)
+
+
+def batch_bucket(size: int) -> str:
+    for bound in _BATCH_BUCKETS:
+        if size <= bound:
+            return f"<={bound}"
+    return f">{_BATCH_BUCKETS[-1]}"
+
+
+_BUCKET_LABELS = [f"<={b}" for b in _BATCH_BUCKETS] + [f">{_BATCH_BUCKETS[-1]}"]
+
+
+# ── Микробатчер ──────────────────────────────────────────────────────────────
+
+class _Request:
+    """Запрос клиента: тексты, куда сложить векторы и сколько ещё ждём."""
+
+    def __init__(self, texts: list[str]):
+        self.texts = texts
+        self.vectors: list = [None] * len(texts)
+        self.remaining = len(texts)
+        self.error: Exception = None
+        self.enqueued_at = time.perf_counter()
+        self.done = threading.Event()
+
+
+class MicroBatcher:
+    """Очередь запросов и поток, векторизующий их общими батчами."""
+
+    def __init__(self, embed_documents, max_batch: int, max_wait_ms: float):
+        self.embed_documents = embed_documents
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        # Элементы очереди: (запрос, смещение первого ещё не взятого текста)
+        self._pending: deque[list] = deque()
+        self._pending_texts = 0
+        self._cond = threading.Condition()
+
+        self._stats_lock = threading.Lock()
+        self.requests = 0
+        self.batches = 0
+        self.texts = 0
+        self.max_batch_seen = 0
+        self.batch_sizes: Counter = Counter()
+        self.wait_seconds = 0.0      # сумма ожиданий запросов от постановки до ответа
+        self.model_seconds = 0.0     # сумма времени вызовов модели
+        self.started_at = time.time()
+
+        threading.Thread(target=self._loop, name="embed-batcher", daemon=True).start()
+
+    def embed(self, texts: list[str]) -> np.ndarray:
+        """Ставит тексты в очередь и ждёт векторы (вызывается из потоков HTTP-сервера)."""
+        request = _Request(texts)
+        with self._cond:
+            self._pending.append([request, 0])
+            self._pending_texts += len(texts)
+            self._cond.notify()
+        request.done.wait()
+        with self._stats_lock:
+            self.requests += 1
+            self.wait_seconds += time.perf_counter() - request.enqueued_at
+        if request.error is not None:
+            raise request.error
+        return np.asarray(request.vectors, dtype=np.float32)
+
+    def _take_batch(self) -> list[tuple[_Request, int, int]]:
+        """Ждёт наполнения батча или истечения окна и забирает до max_batch текстов."""
+        with self._cond:
+            while not self._pending:
+                self._cond.wait()
+            deadline = self._pending[0][0].enqueued_at + self.max_wait
+            while self._pending_texts < self.max_batch:
+                left = deadline - time.perf_counter()
+                if left <= 0:
+                    break
+                self._cond.wait(left)
+
+            parts = []
+            size = 0
+            while self._pending and size < self.max_batch:
+                item = self._pending[0]
+                request, start = item
+                end = min(len(request.texts), start + self.max_batch - size)
+                parts.append((request, start, end))
+                size += end - start
+                if end == len(request.texts):
+                    self._pending.popleft()
+                else:
+                    item[1] = end  # остаток крупного запроса уйдёт следующим батчем
+            self._pending_texts -= size
+            return parts
+
+    def _loop(self):
+        while True:
+            parts = self._take_batch()
+            texts = [t for request, start, end in parts for t in request.texts[start:end]]
+            started = time.perf_counter()
+            try:
+                vectors = self.embed_documents(texts)
+                error = None
+            except Exception as e:
+                vectors, error = None, e
+            elapsed = time.perf_counter() - started
+
+            with self._stats_lock:
+                self.batches += 1
+                self.texts += len(texts)
+                self.max_batch_seen = max(self.max_batch_seen, len(texts))
+                self.batch_sizes[batch_bucket(len(texts))] += 1
+                self.model_seconds += elapsed
+
+            offset = 0
+            for request, start, end in parts:
+                if error is not None:
+                    request.error = error
+                else:
+                    request.vectors[start:end] = vectors[offset:offset + end - start]
+                offset += end - start
+                request.remaining -= end - start
+                if request.remaining == 0 or error is not None:
+                    request.done.set()
+
+    def metrics(self) -> dict:
+        with self._cond:
+            queue_requests = len(self._pending)
+            queue_texts = self._pending_texts
+        with self._stats_lock:
+            return {
+                "model": EMBEDDINGS_MODEL,
+                "backend": settings.EMBEDDINGS_BACKEND,
+                "uptime_seconds": round(time.time() - self.started_at, 1),
+                "max_batch": self.max_batch,
+                "max_wait_ms": self.max_wait * 1000,
+                "queue_depth_requests": queue_requests,
+                "queue_depth_texts": queue_texts,
+                "requests": self.requests,
+                "batches": self.batches,
+                "texts": self.texts,
+                "avg_batch_size": round(self.texts / self.batches, 2) if self.batches else 0.0,
+                "max_batch_size": self.max_batch_seen,
+                "batch_size_histogram": {b: self.batch_sizes[b] for b in _BUCKET_LABELS if self.batch_sizes[b]},
+                "avg_request_ms": round(self.wait_seconds / self.requests * 1000, 2) if self.requests else 0.0,
+                "avg_model_ms_per_batch": round(self.model_seconds / self.batches * 1000, 2) if self.batches else 0.0,
+            }
+
+
+# ── HTTP ─────────────────────────────────────────────────────────────────────
+
+class EmbeddingHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive: клиенты держат соединение на поток
+    batcher: MicroBatcher = None
+
+    def _send(self, status: int, body: bytes, content_type: str, headers: dict = None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, status: int, payload: dict):
+        self._send(status, json.dumps(payload, ensure_ascii=False).encode("utf-8"), "application/json")
+
+    def do_GET(self):
+        if self.path == "/metrics":
+            self._send_json(200, self.batcher.metrics())
+        elif self.path == "/health":
+            self._send(200, b"ok", "text/plain")
+        else:
+            self._send_json(404, {"error": f"unknown path {self.path}"})
+
+    def do_POST(self):
+        if self.path != "/embed":
+            self._send_json(404, {"error": f"unknown path {self.path}"})
+            return
+        try:
+            payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            texts = payload["texts"]
+            if not isinstance(texts, list) or not all(isinstance(t, str) for t in texts):
+                raise ValueError("texts должен быть списком строк")
+        except (ValueError, KeyError) as e:
+            self._send_json(400, {"error": str(e)})
+            return
+
+        try:
+            vectors = self.batcher.embed(texts) if texts else np.empty((0, 0), dtype=np.float32)
+        except Exception as e:
+            self._send_json(500, {"error": f"{type(e).__name__}: {e}"})
+            return
+        self._send(
+            200,
+            vectors.astype("<f4").tobytes(),
+            "application/octet-stream",
+            {"X-Embedding-Dim": str(vectors.shape[1])},
+        )
+
+    def address_string(self) -> str:
+        # У Unix-сокета client_address — пустая строка
+        return self.client_address[0] if isinstance(self.client_address, tuple) else "unix"
+
+    def log_message(self, format, *args):
+        pass  # по строке на запрос — слишком шумно; сводка есть в /metrics
+
+
+# Очередь соединений с запасом: на Unix-сокете переполнение — сразу EAGAIN у клиента
+_LISTEN_BACKLOG = 128
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+    request_queue_size = _LISTEN_BACKLOG
+
+    def server_bind(self):
+        # как у HTTPServer.server_bind, но без getfqdn по адресу сокета
+        socketserver.UnixStreamServer.server_bind(self)
+        self.server_name, self.server_port = "localhost", 0
+
+
+def make_server(url: str, batcher: MicroBatcher):
+    """HTTP-сервер на адресе url (http://host:port или unix:///path)."""
+    handler = type("Handler", (EmbeddingHandler,), {"batcher": batcher})
+    parts = urlsplit(url)
+    if parts.scheme == "unix":
+        if os.path.exists(parts.path):
+            os.unlink(parts.path)  # сокет от предыдущего запуска
+        return ThreadingUnixHTTPServer(parts.path, handler)
+    server_class = type("Server", (ThreadingHTTPServer,), {"request_queue_size": _LISTEN_BACKLOG})
+    return server_class((parts.hostname, parts.port), handler)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Общий сервер эмбеддингов с микробатчами")
+    parser.add_argument("--url", default=EMBEDDING_SERVER_URL, help="http://host:port или unix:///path")
+    parser.add_argument("--max-batch", type=int, default=EMBEDDING_SERVER_MAX_BATCH)
+    parser.add_argument("--max-wait-ms", type=float, default=EMBEDDING_SERVER_MAX_WAIT_MS)
+    args = parser.parse_args()
+
+    log(f"Загружаем модель эмбеддингов: {EMBEDDINGS_MODEL} ({settings.EMBEDDINGS_BACKEND})")
+    model = load_local_model()
+    batcher = MicroBatcher(model.embed_documents, args.max_batch, args.max_wait_ms)
+    server = make_server(args.url, batcher)
+    log(f"Сервер эмбеддингов: {args.url} (батч до {args.max_batch}, окно {args.max_wait_ms} мс)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        log("Остановка")
+    finally:
+        server.server_close()
+        parts = urlsplit(args.url)
+        if parts.scheme == "unix" and os.path.exists(parts.path):
+            os.unlink(parts.path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+embeddings.py — единая точка получения модели эмбеддингов.
+
+get_embeddings() возвращает объект с интерфейсом LangChain Embeddings
+(embed_documents / embed_query):
+    EMBEDDING_SERVER_URL пуст  — модель в текущем процессе;
+    EMBEDDING_SERVER_URL задан — EmbeddingClient к общему серверу
+                                 services/embedding_server.py.
+
+Бэкенд локальной модели (и модели на сервере) — EMBEDDINGS_BACKEND:
+    torch     — HuggingFaceEmbeddings, fp32 PyTorch;
+    onnx-int8 — OnnxEmbeddings, квантизированный ONNX на CPU (services/onnx_embeddings.py).
+
+Адрес сервера:
+    http://127.0.0.1:8765          — TCP на localhost
+    unix:///tmp/embeddings.sock    — Unix-сокет
+
+Пользуются retriever.py, indexer.py и analytics/cluster_questions.py —
+с сервером модель загружается в память один раз на машину, а не в каждом процессе.
+"""
+
+import http.client
+import json
+import socket
+import threading
+from functools import lru_cache
+from urllib.parse import urlsplit
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from config.settings import settings
+
+
+BACKENDS = ("torch", "onnx-int8")
+
+
+def load_torch_model():
+    """HuggingFaceEmbeddings (fp32 PyTorch) в текущем процессе."""
+    from langchain_huggingface import HuggingFaceEmbeddings
+    return HuggingFaceEmbeddings(model_name=settings.EMBEDDINGS_MODEL)
+
+
+def load_local_model() -> Embeddings:
+    """Загружает модель бэкенда EMBEDDINGS_BACKEND в текущий процесс."""
+    if settings.EMBEDDINGS_BACKEND == "torch":
+        return load_torch_model()
+    if settings.EMBEDDINGS_BACKEND == "onnx-int8":
+        from services.onnx_embeddings import OnnxEmbeddings, model_dir
+        return OnnxEmbeddings(model_dir(), threads=settings.EMBEDDINGS_ONNX_THREADS)
+    raise ValueError(f"Неизвестный EMBEDDINGS_BACKEND={settings.EMBEDDINGS_BACKEND!r}, допустимо: {BACKENDS}")
+
+
+def embeddings_cache_key() -> str:
+    """Ключ модели в кэше эмбеддингов: векторы разных бэкендов не смешиваются."""
+    if settings.EMBEDDINGS_BACKEND == "torch":
+        return settings.EMBEDDINGS_MODEL  # как до появления бэкендов — старый кэш остаётся валидным
+    return f"{settings.EMBEDDINGS_MODEL}@{settings.EMBEDDINGS_BACKEND}"
+
+
+@lru_cache(maxsize=1)
+def get_embeddings() -> Embeddings:
+    """Клиент общего сервера эмбеддингов или локальная модель (по EMBEDDING_SERVER_URL)."""
+    if settings.EMBEDDING_SERVER_URL:
+        return EmbeddingClient(settings.EMBEDDING_SERVER_URL, timeout=settings.EMBEDDING_SERVER_TIMEOUT)
+    return load_local_model()
+
+
+# ── Клиент ───────────────────────────────────────────────────────────────────
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    """HTTP поверх Unix-сокета."""
+
+    def __init__(self, socket_path: str, timeout: float):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.socket_path)
+        self.sock = sock
+
+
+class EmbeddingClient(Embeddings):
+    """Клиент services/embedding_server.py.
+
+    Держит keep-alive соединение на каждый поток: параллельные запросы разных
+    сессий Streamlit приходят на сервер одновременно и попадают в один микробатч.
+    """
+
+    def __init__(self, url: str, timeout: float = 60.0):
+        self.url = url
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self) -> http.client.HTTPConnection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            parts = urlsplit(self.url)
+            if parts.scheme == "unix":
+                conn = _UnixHTTPConnection(parts.path, timeout=self.timeout)
+            else:
+                conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=self.timeout)
+            self._local.conn = conn
+        return conn
+
+    def _request(self, method: str, path: str, body: bytes = None) -> http.client.HTTPResponse:
+        headers = {"Content-Type": "application/json"} if body is not None else {}
+        # Одна повторная попытка: сервер мог закрыть простаивающее keep-alive соединение
+        for attempt in range(2):
+            conn = self._connection()
+            try:
+                conn.request(method, path, body=body, headers=headers)
+                response = conn.getresponse()
+            except (ConnectionError, http.client.HTTPException, OSError) as e:
+                conn.close()
+                self._local.conn = None
+                if attempt:
+                    raise ConnectionError(f"Сервер эмбеддингов недоступен ({self.url}): {e}") from e
+                continue
+            if response.status != 200:
+                detail = response.read().decode("utf-8", "replace")
+                raise RuntimeError(f"Сервер эмбеддингов вернул {response.status}: {detail}")
+            return response
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        if not texts:
+            return []
+        body = json.dumps({"texts": list(texts)}, ensure_ascii=False).encode("utf-8")
+        response = self._request("POST", "/embed", body)
+        dim = int(response.getheader("X-Embedding-Dim"))
+        # Ответ — сырые float32 (little-endian), n × dim
+        vectors = np.frombuffer(response.read(), dtype="<f4").reshape(len(texts), dim)
+        return vectors.tolist()
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.embed_documents([text])[0]
+
+    def metrics(self) -> dict:
+        """Метрики сервера: глубина очереди, размеры батчей, задержки."""
+        return json.loads(self._request("GET", "/metrics").read())
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+index_queue.py — очередь заданий индексации в PostgreSQL (таблица index_jobs).
+
+Координатор (indexer.py --enqueue) ставит изменённые файлы в очередь,
+воркеры (indexer.py --worker) на любом числе узлов забирают задания через
+SELECT ... FOR UPDATE SKIP LOCKED, индексируют и фиксируют результат
+по каждому файлу. Задание воркера, который перестал обновлять heartbeat_at
+дольше INDEX_JOB_TIMEOUT секунд, снова становится доступным — если попыток
+было меньше INDEX_JOB_MAX_ATTEMPTS, иначе задание помечается failed
+(файл, на котором воркер падает, не роняет воркеры по кругу).
+
+Статусы: queued → running → done / failed.
+Результаты done координатор переносит в свой манифест при следующем запуске.
+"""
+
+from typing import Callable
+
+import psycopg
+from psycopg.types.json import Jsonb
+
+from models.schemas import IndexJob
+
+
+def init_jobs_table(conn: psycopg.Connection):
+    """Создаёт таблицу index_jobs если не существует."""
+    conn.execute("""
+                 CREATE TABLE IF NOT EXISTS index_jobs
+                 (
+                     path TEXT PRIMARY KEY,
+                     hash TEXT NOT NULL,
+                     mtime_ns BIGINT,
+                     size BIGINT,
+                     old_chunk_ids JSONB,
+                     chunk_ids JSONB,
+                     status TEXT NOT NULL DEFAULT 'queued'
+                         CHECK (status IN ('queued', 'running', 'done', 'failed')),
+                     worker TEXT,
+                     attempts INT NOT NULL DEFAULT 0,
+                     error TEXT,
+                     enqueued_at TIMESTAMPTZ DEFAULT now(),
+                     heartbeat_at TIMESTAMPTZ,
+                     finished_at TIMESTAMPTZ
+                     )
+                 """)
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS index_jobs_status_idx ON index_jobs (status, enqueued_at)"
+    )
+    conn.commit()
+
+
+def enqueue(conn: psycopg.Connection, path: str, file_hash: str, mtime_ns: int, size: int,
+            old_chunk_ids: list[str] = None) -> bool:
+    """Ставит файл в очередь. Возвращает False, если та же версия уже в работе или в очереди.
+
+    Если прежнее задание по файлу ещё выполнялось или упало, его воркер мог успеть
+    загрузить часть чанков: old_chunk_ids тогда не сохраняются, и воркер сверяется
+    с коллекцией по source.
+    """
+    row = conn.execute(
+        """INSERT INTO index_jobs (path, hash, mtime_ns, size, old_chunk_ids)
+           VALUES (%s, %s, %s, %s, %s)
+           ON CONFLICT (path) DO UPDATE SET
+               hash = excluded.hash, mtime_ns = excluded.mtime_ns, size = excluded.size,
+               old_chunk_ids = CASE WHEN index_jobs.status IN ('running', 'failed')
+                                    THEN NULL ELSE excluded.old_chunk_ids END,
+               chunk_ids = NULL,
+               status = 'queued', worker = NULL, attempts = 0, error = NULL,
+               enqueued_at = now(), heartbeat_at = NULL, finished_at = NULL
+           WHERE index_jobs.hash <> excluded.hash OR index_jobs.status = 'failed'
+           RETURNING path""",
+        (path, file_hash, mtime_ns, size,
+         Jsonb(old_chunk_ids) if old_chunk_ids is not None else None),
+    ).fetchone()
+    conn.commit()
+    return row is not None
+
+
+def claim_jobs(conn: psycopg.Connection, worker: str, limit: int, timeout: int,
+               max_attempts: int) -> list[IndexJob]:
+    """Забирает до limit заданий: из очереди и «брошенные» упавшими воркерами.
+
+    Брошенные задания, у которых уже max_attempts попыток, помечаются failed.
+    """
+    conn.execute(
+        """UPDATE index_jobs
+           SET status = 'failed', error = %s, finished_at = now()
+           WHERE status = 'running' AND attempts >= %s
+             AND heartbeat_at < now() - make_interval(secs => %s)""",
+        (f"воркер не завершил задание за {max_attempts} попыток", max_attempts, timeout),
+    )
+    rows = conn.execute(
+        """UPDATE index_jobs
+           SET status = 'running', worker = %s, attempts = attempts + 1, heartbeat_at = now()
+           WHERE path IN (
+               SELECT path FROM index_jobs
+               WHERE status = 'queued'
+                  OR (status = 'running' AND heartbeat_at < now() - make_interval(secs => %s))
+               ORDER BY enqueued_at
+               LIMIT %s
+               FOR UPDATE SKIP LOCKED
+           )
+           RETURNING path, hash, mtime_ns, size, old_chunk_ids, attempts""",
+        (worker, timeout, limit),
+    ).fetchall()
+    conn.commit()
+    return [
+        IndexJob(
+            path=r[0],
+            hash=r[1],
+            mtime_ns=r[2],
+            size=r[3],
+            old_chunk_ids=r[4],
+            attempts=r[5],
+        )
+        for r in rows
+    ]
+
+
+def heartbeat(conn: psycopg.Connection, worker: str):
+    """Продлевает аренду всех заданий воркера."""
+    conn.execute(
+        "UPDATE index_jobs SET heartbeat_at = now() WHERE worker = %s AND status = 'running'",
+        (worker,),
+    )
+    conn.commit()
+
+
+def finish_job(conn: psycopg.Connection, worker: str, path: str, mtime_ns: int, size: int,
+               file_hash: str, chunk_ids: list[str]) -> bool:
+    """Фиксирует проиндексированный файл.
+
+    Условие по worker и hash: если задание успели переназначить или файл
+    поставили в очередь заново, результат устаревший и не записывается.
+    """
+    row = conn.execute(
+        """UPDATE index_jobs
+           SET status = 'done', chunk_ids = %s, mtime_ns = %s, size = %s, finished_at = now()
+           WHERE path = %s AND hash = %s AND worker = %s AND status = 'running'
+           RETURNING path""",
+        (Jsonb(chunk_ids), mtime_ns, size, path, file_hash, worker),
+    ).fetchone()
+    conn.commit()
+    return row is not None
+
+
+def fail_jobs(conn: psycopg.Connection, worker: str, paths: list[str], error: str):
+    """Помечает незавершённые задания воркера как failed."""
+    conn.execute(
+        """UPDATE index_jobs SET status = 'failed', error = %s, finished_at = now()
+           WHERE path = ANY(%s) AND worker = %s AND status = 'running'""",
+        (error, paths, worker),
+    )
+    conn.commit()
+
+
+def take_finished(conn: psycopg.Connection, apply: Callable[[str, int, int, str, list[str]], None]) -> int:
+    """Переносит результаты done в манифест координатора и удаляет их из очереди.
+
+    apply(path, mtime_ns, size, hash, chunk_ids) вызывается для каждого результата;
+    удаление фиксируется только после успешного переноса всех записей.
+    """
+    rows = conn.execute(
+        """DELETE FROM index_jobs WHERE status = 'done'
+           RETURNING path, mtime_ns, size, hash, chunk_ids"""
+    ).fetchall()
+    try:
+        for r in rows:
+            apply(*r)
+    except Exception:
+        conn.rollback()
+        raise
+    conn.commit()
+    return len(rows)
+
+
+def queue_stats(conn: psycopg.Connection) -> dict[str, int]:
+    """{статус: число заданий}."""
+    rows = conn.execute("SELECT status, count(*) FROM index_jobs GROUP BY status").fetchall()
+    return {r[0]: r[1] for r in rows}
@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+"""
+index_version.py — версия содержимого коллекции (INDEX_VERSION_FILE).
+
+Индексатор меняет версию после каждого прохода, изменившего коллекцию;
+retriever.py включает её в ключ кэша выдачи, поэтому после переиндексации
+старые результаты не используются. Чтение — один маленький файл,
+без обращения к ChromaDB.
+"""
+
+import os
+import time
+from pathlib import Path
+
+
+def read_version(path: Path) -> str:
+    """Текущая версия или "0", если индексатор ещё не записывал её."""
+    try:
+        return path.read_text(encoding="utf-8").strip() or "0"
+    except FileNotFoundError:
+        return "0"
+
+
+def bump_version(path: Path) -> str:
+    """Записывает новую версию (атомарно: через временный файл и os.replace)."""
+    version = str(time.time_ns())
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    tmp.write_text(version, encoding="utf-8")
+    os.replace(tmp, path)
+    return version
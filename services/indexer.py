@@ -1,20 +1,81 @@
 #!/usr/bin/env python3
 """
 indexer.py — сканирует FOLDER_PATH, загружает/обновляет эмбеддинги в ChromaDB.
-Отслеживает изменения файлов через MD5-хэши, хранит состояние в INDEX_STATE_FILE.
+Отслеживает изменения файлов через mtime/размер и MD5-хэши, хранит состояние
+в SQLite-манифесте INDEX_MANIFEST_FILE (services/manifest.py). Каждый файл
+фиксируется в манифесте сразу после загрузки его чанков — прерванный запуск
+продолжается с места остановки.
 Запускается вручную или по cron.
 
+Изменённые файлы обрабатываются конвейером:
+    нарезка в пуле процессов → эмбеддинги батчами по EMBED_BATCH_SIZE чанков
+    из разных файлов → upsert в ChromaDB в пуле потоков (не более UPSERT_QUEUE_SIZE
+    батчей в очереди). Модель эмбеддингов не простаивает, пока идёт нарезка и HTTP.
+
+Файлы крупнее STREAM_SPLIT_THRESHOLD байт не загружаются целиком: читаются
+блоками по STREAM_READ_SIZE символов, чанки выдаются генератором и уходят
+в тот же конвейер окнами по EMBED_BATCH_SIZE — пиковая память не зависит
+от размера файла.
+
+IDs чанков зависят от текста, а не от позиции, поэтому для изменённого файла
+считается дифф: удаляются только пропавшие чанки, векторизуются и загружаются
+только новые. Векторы берутся из постоянного кэша EMBEDDING_CACHE_FILE
+(services/embedding_cache.py), модель вызывается только для промахов.
+
+Вместе с манифестом обновляется лексический BM25-индекс LEXICAL_INDEX_FILE
+(services/lexical_index.py) — по тем же IDs чанков. Если он пуст, а коллекция
+нет, индекс один раз собирается из ChromaDB. В распределённом режиме индекс
+ведёт координатор, перенося результаты воркеров.
+
+Каждый проход, изменивший коллекцию, меняет версию в INDEX_VERSION_FILE
+(services/index_version.py) — по ней retriever.py сбрасывает кэш выдачи.
+С SNAPSHOT_EXPORT=true под той же версией выгружается снимок коллекции
+для RETRIEVAL_MODE=snapshot (services/snapshot.py) — не чаще раза в
+SNAPSHOT_MIN_INTERVAL секунд; в режиме --watch отложенный снимок выгружается,
+когда интервал истечёт.
+
+С ROUTING_INDEX=true вместе с лексическим индексом ведётся индекс маршрутизации
+ROUTING_COLLECTION (services/routing_index.py) — центроид чанков каждого файла
+для двухуровневого поиска retriever.py.
+
 Пример cron (каждые 10 минут):
     */10 * * * * /usr/bin/python3 /path/to/services/indexer.py >> /var/log/indexer.log 2>&1
+
+Распределённый режим — очередь заданий в PostgreSQL (services/index_queue.py):
+    python services/indexer.py --enqueue        # координатор: скан и постановка в очередь
+    python services/indexer.py --worker         # воркер, сколько угодно на любых узлах
+    python services/indexer.py --worker --drain # воркер, который выходит, когда очередь пуста
+FOLDER_PATH должен быть доступен воркерам по тому же пути.
+
+Режим демона (--watch): модель и клиент ChromaDB загружаются один раз,
+изменения ловятся событиями файловой системы (watchdog/inotify) с задержкой
+WATCH_DEBOUNCE секунд, раз в CHECK_INTERVAL секунд — полный пересчёт на случай
+пропущенных событий:
+    python services/indexer.py --watch
 """
 
+import argparse
 import hashlib
-import json
+import itertools
+import multiprocessing
+import os
+import socket
 import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from functools import lru_cache, partial
 from pathlib import Path
+from typing import Callable, Iterable, Iterator
 from datetime import datetime
 
 from config.settings import settings
+from models.schemas import IndexedFile
+from services import index_queue, index_version, lexical_index, manifest, routing_index, snapshot
+from services.embedding_cache import embed_with_cache, open_cache
+from services.embeddings import embeddings_cache_key
 
 FOLDER_PATH      = Path(settings.FOLDER_PATH)
 CHROMA_HOST      = settings.CHROMA_HOST
@@ -22,8 +83,38 @@ CHROMA_PORT      = int(settings.CHROMA_PORT)
 COLLECTION_NAME  = settings.COLLECTION_NAME
 EMBEDDINGS_MODEL = settings.EMBEDDINGS_MODEL
 INDEX_STATE_FILE = Path(settings.INDEX_STATE_FILE)
+INDEX_MANIFEST_FILE = Path(settings.INDEX_MANIFEST_FILE)
+LEXICAL_INDEX_FILE = Path(settings.LEXICAL_INDEX_FILE)
+INDEX_VERSION_FILE = Path(settings.INDEX_VERSION_FILE)
+SNAPSHOT_EXPORT  = bool(settings.SNAPSHOT_EXPORT)
+SNAPSHOT_DIR     = Path(settings.SNAPSHOT_DIR)
+SNAPSHOT_DTYPE   = settings.SNAPSHOT_DTYPE
+SNAPSHOT_MIN_INTERVAL = float(settings.SNAPSHOT_MIN_INTERVAL)
+ROUTING_INDEX    = bool(settings.ROUTING_INDEX)
+ROUTING_COLLECTION = settings.ROUTING_COLLECTION
 CHUNK_SIZE       = int(settings.CHUNK_SIZE)
 CHUNK_OVERLAP    = int(settings.CHUNK_OVERLAP)
+STREAM_SPLIT_THRESHOLD = int(settings.STREAM_SPLIT_THRESHOLD)
+STREAM_READ_SIZE = int(settings.STREAM_READ_SIZE)
+SPLIT_WORKERS    = int(settings.SPLIT_WORKERS)
+EMBED_BATCH_SIZE = int(settings.EMBED_BATCH_SIZE)
+UPSERT_WORKERS   = int(settings.UPSERT_WORKERS)
+UPSERT_QUEUE_SIZE = int(settings.UPSERT_QUEUE_SIZE)
+EMBEDDING_CACHE_FILE = Path(settings.EMBEDDING_CACHE_FILE)
+CHECK_INTERVAL   = int(settings.CHECK_INTERVAL)
+WATCH_DEBOUNCE   = float(settings.WATCH_DEBOUNCE)
+POSTGRES_URI     = settings.POSTGRES_URI
+INDEX_JOB_TIMEOUT = int(settings.INDEX_JOB_TIMEOUT)
+INDEX_CLAIM_BATCH = int(settings.INDEX_CLAIM_BATCH)
+INDEX_POLL_INTERVAL = float(settings.INDEX_POLL_INTERVAL)
+INDEX_JOB_MAX_ATTEMPTS = int(settings.INDEX_JOB_MAX_ATTEMPTS)
+
+
+# Суммарное время стадий за процесс: hash, split, embed, upsert.
+# Стадии идут параллельно (split — в нескольких процессах, upsert — в нескольких
+# потоках), поэтому сумма может быть больше общего времени индексации.
+STAGE_SECONDS: Counter = Counter()
+_stage_lock = threading.Lock()
 
 
 # ── Вспомогательные функции ──────────────────────────────────────────────────
@@ -32,6 +123,21 @@ def log(msg: str):
     print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] {msg}", flush=True)
 
 
+def add_stage_time(stage: str, seconds: float):
+    with _stage_lock:
+        STAGE_SECONDS[stage] += seconds
+
+
+@contextmanager
+def timed(stage: str):
+    """Добавляет время выполнения блока к STAGE_SECONDS[stage]."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_stage_time(stage, time.perf_counter() - started)
+
+
 def md5_file(path: Path) -> str:
     """Считает MD5-хэш файла."""
     h = hashlib.md5()
@@ -41,19 +147,13 @@ def md5_file(path: Path) -> str:
     return h.hexdigest()
 
 
-def load_state() -> dict:
-    """Загружает сохранённое состояние хэшей {filepath: md5}."""
-    if INDEX_STATE_FILE.exists():
-        with open(INDEX_STATE_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
-    return {}
+def open_manifest():
+    """Открывает манифест индекса (при первом запуске переносит INDEX_STATE_FILE)."""
+    return manifest.open_manifest(INDEX_MANIFEST_FILE, legacy_state_file=INDEX_STATE_FILE)
 
 
-def save_state(state: dict):
-    """Сохраняет состояние хэшей на диск."""
-    INDEX_STATE_FILE.parent.mkdir(parents=True, exist_ok=True)
-    with open(INDEX_STATE_FILE, "w", encoding="utf-8") as f:
-        json.dump(state, f, ensure_ascii=False, indent=2)
+def open_lexical_index():
+    return lexical_index.open_index(LEXICAL_INDEX_FILE)
 
 
 def scan_txt_files() -> dict[str, Path]:
@@ -64,10 +164,19 @@ def scan_txt_files() -> dict[str, Path]:
     return {str(p): p for p in FOLDER_PATH.rglob("*.txt")}
 
 
-def doc_ids_for_file(filepath: str, n_chunks: int) -> list[str]:
-    """Генерирует стабильные IDs чанков для файла: <md5_path>_chunk_0, _chunk_1 ..."""
+def doc_ids_for_file(filepath: str, texts: Iterable[str]) -> Iterator[str]:
+    """Генерирует стабильные IDs чанков файла: <md5_path>_<md5_текста>_<номер повтора>.
+
+    ID не зависит от позиции чанка — абзац, который не менялся, сохраняет свой ID
+    при правках соседних абзацев. Номер повтора различает одинаковые чанки в одном файле.
+    """
     base = hashlib.md5(filepath.encode()).hexdigest()
-    return [f"{base}_chunk_{i}" for i in range(n_chunks)]
+    seen: dict[str, int] = {}
+    for text in texts:
+        h = hashlib.md5(text.encode("utf-8")).hexdigest()
+        n = seen.get(h, 0)
+        seen[h] = n + 1
+        yield f"{base}_{h}_{n}"
 
 
 # ── Основная логика ──────────────────────────────────────────────────────────
@@ -83,68 +192,511 @@ def get_chroma_collection():
     return client, collection
 
 
+def ensure_lexical_index(lexical_conn, collection):
+    """Собирает лексический индекс из коллекции, если он пуст (первый запуск после обновления)."""
+    if lexical_index.count(lexical_conn) == 0 and collection.count() > 0:
+        log("Лексический индекс пуст — собираем из ChromaDB")
+        log(f"  Проиндексировано чанков: {lexical_index.rebuild_from_collection(lexical_conn, collection)}")
+
+
+@lru_cache(maxsize=1)
+def get_routing_collection():
+    """Коллекция маршрутизации ROUTING_COLLECTION (один вектор на файл)."""
+    import chromadb
+    client = chromadb.HttpClient(host=CHROMA_HOST, port=CHROMA_PORT)
+    return routing_index.open_collection(client, ROUTING_COLLECTION)
+
+
+def ensure_routing_index(collection):
+    """Собирает индекс маршрутизации из коллекции, если он пуст (ROUTING_INDEX включили на готовой базе)."""
+    if not ROUTING_INDEX:
+        return
+    routing = get_routing_collection()
+    if routing_index.count(routing) == 0 and collection.count() > 0:
+        log("Индекс маршрутизации пуст — собираем из ChromaDB")
+        log(f"  Документов: {routing_index.rebuild_from_collection(routing, collection)}")
+
+
+def remove_from_routing(filepath_str: str):
+    if ROUTING_INDEX:
+        routing_index.remove_source(get_routing_collection(), filepath_str)
+
+
+def file_committer(collection, manifest_conn, lexical_conn) -> Callable[..., None]:
+    """mark_committed для локальной индексации и координатора.
+
+    Сначала лексический индекс и индекс маршрутизации, потом манифест: при сбое
+    между ними файл остаётся pending, и повторная синхронизация по тем же IDs
+    ничего не испортит.
+    """
+    fetch_texts = lexical_index.chroma_text_fetcher(collection)
+
+    def commit(filepath_str: str, mtime_ns: int, size: int, file_hash: str, chunk_ids: list[str]):
+        lexical_index.sync_file(lexical_conn, filepath_str, chunk_ids, fetch_texts)
+        if ROUTING_INDEX:
+            routing_index.sync_source(get_routing_collection(), collection, filepath_str)
+        manifest.mark_committed(manifest_conn, filepath_str, mtime_ns, size, file_hash, chunk_ids)
+
+    return commit
+
+
+# Выгрузка снимка: время последней (time.monotonic) и версия, отложенная из-за SNAPSHOT_MIN_INTERVAL
+_snapshot_export: dict = {"at": None, "version": None}
+
+
+def publish_index_version(collection):
+    """Меняет версию коллекции и (SNAPSHOT_EXPORT) выгружает снимок под этой версией.
+
+    Снимок — полная выгрузка коллекции, поэтому не чаще раза в SNAPSHOT_MIN_INTERVAL
+    секунд: более частая версия откладывается до export_pending_snapshot().
+    """
+    version = index_version.bump_version(INDEX_VERSION_FILE)
+    if SNAPSHOT_EXPORT:
+        _snapshot_export["version"] = version
+        if not export_pending_snapshot(collection):
+            log(f"Снимок отложен: с прошлой выгрузки меньше {SNAPSHOT_MIN_INTERVAL:g} с")
+
+
+def export_pending_snapshot(collection) -> bool:
+    """Выгружает отложенный снимок, если интервал истёк. True — снимка в ожидании нет."""
+    version, last = _snapshot_export["version"], _snapshot_export["at"]
+    if version is None:
+        return True
+    if last is not None and time.monotonic() - last < SNAPSHOT_MIN_INTERVAL:
+        return False
+    with timed("snapshot"):
+        path = snapshot.export_snapshot(collection, SNAPSHOT_DIR, SNAPSHOT_DTYPE, version)
+    _snapshot_export.update(at=time.monotonic(), version=None)
+    log(f"Снимок коллекции: {path}")
+    return True
+
+
+@lru_cache(maxsize=1)
 def get_embeddings_model():
-    """Инициализирует модель эмбеддингов (один раз)."""
-    from langchain_huggingface import HuggingFaceEmbeddings
-    log(f"Загружаем модель эмбеддингов: {EMBEDDINGS_MODEL}")
-    return HuggingFaceEmbeddings(model_name=EMBEDDINGS_MODEL)
+    """Модель эмбеддингов (один раз, при первом промахе кэша): локальная или клиент общего сервера."""
+    from services.embeddings import get_embeddings
+    if settings.EMBEDDING_SERVER_URL:
+        log(f"Эмбеддинги через сервер: {settings.EMBEDDING_SERVER_URL}")
+    else:
+        log(f"Загружаем модель эмбеддингов: {EMBEDDINGS_MODEL} ({settings.EMBEDDINGS_BACKEND})")
+    return get_embeddings()
 
 
-def split_file(filepath: Path) -> list:
-    """Загружает и разбивает один .txt файл на чанки через LangChain."""
-    from langchain_community.document_loaders import TextLoader
+def get_splitter(add_start_index: bool = False):
+    """Сплиттер с параметрами индексатора."""
     from langchain_text_splitters import RecursiveCharacterTextSplitter
 
-    loader = TextLoader(str(filepath), encoding="utf-8")
-    docs = loader.load()
-
-    splitter = RecursiveCharacterTextSplitter(
+    return RecursiveCharacterTextSplitter(
         chunk_size=CHUNK_SIZE,
         chunk_overlap=CHUNK_OVERLAP,
         length_function=len,
         separators=["\n\n", "\n", " ", ""],
+        add_start_index=add_start_index,
     )
-    return splitter.split_documents(docs)
 
 
-def delete_file_chunks(collection, filepath: str):
-    """Удаляет все чанки файла из коллекции по метаданным source."""
-    results = collection.get(where={"source": filepath})
-    ids_to_delete = results.get("ids", [])
+def split_file(filepath: Path) -> list:
+    """Загружает и разбивает один .txt файл на чанки через LangChain."""
+    from langchain_community.document_loaders import TextLoader
+
+    loader = TextLoader(str(filepath), encoding="utf-8")
+    docs = loader.load()
+    return get_splitter().split_documents(docs)
+
+
+def iter_file_chunks(filepath: Path) -> Iterator[str]:
+    """Потоковая нарезка большого файла: читает по STREAM_READ_SIZE символов.
+
+    Буфер (хвост + новый блок) режется сплиттером; все чанки, кроме последнего,
+    отдаются сразу. Последний может быть обрезан границей блока, поэтому текст
+    начиная с него переносится в следующий буфер и режется заново — перекрытие
+    CHUNK_OVERLAP между соседними чанками сохраняется, а хвост не больше чанка.
+    """
+    splitter = get_splitter(add_start_index=True)
+    carry = ""
+    last = ""
+    with open(filepath, "r", encoding="utf-8") as f:
+        while True:
+            block = f.read(STREAM_READ_SIZE)
+            buffer = carry + block
+            docs = splitter.create_documents([buffer])
+            if block:
+                if not docs:
+                    carry = buffer
+                    continue
+                carry = buffer[docs[-1].metadata["start_index"]:]
+                docs = docs[:-1]
+
+            for i, doc in enumerate(docs):
+                # Хвост начинается с перекрытия: если из него вышел чанк, целиком
+                # повторяющий конец предыдущего, — при цельной нарезке его бы не было
+                if i == 0 and last and last.endswith(doc.page_content):
+                    continue
+                last = doc.page_content
+                yield last
+
+            if not block:
+                return
+
+
+def split_file_texts(filepath: Path) -> tuple[list[str], float]:
+    """Тексты чанков файла и время нарезки. Выполняется в пуле процессов — возвращает
+    только строки, чтобы не гонять через pickle объекты Document."""
+    started = time.perf_counter()
+    texts = [c.page_content for c in split_file(filepath)]
+    return texts, time.perf_counter() - started
+
+
+def iter_chunk_records(filepath: Path, texts: Iterable[str]) -> Iterator[tuple[str, str, dict]]:
+    """Выдаёт (id, текст, метаданные) для каждого чанка файла по мере поступления текстов."""
+    texts_for_ids, texts = itertools.tee(texts)
+    ids = doc_ids_for_file(str(filepath), texts_for_ids)
+    for i, (doc_id, text) in enumerate(zip(ids, texts)):
+        yield (
+            doc_id,
+            text,
+            {
+                "source": str(filepath),
+                "filename": filepath.name,
+                "chunk_index": i,
+            },
+        )
+
+
+def chunk_records(filepath: Path, texts: list[str]) -> list[tuple[str, str, dict]]:
+    """Собирает (id, текст, метаданные) для всех чанков файла."""
+    return list(iter_chunk_records(filepath, texts))
+
+
+def delete_file_chunks(collection, filepath: str, chunk_ids: list[str] = None):
+    """Удаляет все чанки файла из коллекции.
+
+    IDs берутся из манифеста; поиск по метаданным source — только если их там нет
+    (запись из старого JSON-состояния или прерванная индексация).
+    """
+    if chunk_ids is None:
+        chunk_ids = collection.get(where={"source": filepath}).get("ids", [])
+    ids_to_delete = chunk_ids
     if ids_to_delete:
         collection.delete(ids=ids_to_delete)
         log(f"  Удалено чанков: {len(ids_to_delete)} для {Path(filepath).name}")
 
 
-def upsert_file(collection, embeddings_model, filepath: Path):
-    """Разбивает файл на чанки и загружает в ChromaDB."""
-    chunks = split_file(filepath)
-    if not chunks:
-        log(f"  WARN: нет чанков в {filepath.name}")
-        return 0
-
-    texts = [c.page_content for c in chunks]
-    vectors = embeddings_model.embed_documents(texts)
-    ids = doc_ids_for_file(str(filepath), len(chunks))
-    metadatas = [
-        {
-            "source": str(filepath),
-            "filename": filepath.name,
-            "chunk_index": i,
-        }
-        for i in range(len(chunks))
-    ]
-
-    collection.upsert(
-        ids=ids,
-        embeddings=vectors,
-        documents=texts,
-        metadatas=metadatas,
-    )
-    return len(chunks)
-
-
-def run():
+def existing_chunks(collection, filepath_str: str, old_ids: list[str] = None) -> dict[str, int]:
+    """{id: chunk_index} чанков файла, которые уже лежат в ChromaDB.
+
+    old_ids — IDs из манифеста в порядке chunk_index; если их нет, старые чанки
+    ищутся в коллекции по метаданным source.
+    """
+    if old_ids is not None:
+        return {i: n for n, i in enumerate(old_ids)}
+    existing = collection.get(where={"source": filepath_str}, include=["metadatas"])
+    return {
+        i: (meta or {}).get("chunk_index")
+        for i, meta in zip(existing.get("ids", []), existing.get("metadatas") or [])
+    }
+
+
+def new_chunk_records(collection, records: list[tuple[str, str, dict]], old: dict[str, int]) -> list:
+    """Возвращает записи, которых в коллекции ещё нет: их нужно векторизовать.
+
+    Сохранившиеся, но сдвинувшиеся (другой chunk_index) чанки только обновляют метаданные.
+    """
+    moved = [(i, meta) for i, _, meta in records if i in old and old[i] != meta["chunk_index"]]
+    if moved:
+        collection.update(ids=[i for i, _ in moved], metadatas=[m for _, m in moved])
+    return [r for r in records if r[0] not in old]
+
+
+def diff_file_chunks(collection, filepath_str: str, records: list[tuple[str, str, dict]],
+                     old_ids: list[str] = None) -> list:
+    """Сравнивает новые чанки файла с тем, что уже лежит в ChromaDB.
+
+    Пропавшие чанки удаляются, возвращаются только новые записи (см. new_chunk_records).
+    """
+    old = existing_chunks(collection, filepath_str, old_ids)
+    new_ids = {r[0] for r in records}
+
+    stale = [i for i in old if i not in new_ids]
+    if stale:
+        collection.delete(ids=stale)
+
+    fresh = new_chunk_records(collection, records, old)
+    log(f"  Чанков: новых {len(fresh)}, удалено {len(stale)}, "
+        f"без изменений {len(records) - len(fresh)}")
+    return fresh
+
+
+def upsert_batch(collection, ids: list[str], vectors: list, texts: list[str], metadatas: list[dict]):
+    """Загружает готовый батч (уже с эмбеддингами) в ChromaDB."""
+    with timed("upsert"):
+        collection.upsert(
+            ids=ids,
+            embeddings=vectors,
+            documents=texts,
+            metadatas=metadatas,
+        )
+
+
+def index_files(collection, cache_conn, files_to_update: list, entries: dict[str, IndexedFile],
+                mark_pending: Callable[[str, str], None], mark_committed: Callable[..., None]) -> int:
+    """Конвейерная индексация изменённых файлов.
+
+    - нарезка идёт в пуле процессов, в работе не больше 2 * SPLIT_WORKERS файлов;
+      файлы крупнее STREAM_SPLIT_THRESHOLD режутся потоково в основном процессе;
+    - по каждому файлу считается дифф с коллекцией, дальше идут только новые чанки;
+    - новые чанки разных файлов копятся в общий батч и векторизуются одним вызовом
+      (через кэш эмбеддингов — модель видит только промахи);
+    - готовые батчи уходят в пул потоков на upsert, пока модель считает следующий.
+
+    Перед диффом вызывается mark_pending(path, md5), а mark_committed(path, mtime_ns,
+    size, md5, chunk_ids) — только когда загружены все новые чанки файла (оба вызова
+    из основного потока). Для локального запуска это запись в SQLite-манифест,
+    для воркера очереди — в строку задания в Postgres. Файл, чей upsert упал,
+    остаётся pending и будет переиндексирован следующим запуском.
+    Возвращает число загруженных чанков.
+    """
+    started = time.perf_counter()
+    total_chunks = 0
+    cache_hits = 0
+    batch: list[tuple[str, str, dict]] = []
+    upsert_futures = []
+    upsert_slots = threading.BoundedSemaphore(UPSERT_QUEUE_SIZE)
+    small_files = [f for f in files_to_update if f[4] <= STREAM_SPLIT_THRESHOLD]
+    large_files = [f for f in files_to_update if f[4] > STREAM_SPLIT_THRESHOLD]
+    pending_files = iter(small_files)
+    splitting = {}
+
+    # Учёт незагруженных чанков по файлам: файл фиксируется, когда счётчик дошёл до нуля.
+    # Одна лишняя единица держит файл открытым, пока не известны все его чанки (seal)
+    remaining: dict[str, int] = {}
+    to_commit: dict[str, tuple] = {}
+    ready: list[str] = []
+    ready_lock = threading.Lock()
+
+    def on_upserted(file_counts: Counter):
+        with ready_lock:
+            for filepath_str, n in file_counts.items():
+                remaining[filepath_str] -= n
+                if remaining[filepath_str] == 0:
+                    ready.append(filepath_str)
+
+    def track(filepath_str: str, n: int):
+        with ready_lock:
+            remaining[filepath_str] = remaining.get(filepath_str, 0) + n
+
+    def seal(filepath_str: str):
+        on_upserted(Counter({filepath_str: 1}))
+
+    def commit_ready():
+        # SQLite-соединение используется только из основного потока
+        with ready_lock:
+            done = ready[:]
+            ready.clear()
+        for filepath_str in done:
+            remaining.pop(filepath_str, None)
+            mark_committed(filepath_str, *to_commit.pop(filepath_str))
+
+    def check_upserts():
+        # Пробрасываем ошибку upsert как можно раньше, а не в самом конце
+        for fut in [f for f in upsert_futures if f.done()]:
+            fut.result()
+            upsert_futures.remove(fut)
+        commit_ready()
+
+    def flush(records: list[tuple[str, str, dict]]):
+        nonlocal total_chunks, cache_hits
+        ids, texts, metadatas = (list(col) for col in zip(*records))
+        with timed("embed"):
+            vectors, hits = embed_with_cache(
+                cache_conn,
+                embeddings_cache_key(),
+                lambda missing: get_embeddings_model().embed_documents(missing),
+                texts,
+            )
+        cache_hits += hits
+        check_upserts()
+        upsert_slots.acquire()  # ограниченная очередь: ждём, если upsert не успевает
+        file_counts = Counter(meta["source"] for meta in metadatas)
+
+        def on_done(f):
+            upsert_slots.release()
+            if f.exception() is None:
+                on_upserted(file_counts)
+
+        fut = upsert_pool.submit(upsert_batch, collection, ids, vectors, texts, metadatas)
+        fut.add_done_callback(on_done)
+        upsert_futures.append(fut)
+        total_chunks += len(records)
+        elapsed = time.perf_counter() - started
+        log(f"  Батч: {len(records)} чанков (из кэша {hits}), "
+            f"всего {total_chunks} ({total_chunks / elapsed:.1f} чанков/сек)")
+
+    def add_records(records: list[tuple[str, str, dict]]):
+        batch.extend(records)
+        while len(batch) >= EMBED_BATCH_SIZE:
+            flush(batch[:EMBED_BATCH_SIZE])
+            del batch[:EMBED_BATCH_SIZE]
+
+    def index_large_file(filepath_str: str, filepath: Path, new_hash: str, mtime_ns: int, size: int):
+        # Текст и векторы держим только в пределах окна; растёт лишь список IDs
+        entry = entries.get(filepath_str)
+        action = "Обновление" if entry else "Добавление"
+        log(f"{action}: {filepath.name} (потоковая нарезка, {size / 2**20:.1f} МБ)")
+
+        mark_pending(filepath_str, new_hash)
+        old = existing_chunks(collection, filepath_str, entry.chunk_ids if entry and entry.committed else None)
+        track(filepath_str, 1)
+
+        new_ids: list[str] = []
+        n_fresh = 0
+        records = iter_chunk_records(filepath, iter_file_chunks(filepath))
+        while True:
+            with timed("split"):
+                window = list(itertools.islice(records, EMBED_BATCH_SIZE))
+            if not window:
+                break
+            new_ids.extend(r[0] for r in window)
+            fresh = new_chunk_records(collection, window, old)
+            n_fresh += len(fresh)
+            track(filepath_str, len(fresh))
+            add_records(fresh)
+
+        # Пропавшие чанки удаляем в конце — до этого старая версия остаётся в поиске
+        kept = set(new_ids)
+        stale = [i for i in old if i not in kept]
+        if stale:
+            collection.delete(ids=stale)
+        log(f"  Чанков: новых {n_fresh}, удалено {len(stale)}, без изменений {len(new_ids) - n_fresh}")
+
+        to_commit[filepath_str] = (mtime_ns, size, new_hash, new_ids)
+        seal(filepath_str)
+
+    def submit_splits():
+        while len(splitting) < SPLIT_WORKERS * 2:
+            item = next(pending_files, None)
+            if item is None:
+                return
+            splitting[split_pool.submit(split_file_texts, item[1])] = item
+
+    if len(small_files) >= SPLIT_WORKERS:
+        # spawn: дочерние процессы не наследуют потоки torch от загруженной модели
+        split_executor = ProcessPoolExecutor(
+            max_workers=SPLIT_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    else:
+        # Пара файлов (типично для --watch) — запуск процессов дороже самой нарезки
+        split_executor = ThreadPoolExecutor(max_workers=1)
+
+    with split_executor as split_pool, \
+            ThreadPoolExecutor(max_workers=UPSERT_WORKERS) as upsert_pool:
+        submit_splits()
+        while splitting:
+            done, _ = wait(splitting, return_when=FIRST_COMPLETED)
+            for fut in done:
+                filepath_str, filepath, new_hash, mtime_ns, size = splitting.pop(fut)
+                texts, split_seconds = fut.result()
+                add_stage_time("split", split_seconds)
+
+                entry = entries.get(filepath_str)
+                action = "Обновление" if entry else "Добавление"
+                log(f"{action}: {filepath.name} ({len(texts)} чанков)")
+                if not texts:
+                    log(f"  WARN: нет чанков в {filepath.name}")
+
+                mark_pending(filepath_str, new_hash)
+                records = chunk_records(filepath, texts)
+                old_ids = entry.chunk_ids if entry and entry.committed else None
+
+                # Дифф до постановки в очередь upsert: пропавшие чанки удаляются сразу
+                fresh = diff_file_chunks(collection, filepath_str, records, old_ids)
+                to_commit[filepath_str] = (mtime_ns, size, new_hash, [r[0] for r in records])
+                track(filepath_str, len(fresh) + 1)
+                seal(filepath_str)
+                add_records(fresh)
+            submit_splits()
+            check_upserts()
+
+        for item in large_files:
+            index_large_file(*item)
+
+        if batch:
+            flush(batch)
+
+        for fut in upsert_futures:
+            fut.result()
+        commit_ready()
+
+    elapsed = time.perf_counter() - started
+    rate = total_chunks / elapsed if elapsed > 0 else 0.0
+    log(f"Загружено чанков: {total_chunks} (из кэша эмбеддингов {cache_hits}) "
+        f"за {elapsed:.1f} с ({rate:.1f} чанков/сек)")
+    log("Время стадий (суммарно по процессам/потокам): "
+        + ", ".join(f"{k} {v:.1f} с" for k, v in sorted(STAGE_SECONDS.items())))
+    return total_chunks
+
+
+def find_changes(manifest_conn, entries: dict[str, IndexedFile], candidates: dict[str, Path]) -> list:
+    """Возвращает [(filepath_str, filepath, md5, mtime_ns, size)] для файлов, которые нужно индексировать.
+
+    Быстрый путь: зафиксированный файл с теми же mtime и размером пропускается
+    по одному stat, без чтения. Если изменился только mtime, а MD5 прежний —
+    в манифесте обновляется stat. Файлы в статусе pending переиндексируются всегда.
+    """
+    files_to_update = []
+    for filepath_str, filepath in candidates.items():
+        stat = filepath.stat()
+        entry = entries.get(filepath_str)
+        committed = entry is not None and entry.committed
+        if committed and entry.mtime_ns == stat.st_mtime_ns and entry.size == stat.st_size:
+            continue
+
+        with timed("hash"):
+            current_hash = md5_file(filepath)
+        if committed and entry.hash == current_hash:
+            manifest.touch(manifest_conn, filepath_str, stat.st_mtime_ns, stat.st_size)
+            continue
+
+        files_to_update.append((filepath_str, filepath, current_hash, stat.st_mtime_ns, stat.st_size))
+    return files_to_update
+
+
+def apply_changes(collection, manifest_conn, lexical_conn, entries: dict[str, IndexedFile],
+                  files_to_update: list, deleted_files: list[str]) -> int:
+    """Индексирует изменённые файлы и удаляет пропавшие, фиксируя каждый файл в манифесте.
+
+    Возвращает число загруженных чанков. Версия индекса меняется в любом случае —
+    даже прерванный проход мог успеть изменить коллекцию.
+    """
+    n_chunks = 0
+    try:
+        if files_to_update:
+            cache_conn = open_cache(EMBEDDING_CACHE_FILE)
+            try:
+                n_chunks = index_files(
+                    collection, cache_conn, files_to_update, entries,
+                    mark_pending=partial(manifest.mark_pending, manifest_conn),
+                    mark_committed=file_committer(collection, manifest_conn, lexical_conn),
+                )
+            finally:
+                cache_conn.close()
+
+        for filepath_str in deleted_files:
+            log(f"Удаление (файл пропал): {Path(filepath_str).name}")
+            entry = entries[filepath_str]
+            delete_file_chunks(collection, filepath_str, entry.chunk_ids if entry.committed else None)
+            lexical_index.remove_source(lexical_conn, filepath_str)
+            remove_from_routing(filepath_str)
+            manifest.remove(manifest_conn, filepath_str)
+    finally:
+        publish_index_version(collection)
+
+    return n_chunks
+
+
+def run() -> int:
+    """Однократная индексация. Возвращает число загруженных чанков."""
     log("=" * 60)
     log(f"Старт индексации: {FOLDER_PATH}")
     log(f"ChromaDB: {CHROMA_HOST}:{CHROMA_PORT} / коллекция: {COLLECTION_NAME}")
@@ -152,43 +704,301 @@ def run():
     _, collection = get_chroma_collection()
     log(f"Документов в коллекции до старта: {collection.count()}")
 
-    state = load_state()
+    manifest_conn = open_manifest()
+    lexical_conn = open_lexical_index()
+    ensure_lexical_index(lexical_conn, collection)
+    ensure_routing_index(collection)
+    entries = manifest.load_entries(manifest_conn)
     current_files = scan_txt_files()
     log(f"Найдено .txt файлов: {len(current_files)}")
 
-    files_to_update = []
-    for filepath_str, filepath in current_files.items():
-        current_hash = md5_file(filepath)
-        saved_hash = state.get(filepath_str)
-        if current_hash != saved_hash:
-            files_to_update.append((filepath_str, filepath, current_hash))
-
-    deleted_files = [fp for fp in state if fp not in current_files]
+    files_to_update = find_changes(manifest_conn, entries, current_files)
+    deleted_files = [fp for fp in entries if fp not in current_files]
 
     if not files_to_update and not deleted_files:
         log("Изменений нет. Выход.")
-        return
-
-    embeddings_model = get_embeddings_model()
-
-    for filepath_str, filepath, new_hash in files_to_update:
-        action = "Обновление" if filepath_str in state else "Добавление"
-        log(f"{action}: {filepath.name}")
-        delete_file_chunks(collection, filepath_str)
-        n = upsert_file(collection, embeddings_model, filepath)
-        log(f"  Загружено чанков: {n}")
-        state[filepath_str] = new_hash
+        manifest_conn.close()
+        lexical_conn.close()
+        return 0
 
-    for filepath_str in deleted_files:
-        log(f"Удаление (файл пропал): {Path(filepath_str).name}")
-        delete_file_chunks(collection, filepath_str)
-        del state[filepath_str]
+    resumed = sum(1 for fp, *_ in files_to_update if fp in entries and not entries[fp].committed)
+    if resumed:
+        log(f"Продолжаем прерванную индексацию: {resumed} файлов в статусе pending")
 
-    save_state(state)
+    try:
+        n_chunks = apply_changes(collection, manifest_conn, lexical_conn, entries, files_to_update, deleted_files)
+    finally:
+        manifest_conn.close()
+        lexical_conn.close()
     log(f"Документов в коллекции после: {collection.count()}")
     log("Индексация завершена.")
     log("=" * 60)
+    return n_chunks
+
+
+# ── Режим демона ─────────────────────────────────────────────────────────────
+
+def watch():
+    """Долгоживущий режим: события ФС с debounce + периодический полный пересчёт.
+
+    Модель эмбеддингов и клиент ChromaDB создаются один раз при старте.
+    """
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+
+    pending: set[str] = set()
+    pending_lock = threading.Lock()
+    last_event = 0.0
+    rescan_requested = False
+
+    class ChangeHandler(FileSystemEventHandler):
+        def on_any_event(self, event):
+            nonlocal last_event, rescan_requested
+            if event.event_type in ("opened", "closed_no_write"):
+                return
+            with pending_lock:
+                if event.is_directory:
+                    # Переименование/удаление папки — проще пересканировать всё дерево
+                    if event.event_type in ("moved", "deleted"):
+                        rescan_requested = True
+                else:
+                    for path in (event.src_path, getattr(event, "dest_path", "")):
+                        if path and Path(path).suffix == ".txt":
+                            pending.add(str(Path(path)))
+                last_event = time.monotonic()
+
+    log("=" * 60)
+    log(f"Старт демона индексации: {FOLDER_PATH}")
+    log(f"ChromaDB: {CHROMA_HOST}:{CHROMA_PORT} / коллекция: {COLLECTION_NAME}")
+    log(f"Debounce: {WATCH_DEBOUNCE} с, полный пересчёт: раз в {CHECK_INTERVAL} с")
+
+    _, collection = get_chroma_collection()
+    get_embeddings_model()  # загружаем заранее — дальше события не платят за загрузку
+    manifest_conn = open_manifest()
+    lexical_conn = open_lexical_index()
+    ensure_lexical_index(lexical_conn, collection)
+    ensure_routing_index(collection)
+
+    def sync(candidates: dict[str, Path], gone: list[str]):
+        # Манифест фиксируется пофайлово, поэтому просто перечитываем его перед каждым проходом
+        entries = manifest.load_entries(manifest_conn)
+        try:
+            files_to_update = find_changes(manifest_conn, entries, candidates)
+            deleted_files = [fp for fp in gone if fp in entries]
+            if not files_to_update and not deleted_files:
+                return
+            apply_changes(collection, manifest_conn, lexical_conn, entries, files_to_update, deleted_files)
+            log(f"Документов в коллекции: {collection.count()}")
+        except Exception as e:
+            # Недоделанные файлы остались pending — их подберёт следующий проход
+            log(f"ERROR: {e}")
+
+    def full_rescan():
+        current_files = scan_txt_files()
+        log(f"Полный пересчёт: {len(current_files)} .txt файлов")
+        indexed = manifest.load_entries(manifest_conn)
+        sync(current_files, [fp for fp in indexed if fp not in current_files])
+
+    observer = Observer()
+    observer.schedule(ChangeHandler(), str(FOLDER_PATH), recursive=True)
+    observer.start()
+
+    full_rescan()
+    last_rescan = time.monotonic()
+    try:
+        while True:
+            time.sleep(0.5)
+            now = time.monotonic()
+
+            with pending_lock:
+                quiet = now - last_event >= WATCH_DEBOUNCE
+                paths = set(pending) if quiet else set()
+                pending.difference_update(paths)
+                force_rescan = rescan_requested and quiet
+                if force_rescan:
+                    rescan_requested = False
+
+            if force_rescan or now - last_rescan >= CHECK_INTERVAL:
+                full_rescan()
+                last_rescan = time.monotonic()
+            elif paths:
+                existing = {p: Path(p) for p in paths if Path(p).is_file()}
+                sync(existing, [p for p in paths if p not in existing])
+
+            if SNAPSHOT_EXPORT:
+                try:
+                    export_pending_snapshot(collection)
+                except Exception as e:
+                    # Версия остаётся отложенной — повторим на следующем тике
+                    log(f"ERROR: снимок: {e}")
+    except KeyboardInterrupt:
+        log("Остановка демона.")
+    finally:
+        observer.stop()
+        observer.join()
+        manifest_conn.close()
+        lexical_conn.close()
+
+
+# ── Распределённый режим ─────────────────────────────────────────────────────
+
+def enqueue_changes():
+    """Координатор: забирает результаты воркеров в манифест и ставит изменения в очередь.
+
+    Удалённые файлы обрабатываются сразу здесь — это дешёвый delete по IDs.
+    """
+    import psycopg
+
+    log("=" * 60)
+    log(f"Постановка в очередь: {FOLDER_PATH}")
+
+    _, collection = get_chroma_collection()
+    manifest_conn = open_manifest()
+    lexical_conn = open_lexical_index()
+    try:
+        ensure_lexical_index(lexical_conn, collection)
+        ensure_routing_index(collection)
+        with psycopg.connect(POSTGRES_URI) as pg:
+            index_queue.init_jobs_table(pg)
+            taken = index_queue.take_finished(pg, file_committer(collection, manifest_conn, lexical_conn))
+            log(f"Результатов воркеров перенесено в манифест: {taken}")
+            if taken:
+                publish_index_version(collection)
+
+            entries = manifest.load_entries(manifest_conn)
+            current_files = scan_txt_files()
+            log(f"Найдено .txt файлов: {len(current_files)}")
+
+            queued = 0
+            for filepath_str, _, new_hash, mtime_ns, size in find_changes(manifest_conn, entries, current_files):
+                entry = entries.get(filepath_str)
+                old_ids = entry.chunk_ids if entry and entry.committed else None
+                queued += index_queue.enqueue(pg, filepath_str, new_hash, mtime_ns, size, old_ids)
+            log(f"Поставлено в очередь: {queued}")
+
+            deleted_files = [fp for fp in entries if fp not in current_files]
+            if deleted_files:
+                apply_changes(collection, manifest_conn, lexical_conn, entries, [], deleted_files)
+
+            log(f"Очередь: {index_queue.queue_stats(pg)}")
+    finally:
+        manifest_conn.close()
+        lexical_conn.close()
+    log("=" * 60)
+
+
+def work(drain: bool = False):
+    """Воркер: забирает задания пачками по INDEX_CLAIM_BATCH и индексирует их конвейером.
+
+    Каждый файл фиксируется в очереди (done) сразу после загрузки его чанков.
+    Фоновый поток продлевает аренду заданий, пока процесс жив; задания убитого
+    воркера через INDEX_JOB_TIMEOUT секунд забирают другие.
+    """
+    import psycopg
+
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    log("=" * 60)
+    log(f"Старт воркера {worker_id}")
+    log(f"ChromaDB: {CHROMA_HOST}:{CHROMA_PORT} / коллекция: {COLLECTION_NAME}")
+
+    _, collection = get_chroma_collection()
+    get_embeddings_model()
+    pg = psycopg.connect(POSTGRES_URI)
+    index_queue.init_jobs_table(pg)
+    cache_conn = open_cache(EMBEDDING_CACHE_FILE)
+
+    stop = threading.Event()
+
+    def keep_alive():
+        # Отдельное соединение: основное занято индексацией в основном потоке
+        with psycopg.connect(POSTGRES_URI) as hb_conn:
+            while not stop.wait(INDEX_JOB_TIMEOUT / 3):
+                index_queue.heartbeat(hb_conn, worker_id)
+
+    threading.Thread(target=keep_alive, daemon=True).start()
+
+    try:
+        while True:
+            jobs = index_queue.claim_jobs(
+                pg, worker_id, INDEX_CLAIM_BATCH, INDEX_JOB_TIMEOUT, INDEX_JOB_MAX_ATTEMPTS,
+            )
+            if not jobs:
+                if drain:
+                    log("Очередь пуста. Выход.")
+                    break
+                time.sleep(INDEX_POLL_INTERVAL)
+                continue
+
+            log(f"Взято заданий: {len(jobs)}")
+            files_to_update = []
+            entries = {}
+            for job in jobs:
+                filepath = Path(job.path)
+                if not filepath.is_file():
+                    index_queue.fail_jobs(pg, worker_id, [job.path], "файл не найден")
+                    continue
+                files_to_update.append((job.path, filepath, job.hash, job.mtime_ns, job.size))
+                # Повторная попытка: прежний воркер мог загрузить часть чанков, которых нет
+                # в old_chunk_ids, — без записи в entries дифф идёт по коллекции (source)
+                if job.old_chunk_ids is not None and job.attempts <= 1:
+                    entries[job.path] = IndexedFile(
+                        path=job.path, hash=job.hash, status="committed", chunk_ids=job.old_chunk_ids,
+                    )
+
+            try:
+                index_files(
+                    collection, cache_conn, files_to_update, entries,
+                    mark_pending=lambda filepath_str, file_hash: None,
+                    mark_committed=partial(index_queue.finish_job, pg, worker_id),
+                )
+            except Exception as e:
+                # Уже зафиксированные файлы остаются done, остальные — failed до следующего --enqueue
+                log(f"ERROR: {e}")
+                index_queue.fail_jobs(pg, worker_id, [f[0] for f in files_to_update], str(e))
+            finally:
+                # Видно только процессам на этом узле; остальным — после переноса координатором
+                index_version.bump_version(INDEX_VERSION_FILE)
+    except KeyboardInterrupt:
+        log("Остановка воркера.")
+    finally:
+        stop.set()
+        cache_conn.close()
+        pg.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Индексация FOLDER_PATH в ChromaDB")
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="Работать демоном: следить за изменениями файлов и индексировать сразу",
+    )
+    parser.add_argument(
+        "--enqueue",
+        action="store_true",
+        help="Координатор: поставить изменённые файлы в очередь заданий в PostgreSQL",
+    )
+    parser.add_argument(
+        "--worker",
+        action="store_true",
+        help="Воркер: забирать задания из очереди и индексировать",
+    )
+    parser.add_argument(
+        "--drain",
+        action="store_true",
+        help="С --worker: завершиться, когда очередь опустеет",
+    )
+    args = parser.parse_args()
+
+    if args.watch:
+        watch()
+    elif args.enqueue:
+        enqueue_changes()
+    elif args.worker:
+        work(drain=args.drain)
+    else:
+        run()
 
 
 if __name__ == "__main__":
-    run()
\ No newline at end of file
+    main()
@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+"""
+lexical_index.py — лексический (BM25) индекс чанков во встроенной SQLite FTS5.
+
+Дополняет векторный поиск: точные термины — названия форм, систем, номера —
+плотные эмбеддинги часто теряют. Индекс строится и обновляется indexer.py
+по тем же IDs чанков, что и в ChromaDB, и хранится в LEXICAL_INDEX_FILE.
+retriever.py объединяет его выдачу с векторной через reciprocal rank fusion.
+
+Токенизация учитывает русский язык: нижний регистр, ё → е, стемминг Snowball
+для кириллических слов. Составные обозначения («2-НДФЛ», «1С:ЗУП», «ст. 81.1»)
+индексируются и целиком, и по частям.
+
+Ранжирование — встроенная функция bm25() FTS5 (k1 = 1.2, b = 0.75).
+
+Пересборка из коллекции ChromaDB (например, после смены токенизации):
+    python -m services.lexical_index --rebuild
+"""
+
+import argparse
+import re
+import sqlite3
+from functools import lru_cache
+from pathlib import Path
+from typing import Callable, Iterable
+
+# Слово — буквы/цифры; составное обозначение — слова через - . / :
+_TOKEN_RE = re.compile(r"\w+(?:[-./:]\w+)*")
+_CYRILLIC_RE = re.compile(r"[а-я]")
+
+# SQLite ограничивает число параметров в запросе — работаем пачками
+_SQL_BATCH = 500
+
+
+# ── Токенизация ──────────────────────────────────────────────────────────────
+
+@lru_cache(maxsize=1)
+def _russian_stemmer():
+    import snowballstemmer
+    return snowballstemmer.stemmer("russian")
+
+
+@lru_cache(maxsize=100_000)
+def _stem(word: str) -> str:
+    if _CYRILLIC_RE.search(word):
+        return _russian_stemmer().stemWord(word)
+    return word
+
+
+def tokenize(text: str) -> list[str]:
+    """Термы для индекса и запроса: стеммы слов и склеенные через _ составные обозначения."""
+    terms = []
+    for match in _TOKEN_RE.finditer(text.lower().replace("ё", "е")):
+        parts = re.split(r"[-./:]", match.group())
+        stems = [_stem(p) for p in parts if p]
+        terms.extend(stems)
+        if len(stems) > 1:
+            terms.append("_".join(stems))
+    return terms
+
+
+# ── Хранилище ────────────────────────────────────────────────────────────────
+
+def open_index(path: Path, readonly: bool = False) -> sqlite3.Connection:
+    """Открывает индекс. В режиме readonly (retriever) файл не создаётся."""
+    if readonly:
+        return sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS chunks
+        (
+            rowid  INTEGER PRIMARY KEY,
+            id     TEXT UNIQUE NOT NULL,
+            source TEXT NOT NULL
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS chunks_source_idx ON chunks (source)")
+    # Термы уже нормализованы tokenize(): FTS5 только делит по пробелам, _ — часть терма
+    conn.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS chunks_fts
+        USING fts5(terms, tokenize = "unicode61 remove_diacritics 0 tokenchars '_'")
+    """)
+    conn.commit()
+    return conn
+
+
+def count(conn: sqlite3.Connection) -> int:
+    return conn.execute("SELECT count(*) FROM chunks").fetchone()[0]
+
+
+def add_chunks(conn: sqlite3.Connection, records: Iterable[tuple[str, str, str]]) -> int:
+    """Добавляет чанки (id, текст, source). Уже проиндексированные IDs пропускаются.
+
+    Возвращает число добавленных.
+    """
+    added = 0
+    for chunk_id, text, source in records:
+        cur = conn.execute(
+            "INSERT OR IGNORE INTO chunks (id, source) VALUES (?, ?)", (chunk_id, source)
+        )
+        if cur.rowcount:
+            conn.execute(
+                "INSERT INTO chunks_fts (rowid, terms) VALUES (?, ?)",
+                (cur.lastrowid, " ".join(tokenize(text))),
+            )
+            added += 1
+    conn.commit()
+    return added
+
+
+def _delete_rowids(conn: sqlite3.Connection, rowids: list[int]):
+    for i in range(0, len(rowids), _SQL_BATCH):
+        part = rowids[i:i + _SQL_BATCH]
+        placeholders = ",".join("?" * len(part))
+        conn.execute(f"DELETE FROM chunks_fts WHERE rowid IN ({placeholders})", part)
+        conn.execute(f"DELETE FROM chunks WHERE rowid IN ({placeholders})", part)
+
+
+def remove_source(conn: sqlite3.Connection, source: str) -> int:
+    """Удаляет все чанки файла. Возвращает число удалённых."""
+    rowids = [r[0] for r in conn.execute("SELECT rowid FROM chunks WHERE source = ?", (source,))]
+    _delete_rowids(conn, rowids)
+    conn.commit()
+    return len(rowids)
+
+
+def sync_file(conn: sqlite3.Connection, source: str, chunk_ids: list[str],
+              fetch_texts: Callable[[list[str]], dict[str, str]]) -> tuple[int, int]:
+    """Приводит чанки файла в индексе к списку chunk_ids.
+
+    Пропавшие IDs удаляются, для новых тексты запрашиваются через
+    fetch_texts(ids) -> {id: текст} (обычно из ChromaDB, где чанки уже лежат).
+    Возвращает (добавлено, удалено).
+    """
+    wanted = set(chunk_ids)
+    indexed = dict(conn.execute("SELECT id, rowid FROM chunks WHERE source = ?", (source,)))
+    _delete_rowids(conn, [rowid for chunk_id, rowid in indexed.items() if chunk_id not in wanted])
+
+    missing = [i for i in dict.fromkeys(chunk_ids) if i not in indexed]
+    texts = fetch_texts(missing) if missing else {}
+    added = add_chunks(conn, ((i, texts[i], source) for i in missing if i in texts))
+    return added, len(indexed) - len(wanted & indexed.keys())
+
+
+def search(conn: sqlite3.Connection, query: str, k: int,
+           sources: list[str] | None = None) -> list[tuple[str, float]]:
+    """Топ-k чанков по BM25: [(id, score)], score больше — лучше.
+
+    sources — только чанки этих документов (маршрутизация retriever.py); None — все.
+    """
+    terms = list(dict.fromkeys(tokenize(query)))
+    if not terms:
+        return []
+    # Каждый терм в кавычках — иначе FTS5 разбирает AND/OR/NEAR и спецсимволы как синтаксис
+    match = " OR ".join('"' + t.replace('"', '""') + '"' for t in terms)
+    source_filter = ""
+    params: list = [match]
+    if sources is not None:
+        source_filter = f"AND c.source IN ({', '.join('?' * len(sources))})"
+        params.extend(sources)
+    rows = conn.execute(
+        f"""SELECT c.id, bm25(chunks_fts) AS rank
+           FROM chunks_fts JOIN chunks c ON c.rowid = chunks_fts.rowid
+           WHERE chunks_fts MATCH ? {source_filter}
+           ORDER BY rank
+           LIMIT ?""",
+        (*params, k),
+    ).fetchall()
+    # bm25() в FTS5 отрицательный: чем меньше, тем релевантнее
+    return [(chunk_id, -rank) for chunk_id, rank in rows]
+
+
+def clear(conn: sqlite3.Connection) -> int:
+    """Удаляет все чанки. Возвращает число удалённых."""
+    n = count(conn)
+    conn.execute("DELETE FROM chunks_fts")
+    conn.execute("DELETE FROM chunks")
+    conn.commit()
+    return n
+
+
+def rebuild_from_collection(conn: sqlite3.Connection, collection, page_size: int = 1000) -> int:
+    """Полностью пересобирает индекс по содержимому коллекции ChromaDB."""
+    clear(conn)
+    total = 0
+    offset = 0
+    while True:
+        page = collection.get(include=["documents", "metadatas"], limit=page_size, offset=offset)
+        ids = page.get("ids", [])
+        if not ids:
+            break
+        total += add_chunks(conn, (
+            (chunk_id, text or "", (meta or {}).get("source", ""))
+            for chunk_id, text, meta in zip(ids, page["documents"], page["metadatas"])
+        ))
+        offset += len(ids)
+    return total
+
+
+def chroma_text_fetcher(collection) -> Callable[[list[str]], dict[str, str]]:
+    """fetch_texts для sync_file: тексты чанков по IDs из коллекции ChromaDB."""
+    def fetch(ids: list[str]) -> dict[str, str]:
+        texts = {}
+        for i in range(0, len(ids), _SQL_BATCH):
+            got = collection.get(ids=ids[i:i + _SQL_BATCH], include=["documents"])
+            texts.update(zip(got.get("ids", []), got.get("documents") or []))
+        return texts
+    return fetch
+
+
+def main():
+    from config.settings import settings
+    from services.indexer import get_chroma_collection
+
+    parser = argparse.ArgumentParser(description="Лексический индекс чанков (BM25)")
+    parser.add_argument("--rebuild", action="store_true", help="Пересобрать индекс из ChromaDB")
+    parser.add_argument("--search", metavar="QUERY", help="Показать топ-10 по BM25 для запроса")
+    args = parser.parse_args()
+
+    conn = open_index(Path(settings.LEXICAL_INDEX_FILE))
+    if args.rebuild:
+        _, collection = get_chroma_collection()
+        print(f"Проиндексировано чанков: {rebuild_from_collection(conn, collection)}")
+    if args.search:
+        print(f"Термы запроса: {tokenize(args.search)}")
+        for chunk_id, score in search(conn, args.search, 10):
+            print(f"{score:8.3f}  {chunk_id}")
+    print(f"Чанков в индексе: {count(conn)}")
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+manifest.py — манифест индекса во встроенной SQLite (INDEX_MANIFEST_FILE).
+
+Для каждого файла хранит mtime, размер, MD5, IDs чанков и статус:
+    pending   — индексация файла начата, но не доведена до конца;
+    committed — все чанки файла загружены в ChromaDB.
+
+Запись фиксируется сразу после обработки файла, поэтому прерванный запуск
+продолжается с места остановки. Файлы с неизменными mtime и размером
+пропускаются без чтения содержимого.
+
+При первом открытии переносит записи из старого JSON-состояния INDEX_STATE_FILE.
+"""
+
+import json
+import sqlite3
+from pathlib import Path
+
+from models.schemas import IndexedFile
+
+
+def open_manifest(path: Path, legacy_state_file: Path = None) -> sqlite3.Connection:
+    """Открывает манифест. Если файла ещё нет — создаёт и переносит legacy JSON."""
+    is_new = not path.exists()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS files
+        (
+            path      TEXT PRIMARY KEY,
+            mtime_ns  INTEGER,
+            size      INTEGER,
+            hash      TEXT NOT NULL,
+            chunk_ids TEXT,
+            status    TEXT NOT NULL CHECK (status IN ('pending', 'committed'))
+        )
+    """)
+    conn.commit()
+
+    if is_new and legacy_state_file is not None and legacy_state_file.exists():
+        with open(legacy_state_file, "r", encoding="utf-8") as f:
+            legacy = json.load(f)
+        # mtime/размер неизвестны — такие файлы один раз пересчитают MD5
+        conn.executemany(
+            "INSERT INTO files (path, hash, status) VALUES (?, ?, 'committed')",
+            list(legacy.items()),
+        )
+        conn.commit()
+
+    return conn
+
+
+def load_entries(conn: sqlite3.Connection) -> dict[str, IndexedFile]:
+    """Возвращает {путь: IndexedFile} для всех файлов манифеста."""
+    rows = conn.execute(
+        "SELECT path, hash, status, mtime_ns, size, chunk_ids FROM files"
+    ).fetchall()
+    return {
+        r[0]: IndexedFile(
+            path=r[0],
+            hash=r[1],
+            status=r[2],
+            mtime_ns=r[3],
+            size=r[4],
+            chunk_ids=json.loads(r[5]) if r[5] is not None else None,
+        )
+        for r in rows
+    }
+
+
+def mark_pending(conn: sqlite3.Connection, path: str, file_hash: str):
+    """Фиксирует начало индексации файла. Старые chunk_ids не трогаем."""
+    conn.execute(
+        """INSERT INTO files (path, hash, status) VALUES (?, ?, 'pending')
+           ON CONFLICT (path) DO UPDATE SET hash = excluded.hash, status = 'pending'""",
+        (path, file_hash),
+    )
+    conn.commit()
+
+
+def mark_committed(conn: sqlite3.Connection, path: str, mtime_ns: int, size: int,
+                   file_hash: str, chunk_ids: list[str]):
+    """Фиксирует успешную индексацию файла."""
+    conn.execute(
+        """INSERT INTO files (path, mtime_ns, size, hash, chunk_ids, status)
+           VALUES (?, ?, ?, ?, ?, 'committed')
+           ON CONFLICT (path) DO UPDATE SET
+               mtime_ns = excluded.mtime_ns, size = excluded.size, hash = excluded.hash,
+               chunk_ids = excluded.chunk_ids, status = 'committed'""",
+        (path, mtime_ns, size, file_hash, json.dumps(chunk_ids)),
+    )
+    conn.commit()
+
+
+def touch(conn: sqlite3.Connection, path: str, mtime_ns: int, size: int):
+    """Обновляет mtime/размер файла, содержимое которого не изменилось."""
+    conn.execute(
+        "UPDATE files SET mtime_ns = ?, size = ? WHERE path = ?",
+        (mtime_ns, size, path),
+    )
+    conn.commit()
+
+
+def remove(conn: sqlite3.Connection, path: str):
+    """Удаляет запись о файле."""
+    conn.execute("DELETE FROM files WHERE path = ?", (path,))
+    conn.commit()
+
+
+def clear(conn: sqlite3.Connection) -> int:
+    """Удаляет все записи. Возвращает число удалённых."""
+    count = conn.execute("DELETE FROM files").rowcount
+    conn.commit()
+    return count
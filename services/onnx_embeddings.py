@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+"""
+onnx_embeddings.py — CPU-бэкенд эмбеддингов: EMBEDDINGS_MODEL в ONNX с int8-квантизацией.
+
+Включается настройкой EMBEDDINGS_BACKEND=onnx-int8 — тогда get_embeddings()
+(services/embeddings.py) отдаёт OnnxEmbeddings вместо HuggingFaceEmbeddings
+в retriever.py, indexer.py, analytics и на сервере эмбеддингов.
+Для инференса нужны только onnxruntime и tokenizers, без PyTorch.
+
+Модель экспортируется один раз (нужны torch и transformers):
+    python -m services.onnx_embeddings export
+В ONNX_MODEL_DIR/<модель>/ появляются model_int8.onnx, tokenizer.json и
+embedding_config.json (пулинг и нормализация — как в sentence-transformers модели).
+
+Проверка расхождения с fp32 на чанках из ChromaDB:
+    python -m services.onnx_embeddings parity                   # против свежих fp32-векторов PyTorch
+    python -m services.onnx_embeddings parity --against-index   # против векторов, лежащих в коллекции
+Второй вариант прямо отвечает на вопрос, нужна ли переиндексация после переключения бэкенда.
+"""
+
+import argparse
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from config.settings import settings
+
+ONNX_MODEL_FILE = "model_int8.onnx"
+EMBEDDING_CONFIG_FILE = "embedding_config.json"
+
+# Тексты внутри вызова прогоняются пачками: паддинг до самой длинной строки пачки
+_INFER_BATCH = 32
+
+
+def model_dir(model_name: str = None) -> Path:
+    """Каталог экспортированной модели: ONNX_MODEL_DIR/<имя модели с __ вместо />."""
+    model_name = model_name or settings.EMBEDDINGS_MODEL
+    return Path(settings.ONNX_MODEL_DIR) / model_name.replace("/", "__")
+
+
+# ── Инференс ─────────────────────────────────────────────────────────────────
+
+class OnnxEmbeddings(Embeddings):
+    """Эмбеддинги через onnxruntime: токенизация → ONNX → пулинг → нормализация."""
+
+    def __init__(self, path: Path, threads: int = 0):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        if not (path / ONNX_MODEL_FILE).exists():
+            raise FileNotFoundError(
+                f"Нет ONNX-модели {path / ONNX_MODEL_FILE}. "
+                f"Экспортируйте её: python -m services.onnx_embeddings export"
+            )
+        self.config = json.loads((path / EMBEDDING_CONFIG_FILE).read_text(encoding="utf-8"))
+
+        self.tokenizer = Tokenizer.from_file(str(path / "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=self.config["max_length"])
+        self.tokenizer.enable_padding(pad_id=self.config["pad_token_id"])
+
+        options = ort.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(
+            str(path / ONNX_MODEL_FILE), options, providers=["CPUExecutionProvider"],
+        )
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+    def _embed_batch(self, texts: list[str]) -> np.ndarray:
+        encodings = self.tokenizer.encode_batch(texts)
+        input_ids = np.array([e.ids for e in encodings], dtype=np.int64)
+        attention_mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+        feeds = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in self.input_names:
+            feeds["token_type_ids"] = np.zeros_like(input_ids)
+        hidden = self.session.run(None, {k: v for k, v in feeds.items() if k in self.input_names})[0]
+
+        if self.config["pooling"] == "cls":
+            vectors = hidden[:, 0]
+        else:
+            mask = attention_mask[..., None].astype(np.float32)
+            vectors = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        if self.config["normalize"]:
+            vectors = vectors / np.clip(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12, None)
+        return vectors.astype(np.float32)
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        if not texts:
+            return []
+        # Сортируем по длине — в пачке меньше паддинга; порядок восстанавливаем
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        result = np.empty((len(texts), 0), dtype=np.float32)
+        for start in range(0, len(order), _INFER_BATCH):
+            idx = order[start:start + _INFER_BATCH]
+            vectors = self._embed_batch([texts[i] for i in idx])
+            if result.shape[1] == 0:
+                result = np.empty((len(texts), vectors.shape[1]), dtype=np.float32)
+            result[idx] = vectors
+        return result.tolist()
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.embed_documents([text])[0]
+
+
+# ── Экспорт ──────────────────────────────────────────────────────────────────
+
+def read_sentence_transformers_config(model_name: str) -> tuple[str, bool]:
+    """Пулинг ('mean' | 'cls') и нормализация из modules.json модели на HuggingFace Hub."""
+    from huggingface_hub import hf_hub_download
+
+    pooling, normalize = "mean", False
+    try:
+        modules = json.loads(Path(hf_hub_download(model_name, "modules.json")).read_text())
+    except Exception:
+        return pooling, normalize  # не sentence-transformers модель — mean без нормализации
+
+    for module in modules:
+        if module["type"].endswith("Normalize"):
+            normalize = True
+        elif module["type"].endswith("Pooling"):
+            pooling_config = json.loads(
+                Path(hf_hub_download(model_name, f"{module['path']}/config.json")).read_text()
+            )
+            if pooling_config.get("pooling_mode_cls_token"):
+                pooling = "cls"
+    return pooling, normalize
+
+
+def export_onnx(model_name: str, out_dir: Path, keep_fp32: bool = False) -> Path:
+    """Экспортирует модель в ONNX и квантизирует веса в int8 (динамическая квантизация)."""
+    import torch
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    from transformers import AutoModel, AutoTokenizer
+
+    out_dir.mkdir(parents=True, exist_ok=True)
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModel.from_pretrained(model_name).eval()
+
+    class LastHiddenState(torch.nn.Module):
+        def __init__(self, encoder):
+            super().__init__()
+            self.encoder = encoder
+
+        def forward(self, input_ids, attention_mask):
+            return self.encoder(input_ids=input_ids, attention_mask=attention_mask).last_hidden_state
+
+    sample = tokenizer(["пример текста", "example"], padding=True, return_tensors="pt")
+    fp32_path = out_dir / "model_fp32.onnx"
+    torch.onnx.export(
+        LastHiddenState(model),
+        (sample["input_ids"], sample["attention_mask"]),
+        str(fp32_path),
+        input_names=["input_ids", "attention_mask"],
+        output_names=["last_hidden_state"],
+        dynamic_axes={
+            "input_ids": {0: "batch", 1: "seq"},
+            "attention_mask": {0: "batch", 1: "seq"},
+            "last_hidden_state": {0: "batch", 1: "seq"},
+        },
+        opset_version=17,
+        dynamo=False,
+    )
+    quantize_dynamic(str(fp32_path), str(out_dir / ONNX_MODEL_FILE), weight_type=QuantType.QInt8)
+    if not keep_fp32:
+        fp32_path.unlink()
+
+    tokenizer.save_pretrained(str(out_dir))  # tokenizer.json для tokenizers.Tokenizer
+    pooling, normalize = read_sentence_transformers_config(model_name)
+    config = {
+        "model": model_name,
+        "pooling": pooling,
+        "normalize": normalize,
+        "max_length": min(int(tokenizer.model_max_length), 512),
+        "pad_token_id": tokenizer.pad_token_id,
+    }
+    (out_dir / EMBEDDING_CONFIG_FILE).write_text(json.dumps(config, indent=2), encoding="utf-8")
+    return out_dir / ONNX_MODEL_FILE
+
+
+# ── Проверка расхождения ─────────────────────────────────────────────────────
+
+def cosine_drift(reference: np.ndarray, candidate: np.ndarray) -> dict:
+    """Статистика косинусного сходства построчно: reference (fp32) против candidate (int8)."""
+    ref = reference / np.linalg.norm(reference, axis=1, keepdims=True)
+    cand = candidate / np.linalg.norm(candidate, axis=1, keepdims=True)
+    cos = (ref * cand).sum(axis=1)
+    return {
+        "n": int(len(cos)),
+        "cosine_mean": round(float(cos.mean()), 6),
+        "cosine_min": round(float(cos.min()), 6),
+        "cosine_p1": round(float(np.percentile(cos, 1)), 6),
+        "cosine_p5": round(float(np.percentile(cos, 5)), 6),
+        "drift_mean": round(float(1 - cos.mean()), 6),
+        "drift_max": round(float(1 - cos.min()), 6),
+    }
+
+
+def sample_indexed_chunks(n: int) -> tuple[list[str], np.ndarray]:
+    """Первые n чанков коллекции: тексты и сохранённые при индексации векторы."""
+    import chromadb
+
+    client = chromadb.HttpClient(host=settings.CHROMA_HOST, port=int(settings.CHROMA_PORT))
+    collection = client.get_collection(settings.COLLECTION_NAME)
+    data = collection.get(limit=n, include=["documents", "embeddings"])
+    return data["documents"], np.asarray(data["embeddings"], dtype=np.float32)
+
+
+def parity_check(n: int, against_index: bool) -> dict:
+    from services.embeddings import load_torch_model
+
+    texts, stored = sample_indexed_chunks(n)
+    if not texts:
+        raise RuntimeError(f"Коллекция {settings.COLLECTION_NAME} пуста — не на чем проверять")
+    if against_index:
+        reference = stored
+    else:
+        reference = np.asarray(load_torch_model().embed_documents(texts), dtype=np.float32)
+    candidate = np.asarray(OnnxEmbeddings(model_dir(), settings.EMBEDDINGS_ONNX_THREADS).embed_documents(texts))
+    return cosine_drift(reference, candidate)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ONNX int8 бэкенд эмбеддингов")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_export = sub.add_parser("export", help="Экспорт EMBEDDINGS_MODEL в ONNX + int8")
+    p_export.add_argument("--model", default=settings.EMBEDDINGS_MODEL)
+    p_export.add_argument("--keep-fp32", action="store_true", help="Оставить неквантизированный model_fp32.onnx")
+
+    p_parity = sub.add_parser("parity", help="Косинусное расхождение int8 против fp32")
+    p_parity.add_argument("--sample", type=int, default=500, help="Сколько чанков взять из коллекции")
+    p_parity.add_argument("--against-index", action="store_true",
+                          help="Сравнивать с векторами в ChromaDB, а не со свежими fp32")
+    p_parity.add_argument("--max-drift", type=float, default=0.01,
+                          help="Допустимое среднее 1 - cos; выше — рекомендуется переиндексация")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        path = export_onnx(args.model, model_dir(args.model), keep_fp32=args.keep_fp32)
+        print(f"ONNX int8: {path} ({os.path.getsize(path) / 2**20:.0f} МБ)")
+        return
+
+    report = parity_check(args.sample, args.against_index)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    if report["drift_mean"] > args.max_drift:
+        print(f"Среднее расхождение {report['drift_mean']} > {args.max_drift}: "
+              f"после переключения на onnx-int8 переиндексируйте коллекцию")
+    else:
+        print(f"Среднее расхождение {report['drift_mean']} <= {args.max_drift}: "
+              f"старые векторы совместимы, переиндексация не обязательна")
+
+
+if __name__ == "__main__":
+    main()
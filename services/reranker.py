@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+reranker.py — переранжирование кандидатов поиска кросс-энкодером на CPU.
+
+Кросс-энкодер читает пару (запрос, чанк) целиком и оценивает релевантность
+точнее, чем косинус эмбеддингов. retriever.py берёт из поиска RERANK_CANDIDATES
+кандидатов, пересчитывает их одним батчем и оставляет RETRIEVER_K лучших —
+правильный чанк с 4–10 места попадает в контекст без цикла grader → rewriter.
+
+Бюджет задержки RERANK_BUDGET_MS: по прошлым вызовам известна цена одной пары,
+и кандидатов берётся столько, сколько укладывается в бюджет. Если не укладывается
+даже RETRIEVER_K на запрос — переранжирование пропускается, но каждый
+_PROBE_EVERY-й пропуск идёт с минимальной глубиной (RETRIEVER_K + 1) и
+обновляет оценку: разовый медленный вызов не выключает модель до перезапуска.
+Первый (холодный) проход модели делается в конструкторе и в оценку не входит.
+
+Модель — RERANK_MODEL (sentence_transformers.CrossEncoder), пусто — выключено.
+"""
+
+import threading
+import time
+from functools import lru_cache
+
+from config.settings import settings
+
+# Вес нового замера в скользящей оценке цены пары
+_EMA_WEIGHT = 0.2
+
+# Каждый какой пропуск по бюджету переранжирует с минимальной глубиной — заново мерит цену пары
+_PROBE_EVERY = 20
+
+# Пары холодного прохода в конструкторе: выделение памяти, запуск потоков torch
+_WARMUP_PAIRS = [("прогрев", "прогрев модели")] * 4
+
+
+class CrossEncoderReranker:
+    """Кросс-энкодер с оценкой цены одной пары (мс) по прошлым вызовам."""
+
+    def __init__(self, model_name: str, max_length: int):
+        from sentence_transformers import CrossEncoder
+
+        self.model = CrossEncoder(model_name, max_length=max_length, device="cpu")
+        self.ms_per_pair: float | None = None
+        self.skipped = 0
+        self._lock = threading.Lock()
+        # Холодный вызов в несколько раз дороже обычного — в оценку цены не идёт
+        self.model.predict(_WARMUP_PAIRS, batch_size=len(_WARMUP_PAIRS), show_progress_bar=False)
+
+    def score(self, pairs: list[tuple[str, str]]) -> list[float]:
+        """Оценки релевантности пар — один прямой проход модели."""
+        if not pairs:
+            return []
+        started = time.perf_counter()
+        scores = self.model.predict(pairs, batch_size=len(pairs), show_progress_bar=False)
+        ms = (time.perf_counter() - started) * 1000 / len(pairs)
+        with self._lock:
+            self.ms_per_pair = ms if self.ms_per_pair is None else (
+                (1 - _EMA_WEIGHT) * self.ms_per_pair + _EMA_WEIGHT * ms
+            )
+        return [float(s) for s in scores]
+
+    def affordable_pairs(self, budget_ms: float) -> int | None:
+        """Сколько пар укладывается в бюджет; None — цена ещё не известна."""
+        if self.ms_per_pair is None:
+            return None
+        return int(budget_ms / max(self.ms_per_pair, 1e-6))
+
+    def should_probe(self) -> bool:
+        """Пропуск по бюджету; True — пора заново измерить цену пары."""
+        with self._lock:
+            self.skipped += 1
+            return self.skipped % _PROBE_EVERY == 0
+
+
+@lru_cache(maxsize=1)
+def get_reranker() -> CrossEncoderReranker:
+    return CrossEncoderReranker(settings.RERANK_MODEL, settings.RERANK_MAX_LENGTH)
+
+
+def enabled() -> bool:
+    return bool(settings.RERANK_MODEL)
+
+
+def candidates_per_query(reranker: CrossEncoderReranker, n_queries: int) -> int:
+    """Глубина переранжирования на запрос в пределах RERANK_CANDIDATES и бюджета."""
+    affordable = reranker.affordable_pairs(settings.RERANK_BUDGET_MS)
+    if affordable is None:
+        return settings.RERANK_CANDIDATES
+    return min(settings.RERANK_CANDIDATES, affordable // max(n_queries, 1))
+
+
+def rerank(queries: list[str], candidates: list[list[str]], k: int) -> tuple[list[list[int]], dict]:
+    """Номера top-k кандидатов каждого запроса после переранжирования, все пары — одним батчем.
+
+    Возвращает (порядки, статистика): пары, время, пропущено ли по бюджету.
+    """
+    reranker = get_reranker()
+    depth = candidates_per_query(reranker, len(queries))
+    probe = False
+    if depth <= k:
+        if not reranker.should_probe():
+            return [list(range(min(k, len(c)))) for c in candidates], {"pairs": 0, "ms": 0.0, "skipped": True}
+        # Минимальная глубина: оценка цены обновится, даже если модель давно пропускается
+        depth, probe = k + 1, True
+
+    pairs = [(q, t) for q, texts in zip(queries, candidates) for t in texts[:depth]]
+    started = time.perf_counter()
+    scores = iter(reranker.score(pairs))
+
+    orders = []
+    for texts in candidates:
+        head = [(i, next(scores)) for i in range(min(depth, len(texts)))]
+        head.sort(key=lambda x: x[1], reverse=True)
+        orders.append([i for i, _ in head[:k]])
+    stats = {"pairs": len(pairs), "ms": (time.perf_counter() - started) * 1000, "skipped": False, "probe": probe}
+    return orders, stats
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+routing_index.py — индекс маршрутизации: один вектор на документ.
+
+Плоский HNSW-поиск по всем чанкам с ростом базы теряет и в скорости, и в точности:
+среди десятков тысяч файлов похожие куски чужих документов вытесняют нужные.
+Двухуровневый поиск (ROUTING_DOCS > 0) сначала выбирает ROUTING_DOCS документов
+по вектору документа, а затем ищет чанки только в них:
+where={"source": {"$in": [...]}}.
+
+Вектор документа — нормированный центроид векторов его чанков. Дополнительных
+вызовов модели не нужно: векторы уже лежат в ChromaDB. Индекс — отдельная
+небольшая коллекция ChromaDB ROUTING_COLLECTION (cosine, ID = source). Её ведёт
+indexer.py (ROUTING_INDEX=true) вместе с лексическим индексом: после фиксации
+файла его центроид пересчитывается, удалённый файл убирается.
+
+Пересборка из основной коллекции:
+    python -m services.routing_index --rebuild
+"""
+
+import argparse
+from pathlib import Path
+
+import numpy as np
+
+# Размер страницы get() по основной коллекции при пересборке
+_PAGE_SIZE = 1000
+
+
+def open_collection(client, name: str):
+    """Коллекция маршрутизации (создаётся при первом обращении)."""
+    return client.get_or_create_collection(name=name, metadata={"hnsw:space": "cosine"})
+
+
+def document_vector(vectors) -> list[float] | None:
+    """Нормированный центроид векторов чанков; None — чанков нет."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if vectors.size == 0:
+        return None
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    centroid = (vectors / np.maximum(norms, 1e-12)).mean(axis=0)
+    return (centroid / max(float(np.linalg.norm(centroid)), 1e-12)).tolist()
+
+
+def upsert_documents(routing, documents: dict[str, tuple[list[float], int]]):
+    """Записывает векторы документов: {source: (вектор, число чанков)}."""
+    if not documents:
+        return
+    sources = list(documents)
+    routing.upsert(
+        ids=sources,
+        embeddings=[documents[s][0] for s in sources],
+        metadatas=[{"source": s, "filename": Path(s).name, "chunks": documents[s][1]} for s in sources],
+    )
+
+
+def sync_source(routing, collection, source: str) -> bool:
+    """Пересчитывает вектор документа по его чанкам в коллекции.
+
+    Если чанков не осталось — документ убирается. Возвращает True, если вектор записан.
+    """
+    got = collection.get(where={"source": source}, include=["embeddings"])
+    vector = document_vector(got["embeddings"])
+    if vector is None:
+        remove_source(routing, source)
+        return False
+    upsert_documents(routing, {source: (vector, len(got["ids"]))})
+    return True
+
+
+def remove_source(routing, source: str):
+    routing.delete(ids=[source])
+
+
+def count(routing) -> int:
+    return routing.count()
+
+
+def rebuild_from_collection(routing, collection, page_size: int = _PAGE_SIZE) -> int:
+    """Полностью пересобирает индекс по основной коллекции. Возвращает число документов.
+
+    Коллекция читается постранично, в памяти — только суммы векторов по документам.
+    """
+    sums: dict[str, np.ndarray] = {}
+    counts: dict[str, int] = {}
+    offset = 0
+    while True:
+        page = collection.get(include=["embeddings", "metadatas"], limit=page_size, offset=offset)
+        if not page["ids"]:
+            break
+        vectors = np.asarray(page["embeddings"], dtype=np.float32)
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        for vector, meta in zip(vectors, page["metadatas"]):
+            source = (meta or {}).get("source")
+            if not source:
+                continue
+            if source in sums:
+                sums[source] += vector
+            else:
+                sums[source] = vector.copy()
+            counts[source] = counts.get(source, 0) + 1
+        offset += len(page["ids"])
+
+    stale = set(routing.get(include=[])["ids"]) - sums.keys()
+    if stale:
+        routing.delete(ids=list(stale))
+    sources = list(sums)
+    for i in range(0, len(sources), page_size):
+        upsert_documents(routing, {
+            s: ((sums[s] / max(float(np.linalg.norm(sums[s])), 1e-12)).tolist(), counts[s])
+            for s in sources[i:i + page_size]
+        })
+    return len(sources)
+
+
+def route(routing, embeddings: list[list[float]], n: int) -> list[list[str]]:
+    """source n ближайших документов для каждого запроса — один multi-query запрос."""
+    result = routing.query(query_embeddings=embeddings, n_results=n, include=[])
+    return result["ids"]
+
+
+def main():
+    import chromadb
+    from config.settings import settings
+
+    parser = argparse.ArgumentParser(description="Индекс маршрутизации документов")
+    parser.add_argument("--rebuild", action="store_true", help="Пересобрать индекс из ChromaDB")
+    parser.add_argument("--route", metavar="QUERY", help="Показать документы, выбранные для запроса")
+    args = parser.parse_args()
+
+    client = chromadb.HttpClient(host=settings.CHROMA_HOST, port=int(settings.CHROMA_PORT))
+    routing = open_collection(client, settings.ROUTING_COLLECTION)
+    if args.rebuild:
+        collection = client.get_collection(settings.COLLECTION_NAME)
+        print(f"Документов в индексе маршрутизации: {rebuild_from_collection(routing, collection)}")
+    if args.route:
+        from services.embeddings import get_embeddings
+        embedding = get_embeddings().embed_query(args.route)
+        for source in route(routing, [embedding], max(settings.ROUTING_DOCS, 10))[0]:
+            print(source)
+    print(f"Документов в индексе: {count(routing)}")
+
+
+if __name__ == "__main__":
+    main()
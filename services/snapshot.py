@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+"""
+snapshot.py — компактный снимок коллекции для поиска в процессе (RETRIEVAL_MODE=snapshot).
+
+Индексатор выгружает векторы, тексты и метаданные всех чанков в каталог
+SNAPSHOT_DIR/<версия>/, а указатель SNAPSHOT_DIR/CURRENT переключается
+атомарно. Читатель (graph/nodes/retriever_local.py) открывает файлы через
+mmap: старт — это чтение заголовка, а несколько процессов Streamlit делят одни
+и те же страницы page cache. Поиск — скалярные произведения NumPy по блокам.
+
+Файлы снимка:
+    header.json          размерность, число чанков, тип векторов, модель, версия
+    vectors.npy          нормированные векторы: int8 (+ scales.npy) | float16 | float32
+    scales.npy           для int8: масштаб строки, v ≈ q * scale
+    texts.bin            тексты чанков подряд (utf-8), границы — text_offsets.npy
+    ids.bin              IDs чанков подряд (utf-8), границы — id_offsets.npy
+    sources.json         список файлов; source_idx.npy — номер файла чанка
+    chunk_index.npy      номер чанка в файле
+
+Выгрузка вручную:
+    python -m services.snapshot --export
+"""
+
+import argparse
+import json
+import mmap
+import os
+import shutil
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+
+from config.settings import settings
+
+SNAPSHOT_DTYPES = ("int8", "float16", "float32")
+CURRENT_FILE = "CURRENT"
+
+# Строк матрицы за один шаг поиска: int8/float16 приводятся к float32 поблочно,
+# без копии всей матрицы
+_SEARCH_BLOCK = 4096
+# Сколько старых снимков оставлять: процессы могут ещё читать предыдущий
+_KEEP_SNAPSHOTS = 2
+
+
+# ── Выгрузка ─────────────────────────────────────────────────────────────────
+
+def quantize(vectors: np.ndarray, dtype: str) -> tuple[np.ndarray, np.ndarray]:
+    """Нормирует векторы и приводит к dtype. Для int8 — симметричная квантизация по строкам."""
+    vectors = vectors / np.clip(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12, None)
+    if dtype == "int8":
+        scales = np.clip(np.abs(vectors).max(axis=1), 1e-12, None) / 127.0
+        return np.round(vectors / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+    return vectors.astype(dtype), None
+
+
+def _write_strings(path: Path, strings: list[str]) -> np.ndarray:
+    offsets = [0]
+    with open(path, "wb") as f:
+        for s in strings:
+            data = s.encode("utf-8")
+            f.write(data)
+            offsets.append(offsets[-1] + len(data))
+    return np.asarray(offsets, dtype=np.int64)
+
+
+def export_snapshot(collection, root: Path, dtype: str, version: str, page_size: int = 1000) -> Path:
+    """Выгружает коллекцию в root/<version>/ и переключает root/CURRENT на неё."""
+    if dtype not in SNAPSHOT_DTYPES:
+        raise ValueError(f"SNAPSHOT_DTYPE={dtype!r}, допустимо: {SNAPSHOT_DTYPES}")
+
+    vectors, scales, texts, ids, metadatas = [], [], [], [], []
+    offset = 0
+    while True:
+        page = collection.get(
+            include=["embeddings", "documents", "metadatas"], limit=page_size, offset=offset,
+        )
+        if not page["ids"]:
+            break
+        q, s = quantize(np.asarray(page["embeddings"], dtype=np.float32), dtype)
+        vectors.append(q)
+        if s is not None:
+            scales.append(s)
+        ids.extend(page["ids"])
+        texts.extend(t or "" for t in page["documents"])
+        metadatas.extend(m or {} for m in page["metadatas"])
+        offset += len(page["ids"])
+
+    target = root / version
+    tmp = root / f".{version}.{os.getpid()}.tmp"
+    tmp.mkdir(parents=True, exist_ok=True)
+
+    dim = vectors[0].shape[1] if vectors else 0
+    np.save(tmp / "vectors.npy", np.concatenate(vectors) if vectors else np.zeros((0, 0), dtype=dtype))
+    if dtype == "int8":
+        np.save(tmp / "scales.npy", np.concatenate(scales) if scales else np.zeros(0, dtype=np.float32))
+    np.save(tmp / "text_offsets.npy", _write_strings(tmp / "texts.bin", texts))
+    np.save(tmp / "id_offsets.npy", _write_strings(tmp / "ids.bin", ids))
+
+    sources = list(dict.fromkeys(m.get("source", "") for m in metadatas))
+    source_no = {s: i for i, s in enumerate(sources)}
+    (tmp / "sources.json").write_text(json.dumps(sources, ensure_ascii=False), encoding="utf-8")
+    np.save(tmp / "source_idx.npy", np.asarray([source_no[m.get("source", "")] for m in metadatas], dtype=np.int32))
+    np.save(tmp / "chunk_index.npy", np.asarray([m.get("chunk_index", -1) for m in metadatas], dtype=np.int32))
+
+    header = {
+        "version": version,
+        "count": len(ids),
+        "dim": int(dim),
+        "dtype": dtype,
+        "model": settings.EMBEDDINGS_MODEL,
+        "backend": settings.EMBEDDINGS_BACKEND,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+    (tmp / "header.json").write_text(json.dumps(header, ensure_ascii=False, indent=2), encoding="utf-8")
+
+    if target.exists():
+        shutil.rmtree(target)
+    os.replace(tmp, target)
+
+    pointer_tmp = root / f".{CURRENT_FILE}.{os.getpid()}.tmp"
+    pointer_tmp.write_text(version, encoding="utf-8")
+    os.replace(pointer_tmp, root / CURRENT_FILE)
+
+    _remove_old_snapshots(root, keep=version)
+    return target
+
+
+def _remove_old_snapshots(root: Path, keep: str):
+    # Файлы, открытые через mmap в других процессах, остаются доступны им и после удаления
+    versions = sorted(
+        (p for p in root.iterdir() if p.is_dir() and not p.name.startswith(".") and p.name != keep),
+        key=lambda p: p.stat().st_mtime,
+        reverse=True,
+    )
+    for old in versions[_KEEP_SNAPSHOTS - 1:]:
+        shutil.rmtree(old, ignore_errors=True)
+
+
+# ── Чтение ───────────────────────────────────────────────────────────────────
+
+class VectorSnapshot:
+    """Снимок, открытый через mmap. Потокобезопасен для чтения."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.header = json.loads((path / "header.json").read_text(encoding="utf-8"))
+        self.count = self.header["count"]
+        self.vectors = np.load(path / "vectors.npy", mmap_mode="r")
+        self.scales = np.load(path / "scales.npy", mmap_mode="r") if self.header["dtype"] == "int8" else None
+        self.text_offsets = np.load(path / "text_offsets.npy", mmap_mode="r")
+        self.id_offsets = np.load(path / "id_offsets.npy", mmap_mode="r")
+        self.source_idx = np.load(path / "source_idx.npy", mmap_mode="r")
+        self.chunk_index = np.load(path / "chunk_index.npy", mmap_mode="r")
+        self.sources = json.loads((path / "sources.json").read_text(encoding="utf-8"))
+        self._texts = self._map(path / "texts.bin")
+        self._ids = self._map(path / "ids.bin")
+
+    @staticmethod
+    def _map(path: Path):
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return b""  # mmap не умеет пустые файлы
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def search(self, query: list[float], k: int) -> list[tuple[int, float]]:
+        """Топ-k строк по косинусному сходству: [(номер строки, сходство)]."""
+        if self.count == 0:
+            return []
+        q = np.asarray(query, dtype=np.float32)
+        q = q / max(float(np.linalg.norm(q)), 1e-12)
+        scores = np.empty(self.count, dtype=np.float32)
+        for start in range(0, self.count, _SEARCH_BLOCK):
+            end = min(start + _SEARCH_BLOCK, self.count)
+            block = self.vectors[start:end]
+            part = (block if block.dtype == np.float32 else block.astype(np.float32)) @ q
+            if self.scales is not None:
+                part *= self.scales[start:end]
+            scores[start:end] = part
+        k = min(k, self.count)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(i), float(scores[i])) for i in top]
+
+    def text(self, i: int) -> str:
+        return self._texts[self.text_offsets[i]:self.text_offsets[i + 1]].decode("utf-8")
+
+    def chunk_id(self, i: int) -> str:
+        return self._ids[self.id_offsets[i]:self.id_offsets[i + 1]].decode("utf-8")
+
+    def metadata(self, i: int) -> dict:
+        source = self.sources[self.source_idx[i]]
+        return {"source": source, "filename": Path(source).name, "chunk_index": int(self.chunk_index[i])}
+
+
+_current: dict = {"version": None, "snapshot": None}
+_current_lock = threading.Lock()
+
+
+def load_current(root: Path):
+    """Текущий снимок (по root/CURRENT) или None, если его ещё не выгружали.
+
+    Указатель перечитывается при каждом вызове: после новой выгрузки
+    следующий запрос открывает новый снимок.
+    """
+    try:
+        version = (root / CURRENT_FILE).read_text(encoding="utf-8").strip()
+    except FileNotFoundError:
+        return None
+    with _current_lock:
+        if _current["version"] != version:
+            _current["snapshot"] = VectorSnapshot(root / version)
+            _current["version"] = version
+        return _current["snapshot"]
+
+
+def main():
+    from services.index_version import read_version
+    from services.indexer import get_chroma_collection
+
+    parser = argparse.ArgumentParser(description="Снимок коллекции для RETRIEVAL_MODE=snapshot")
+    parser.add_argument("--export", action="store_true", help="Выгрузить коллекцию из ChromaDB")
+    parser.add_argument("--dtype", default=settings.SNAPSHOT_DTYPE, choices=SNAPSHOT_DTYPES)
+    args = parser.parse_args()
+
+    root = Path(settings.SNAPSHOT_DIR)
+    if args.export:
+        _, collection = get_chroma_collection()
+        started = time.perf_counter()
+        path = export_snapshot(collection, root, args.dtype, read_version(Path(settings.INDEX_VERSION_FILE)))
+        print(f"Снимок: {path} за {time.perf_counter() - started:.1f} с")
+
+    snapshot = load_current(root)
+    if snapshot is None:
+        print(f"Снимка нет: {root / CURRENT_FILE}")
+    else:
+        size = sum(f.stat().st_size for f in snapshot.path.iterdir()) / 2**20
+        print(f"Текущий снимок: {snapshot.path} — {snapshot.count} чанков, "
+              f"{snapshot.header['dtype']}×{snapshot.header['dim']}, {size:.1f} МБ")
+
+
+if __name__ == "__main__":
+    main()
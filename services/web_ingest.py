@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+"""
+web_ingest.py — загрузка веб-документов с кэшем страниц на диске.
+
+Страницы WEB_URLS скачиваются параллельно (httpx, не больше WEB_FETCH_CONCURRENCY
+запросов сразу). Кэш WEB_CACHE_FILE (SQLite, ключ — URL) хранит ETag,
+Last-Modified, sha256 извлечённого текста и чанки страницы:
+
+  1. Запрос уходит с If-None-Match / If-Modified-Since. На 304 тело не передаётся,
+     чанки берутся из кэша — холодный старт не скачивает страницы целиком.
+  2. Если сервер условные запросы не поддерживает и отдал 200, текст сравнивается
+     по sha256: неизменённая страница не режется заново.
+  3. index_pages() загружает в ChromaDB только новые и изменённые страницы:
+     дифф чанков по стабильным IDs и векторы из кэша эмбеддингов — как в indexer.py.
+     Страницы, убранные из WEB_URLS, удаляются из коллекции.
+
+Если страница не скачалась (сеть, 5xx), используется её копия из кэша.
+Чанки режутся сплиттером индексатора (CHUNK_SIZE / CHUNK_OVERLAP).
+
+    python -m services.web_ingest               # обновить кэш страниц WEB_URLS
+    python -m services.web_ingest --index       # и загрузить изменения в ChromaDB
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import sqlite3
+import time
+from collections import Counter
+from dataclasses import replace
+from datetime import datetime
+from pathlib import Path
+from typing import Callable
+
+from config.settings import settings
+from models.schemas import WebPage
+
+WEB_CACHE_FILE = Path(settings.WEB_CACHE_FILE)
+WEB_FETCH_CONCURRENCY = int(settings.WEB_FETCH_CONCURRENCY)
+WEB_FETCH_TIMEOUT = float(settings.WEB_FETCH_TIMEOUT)
+
+_USER_AGENT = "langgraph-ai-agent web_ingest"
+
+
+def log(msg: str):
+    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] {msg}", flush=True)
+
+
+# ── Кэш страниц ──────────────────────────────────────────────────────────────
+
+def open_cache(path: Path) -> sqlite3.Connection:
+    """Открывает (и при необходимости создаёт) кэш страниц."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS pages
+        (
+            url           TEXT PRIMARY KEY,
+            etag          TEXT,
+            last_modified TEXT,
+            content_hash  TEXT NOT NULL,
+            title         TEXT NOT NULL,
+            chunks        TEXT NOT NULL,
+            chunk_ids     TEXT,
+            fetched_at    REAL NOT NULL
+        )
+    """)
+    conn.commit()
+    return conn
+
+
+def load_pages(conn: sqlite3.Connection) -> dict[str, WebPage]:
+    """{url: WebPage} всех страниц кэша."""
+    rows = conn.execute(
+        "SELECT url, content_hash, chunks, title, etag, last_modified, chunk_ids, fetched_at FROM pages"
+    ).fetchall()
+    return {
+        r[0]: WebPage(
+            url=r[0],
+            content_hash=r[1],
+            chunks=json.loads(r[2]),
+            title=r[3],
+            etag=r[4],
+            last_modified=r[5],
+            chunk_ids=json.loads(r[6]) if r[6] is not None else None,
+            fetched_at=r[7],
+        )
+        for r in rows
+    }
+
+
+def save_page(conn: sqlite3.Connection, page: WebPage):
+    conn.execute(
+        """INSERT INTO pages (url, etag, last_modified, content_hash, title, chunks, chunk_ids, fetched_at)
+           VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+           ON CONFLICT (url) DO UPDATE SET
+               etag = excluded.etag, last_modified = excluded.last_modified,
+               content_hash = excluded.content_hash, title = excluded.title, chunks = excluded.chunks,
+               chunk_ids = excluded.chunk_ids, fetched_at = excluded.fetched_at""",
+        (
+            page.url, page.etag, page.last_modified, page.content_hash, page.title,
+            json.dumps(page.chunks, ensure_ascii=False),
+            json.dumps(page.chunk_ids) if page.chunk_ids is not None else None,
+            page.fetched_at,
+        ),
+    )
+    conn.commit()
+
+
+def remove_page(conn: sqlite3.Connection, url: str):
+    conn.execute("DELETE FROM pages WHERE url = ?", (url,))
+    conn.commit()
+
+
+# ── Загрузка ─────────────────────────────────────────────────────────────────
+
+def html_to_text(html: str) -> tuple[str, str]:
+    """(заголовок, текст) страницы — как у WebBaseLoader: BeautifulSoup.get_text()."""
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(html, "html.parser")
+    title = soup.find("title")
+    return (title.get_text().strip() if title else ""), soup.get_text()
+
+
+def split_text(text: str) -> list[str]:
+    from services.indexer import get_splitter
+    return get_splitter().split_text(text)
+
+
+def conditional_headers(cached: WebPage | None) -> dict[str, str]:
+    """If-None-Match / If-Modified-Since по валидаторам из кэша."""
+    headers = {}
+    if cached is not None:
+        if cached.etag:
+            headers["If-None-Match"] = cached.etag
+        if cached.last_modified:
+            headers["If-Modified-Since"] = cached.last_modified
+    return headers
+
+
+def page_from_response(url: str, response, cached: WebPage | None) -> WebPage:
+    """Страница по ответу сервера: из кэша (304 или тот же текст) или нарезанная заново."""
+    validators = {
+        "etag": response.headers.get("etag"),
+        "last_modified": response.headers.get("last-modified"),
+        "fetched_at": time.time(),
+    }
+    if response.status_code == 304:
+        return replace(
+            cached, status="not_modified",
+            etag=validators["etag"] or cached.etag,
+            last_modified=validators["last_modified"] or cached.last_modified,
+            fetched_at=validators["fetched_at"],
+        )
+
+    title, text = html_to_text(response.text)
+    content_hash = hashlib.sha256(text.encode("utf-8")).hexdigest()
+    if cached is not None and cached.content_hash == content_hash:
+        return replace(cached, status="unchanged", title=title, **validators)
+    return WebPage(
+        url=url,
+        content_hash=content_hash,
+        chunks=split_text(text),
+        title=title,
+        chunk_ids=cached.chunk_ids if cached else None,
+        status="changed" if cached else "new",
+        **validators,
+    )
+
+
+async def fetch_page(client, limit: asyncio.Semaphore, url: str, cached: WebPage | None) -> WebPage | None:
+    """Условный GET страницы. При ошибке — копия из кэша (status=error) или None."""
+    import httpx
+
+    async with limit:
+        try:
+            response = await client.get(url, headers=conditional_headers(cached))
+            if response.status_code != 304:
+                response.raise_for_status()
+        except httpx.HTTPError as e:
+            log(f"  {url}: ошибка загрузки ({e!r}){' — берём из кэша' if cached else ''}")
+            return replace(cached, status="error") if cached else None
+    # Разбор HTML и нарезка — в потоке, чтобы не задерживать остальные запросы
+    return await asyncio.to_thread(page_from_response, url, response, cached)
+
+
+async def afetch_pages(urls: list[str], cached: dict[str, WebPage]) -> list[WebPage]:
+    """Все страницы параллельно, не больше WEB_FETCH_CONCURRENCY запросов сразу."""
+    import httpx
+
+    limit = asyncio.Semaphore(WEB_FETCH_CONCURRENCY)
+    async with httpx.AsyncClient(
+        follow_redirects=True,
+        timeout=WEB_FETCH_TIMEOUT,
+        limits=httpx.Limits(max_connections=WEB_FETCH_CONCURRENCY),
+        headers={"User-Agent": _USER_AGENT},
+    ) as client:
+        pages = await asyncio.gather(*(fetch_page(client, limit, url, cached.get(url)) for url in urls))
+    return [p for p in pages if p is not None]
+
+
+def refresh_pages(urls: list[str] | None = None, cache_path: Path = WEB_CACHE_FILE) -> list[WebPage]:
+    """Актуальные страницы urls (по умолчанию WEB_URLS): перекачиваются и режутся только изменённые."""
+    urls = list(dict.fromkeys(urls or settings.web_urls_list))
+    conn = open_cache(cache_path)
+    try:
+        cached = load_pages(conn)
+        started = time.perf_counter()
+        pages = asyncio.run(afetch_pages(urls, cached))
+        for page in pages:
+            if page.status != "error":
+                save_page(conn, page)
+    finally:
+        conn.close()
+
+    statuses = Counter(p.status for p in pages)
+    log(f"Веб-страниц: {len(pages)} из {len(urls)} за {time.perf_counter() - started:.1f} с "
+        f"({', '.join(f'{k}={v}' for k, v in sorted(statuses.items()))})")
+    return pages
+
+
+# ── Загрузка в ChromaDB ──────────────────────────────────────────────────────
+
+def page_records(page: WebPage) -> list[tuple[str, str, dict]]:
+    """(id, текст, метаданные) чанков страницы; IDs — как у файлов в indexer.py."""
+    from services.indexer import doc_ids_for_file
+
+    ids = doc_ids_for_file(page.url, page.chunks)
+    return [
+        (doc_id, text, {"source": page.url, "filename": page.title or page.url, "chunk_index": i})
+        for i, (doc_id, text) in enumerate(zip(ids, page.chunks))
+    ]
+
+
+def vanished_pages(collection, pages: list[WebPage]) -> set[str]:
+    """URL страниц, чьих чанков нет в коллекции (например, после clear_collection.py)."""
+    first_ids = {p.chunk_ids[0]: p.url for p in pages if p.chunk_ids}
+    if not first_ids:
+        return set()
+    present = set(collection.get(ids=list(first_ids), include=[])["ids"])
+    return {url for chunk_id, url in first_ids.items() if chunk_id not in present}
+
+
+def index_pages(collection, pages: list[WebPage], cache_path: Path = WEB_CACHE_FILE,
+                embed_documents: Callable[[list[str]], list[list[float]]] | None = None) -> dict:
+    """Загружает в ChromaDB новые и изменённые страницы, удаляет убранные из списка.
+
+    Лексический индекс и индекс маршрутизации обновляются так же, как для файлов.
+    Возвращает статистику: страниц загружено / удалено, чанков векторизовано.
+    """
+    from services import indexer, lexical_index, routing_index
+    from services.embedding_cache import embed_with_cache, open_cache as open_embedding_cache
+    from services.embeddings import embeddings_cache_key
+
+    conn = open_cache(cache_path)
+    lexical_conn = indexer.open_lexical_index()
+    embedding_conn = open_embedding_cache(indexer.EMBEDDING_CACHE_FILE)
+    fetch_texts = lexical_index.chroma_text_fetcher(collection)
+    stats = {"indexed": 0, "removed": 0, "embedded": 0, "from_cache": 0}
+    try:
+        urls = {p.url for p in pages}
+        for url, stale in load_pages(conn).items():
+            if url not in urls:
+                log(f"Удаление (URL убран из списка): {url}")
+                indexer.delete_file_chunks(collection, url, stale.chunk_ids)
+                lexical_index.remove_source(lexical_conn, url)
+                indexer.remove_from_routing(url)
+                remove_page(conn, url)
+                stats["removed"] += 1
+
+        vanished = vanished_pages(collection, [p for p in pages if not p.needs_indexing])
+        for page in pages:
+            if not page.needs_indexing and page.url not in vanished:
+                continue
+            log(f"Загрузка страницы ({page.status}): {page.url}")
+            records = page_records(page)
+            old_ids = None if page.url in vanished else page.chunk_ids
+            fresh = indexer.diff_file_chunks(collection, page.url, records, old_ids)
+            if fresh:
+                ids, texts, metadatas = (list(col) for col in zip(*fresh))
+                embed = embed_documents or indexer.get_embeddings_model().embed_documents
+                vectors, hits = embed_with_cache(embedding_conn, embeddings_cache_key(), embed, texts)
+                indexer.upsert_batch(collection, ids, vectors, texts, metadatas)
+                stats["embedded"] += len(texts) - hits
+                stats["from_cache"] += hits
+
+            page.chunk_ids = [r[0] for r in records]
+            lexical_index.sync_file(lexical_conn, page.url, page.chunk_ids, fetch_texts)
+            if indexer.ROUTING_INDEX:
+                routing_index.sync_source(indexer.get_routing_collection(), collection, page.url)
+            save_page(conn, page)
+            stats["indexed"] += 1
+    finally:
+        if stats["indexed"] or stats["removed"]:
+            indexer.publish_index_version(collection)
+        conn.close()
+        lexical_conn.close()
+        embedding_conn.close()
+
+    log(f"В ChromaDB: страниц загружено {stats['indexed']}, удалено {stats['removed']}, "
+        f"чанков векторизовано {stats['embedded']}, из кэша эмбеддингов {stats['from_cache']}")
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Загрузка веб-документов с кэшем страниц")
+    parser.add_argument("--urls", nargs="+", default=None, help="URL вместо WEB_URLS")
+    parser.add_argument("--index", action="store_true", help="Загрузить изменённые страницы в ChromaDB")
+    args = parser.parse_args()
+
+    pages = refresh_pages(args.urls)
+    if args.index:
+        from services.indexer import get_chroma_collection
+        _, collection = get_chroma_collection()
+        index_pages(collection, pages)
+
+
+if __name__ == "__main__":
+    main()